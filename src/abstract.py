@@ -0,0 +1,331 @@
+import re
+from src.ast import AST, Node
+from src.interpreter import CONCRETE_SEM, literal as concrete_literal, type_of, EvalError
+from src.semantics import OPS, Semantics, matches_signature
+
+# Abstract semantics of the string/int DSL, a cheap pre-filter for CHECK-CONFLICT. A partial program is evaluated
+# bottom-up on an example, with every hole standing for any value of its type, into an abstract value per node:
+#   int  - an interval ('int', lo, hi), the bounds possibly infinite
+#   str  - ('str', lo, hi, prefix, suffix): an interval of lengths, and a prefix and a suffix the string is known to
+#          have. A string is known exactly when its prefix is as long as its largest length.
+#   bool - ('bool', the set of values it can take)
+# If the value of the root can't be the output of an example, the partial program conflicts with that example, and no
+# program it can be completed into satisfies the spec, so the solver needn't be called. E.g., `str.at` has a length of
+# at most 1, so a program whose root is `str.at` can't return a longer output.
+# Every operator over-approximates the SMT-LIB semantics (see `SEM` in src/semantics.py), so a conflict found here is
+# one that the solver would find too. The inputs whose declared type doesn't match their operator, and the operators
+# that Z3 sees as uninterpreted functions, are treated as `Semantics` treats them: as any value of their type.
+
+INF = float('inf')
+TOP = {
+    'int': ('int', -INF, INF),
+    'str': ('str', 0, INF, "", ""),
+    'bool': ('bool', frozenset([True, False])),
+}
+
+
+# The abstract value of a concrete value
+def exact(value):
+    if isinstance(value, bool):
+        return ('bool', frozenset([value]))
+    if isinstance(value, int):
+        return ('int', value, value)
+    return ('str', len(value), len(value), value, value)
+
+
+# The concrete value an abstract value stands for, if there is just one, or None
+def concrete(v):
+    if v[0] == 'int':
+        return v[1] if v[1] == v[2] else None
+    if v[0] == 'str':
+        return v[3] if v[2] == len(v[3]) else None
+    return next(iter(v[1])) if len(v[1]) == 1 else None
+
+
+def common_prefix(a: str, b: str) -> str:
+    n = 0
+    while n < min(len(a), len(b)) and a[n] == b[n]:
+        n += 1
+    return a[:n]
+
+
+def common_suffix(a: str, b: str) -> str:
+    return common_prefix(a[::-1], b[::-1])[::-1]
+
+
+# The least abstract value that covers both values (of the same type)
+def join(a, b):
+    if a[0] == 'int':
+        return ('int', min(a[1], b[1]), max(a[2], b[2]))
+    if a[0] == 'str':
+        return ('str', min(a[1], b[1]), max(a[2], b[2]), common_prefix(a[3], b[3]), common_suffix(a[4], b[4]))
+    return ('bool', a[1] | b[1])
+
+
+# Whether a concrete value is covered by an abstract value
+def covers(v, value) -> bool:
+    if v[0] == 'int':
+        return not isinstance(value, bool) and isinstance(value, int) and v[1] <= value <= v[2]
+    if v[0] == 'str':
+        return isinstance(value, str) and v[1] <= len(value) <= v[2] and value.startswith(v[3]) \
+            and value.endswith(v[4])
+    return value in v[1]
+
+
+def make_str(lo, hi, prefix: str = "", suffix: str = ""):
+    lo = max(lo, len(prefix), len(suffix), 0)
+    if hi < lo:  # Can't happen for a sound input; keep the value well-formed anyway
+        hi = lo
+    return ('str', lo, hi, prefix, suffix)
+
+
+def maybe(values) -> tuple:
+    return ('bool', frozenset(values))
+
+
+# The number of decimal digits of a non-negative integer
+def digits(n) -> float:
+    return INF if n == INF else len(str(int(n)))
+
+
+_NON_DIGIT = re.compile(r"[^0-9]")
+
+
+def a_concat(s, t):
+    prefix = s[3] + t[3] if concrete(s) is not None else s[3]
+    suffix = s[4] + t[4] if concrete(t) is not None else t[4]
+    return make_str(s[1] + t[1], s[2] + t[2], prefix, suffix)
+
+
+def a_replace(s, t, u):
+    if t[1] > s[2]:  # t is longer than s, so it doesn't occur in s (and isn't empty)
+        return s
+    lo = min(s[1], s[1] - t[2] + u[1])
+    hi = max(s[2], s[2] - t[1] + u[2])
+    return make_str(lo, hi)
+
+
+def a_at(s, i):
+    if s[2] == 0 or i[2] < 0 or i[1] >= s[2]:
+        return exact("")
+    return make_str(0, 1)
+
+
+def a_substr(s, i, n):
+    if n[2] <= 0 or i[2] < 0 or i[1] >= s[2]:
+        return exact("")
+    hi = min(s[2] - max(i[1], 0), n[2])
+    if i[1] == i[2] == 0 and n[1] >= 1:  # A prefix of s, s[:n]
+        k = min(n[1], s[1])
+        return make_str(k, hi, s[3][:n[1]])
+    return make_str(0, hi)
+
+
+def a_int_to_str(n):
+    if n[2] < 0:
+        return exact("")
+    lo = digits(n[1]) if n[1] >= 0 else 0
+    return make_str(lo, digits(n[2]))
+
+
+def a_str_to_int(s):
+    if s[2] == 0 or _NON_DIGIT.search(s[3]) or _NON_DIGIT.search(s[4]):
+        return exact(-1)
+    return ('int', -1, INF if s[2] == INF else 10 ** s[2] - 1)
+
+
+def a_indexof(s, t, i):
+    if t[1] > s[2] or i[2] < 0 or i[1] > s[2]:
+        return exact(-1)
+    return ('int', -1, max(-1, s[2] - t[1]))
+
+
+# Whether the known parts of two strings contradict each other being equal
+def str_differ(a, b) -> bool:
+    if a[2] < b[1] or b[2] < a[1]:
+        return True
+    n = min(len(a[3]), len(b[3]))
+    if a[3][:n] != b[3][:n]:
+        return True
+    n = min(len(a[4]), len(b[4]))
+    return n > 0 and a[4][-n:] != b[4][-n:]
+
+
+def a_eq(a, b):
+    if a[0] == 'int':
+        differ = a[2] < b[1] or b[2] < a[1]
+    elif a[0] == 'str':
+        differ = str_differ(a, b)
+    else:
+        differ = len(a[1] & b[1]) == 0
+    if differ:
+        return exact(False)
+    x, y = concrete(a), concrete(b)
+    if x is not None and y is not None:
+        return exact(x == y)
+    return TOP['bool']
+
+
+def a_prefixof(s, t):  # Whether s is a prefix of t
+    n = min(len(s[3]), len(t[3]))
+    if s[1] > t[2] or s[3][:n] != t[3][:n]:
+        return exact(False)
+    return TOP['bool']
+
+
+def a_suffixof(s, t):  # Whether s is a suffix of t
+    n = min(len(s[4]), len(t[4]))
+    if s[1] > t[2] or (n > 0 and s[4][-n:] != t[4][-n:]):
+        return exact(False)
+    return TOP['bool']
+
+
+def a_contains(s, t):  # Whether s contains t
+    if t[1] > s[2]:
+        return exact(False)
+    return TOP['bool']
+
+
+def a_compare(test):
+    # `test(lo1, hi1, lo2, hi2)` returns (whether it holds for sure, whether it fails for sure)
+    def compare(a, b):
+        (always, never) = test(a[1], a[2], b[1], b[2])
+        return exact(True) if always else exact(False) if never else TOP['bool']
+    return compare
+
+
+def a_ite(c, x, y):
+    if c[1] == frozenset([True]):
+        return x
+    if c[1] == frozenset([False]):
+        return y
+    return join(x, y)
+
+
+def a_and(a, b):
+    return maybe(x and y for x in a[1] for y in b[1])
+
+
+def a_or(a, b):
+    return maybe(x or y for x in a[1] for y in b[1])
+
+
+# Abstract semantics of every operator in `OPS`, over the abstract values of the inputs
+ABSTRACT_SEM = {
+    'str.++': a_concat,
+    'str.replace': a_replace,
+    'str.at': a_at,
+    'int.to.str': a_int_to_str,
+    'str.substr': a_substr,
+    'space': lambda: exact(" "),
+    '+': lambda a, b: ('int', a[1] + b[1], a[2] + b[2]),
+    '-': lambda a, b: ('int', a[1] - b[2], a[2] - b[1]),
+    'str.len': lambda s: ('int', s[1], s[2]),
+    'str.to.int': a_str_to_int,
+    'str.indexof': a_indexof,
+    'str.prefixof': a_prefixof,
+    'str.suffixof': a_suffixof,
+    'str.contains': a_contains,
+    'ite': a_ite,
+    '=': a_eq,
+    '<=': a_compare(lambda l1, h1, l2, h2: (h1 <= l2, l1 > h2)),
+    '>=': a_compare(lambda l1, h1, l2, h2: (l1 >= h2, h1 < l2)),
+    '<': a_compare(lambda l1, h1, l2, h2: (h1 < l2, l1 >= h2)),
+    '>': a_compare(lambda l1, h1, l2, h2: (l1 > h2, h1 <= l2)),
+    'and': a_and,
+    'or': a_or,
+    'not': lambda a: maybe(not x for x in a[1]),
+}
+assert ABSTRACT_SEM.keys() == OPS.keys()
+
+
+# The abstract semantics of a grammar. Like `Semantics`, it decides once per production how its operator is applied:
+#   'op'      - by `ABSTRACT_SEM`, on the values of the children
+#   'partial' - by `ABSTRACT_SEM`, with the children whose type doesn't match the operator's as any value
+#   'literal' - a terminal with no inputs: a constant, or an input of the synthesized function
+#   'top'     - anything of the production's type (an uninterpreted function)
+class AbstractSemantics:
+    def __init__(self, semantics: Semantics):
+        self.semantics = semantics
+        self.modes = {}  # Keyed by (non-terminal, terminal, child non-terminals)
+        for nt in semantics.prods:
+            for p in semantics.prods[nt]:
+                self.modes[(nt, p[0], tuple(p[1]))] = self.mode(nt, p)
+
+    def mode(self, nt: str, p):
+        op, child_nts = p[0], p[1]
+        ret_type = self.semantics.type_of(nt)
+        arg_types = tuple(self.semantics.type_of(c) for c in child_nts)
+        if matches_signature(op, ret_type, arg_types):
+            return 'op'
+        if op in OPS and len(OPS[op][1]) == len(arg_types) and 'a' not in OPS[op][1]:
+            return 'partial'
+        if len(child_nts) > 0 or op in OPS:
+            return 'top'
+        return 'literal'
+
+    def top(self, node: Node):
+        return TOP[self.semantics.type_of(node.non_terminal)]
+
+    # The abstract value of a filled node, from the values of its children
+    def apply(self, node: Node, env: dict, args: list):
+        op = node.terminal
+        mode = self.modes[(node.non_terminal, op, tuple(c.non_terminal for c in node.children))]
+        if mode == 'literal':
+            try:
+                value = concrete_literal(op, env)
+            except EvalError:
+                return self.top(node)
+            typ = self.semantics.type_of(node.non_terminal)
+            return exact(value) if type_of(value) == typ else TOP[typ]
+        if mode == 'top':
+            return self.top(node)
+        if mode == 'partial':
+            sig_types = OPS[op][1]
+            args = [a if a[0] == typ else TOP[typ] for (a, typ) in zip(args, sig_types)]
+        values = [concrete(a) for a in args]
+        if all(v is not None for v in values):  # Known inputs: the concrete semantics are exact
+            return exact(CONCRETE_SEM[op](*values))
+        return ABSTRACT_SEM[op](*args)
+
+    # The abstract value of a partial program on an example. Holes, and the nodes in `forgotten`, are any value.
+    def evaluate(self, program: AST, env: dict, forgotten=frozenset()):
+        values = {}
+        stack = [(program.root, False)]
+        while stack:
+            (v, visited) = stack.pop()
+            if v.is_hole() or v.id in forgotten:
+                values[v.id] = self.top(v)
+            elif visited:
+                values[v.id] = self.apply(v, env, [values.pop(c.id) for c in v.children])
+            else:
+                stack.append((v, True))
+                stack.extend((c, False) for c in v.children)
+        return values[program.root.id]
+
+    # Looks for an example that the partial program conflicts with. Returns None, or the example's position and the
+    # ids of the nodes to blame: the filled nodes that still give the conflict once the others are forgotten, top-down
+    # (forgetting a node forgets its whole sub-program).
+    def conflict(self, program: AST, examples: list):
+        for (i, (env, output)) in enumerate(examples):
+            if covers(self.evaluate(program, env), output):
+                continue
+            forgotten = set()
+            stack = list(reversed(program.root.children))
+            while stack:
+                v = stack.pop()
+                if v.is_hole():
+                    continue
+                forgotten.add(v.id)
+                if covers(self.evaluate(program, env, forgotten), output):
+                    forgotten.discard(v.id)
+                    stack.extend(reversed(v.children))
+            blamed = set()
+            stack = [program.root]
+            while stack:
+                v = stack.pop()
+                if not v.is_hole() and v.id not in forgotten:
+                    blamed.add(v.id)
+                    stack.extend(v.children)
+            return (i, blamed)
+        return None
@@ -1,5 +1,8 @@
 from z3 import *
-from src.ast import Node, AST
+from src.ast import Node, AST, label
+from src.lemma import Lemma
+from src.semantics import Semantics
+from src.spec import SpecContext
 
 
 
@@ -9,6 +12,65 @@ from src.ast import Node, AST
 # block the assignment, so that the algorithm doesn't make another "bad" choice.
 # This is very similar to CEGIS: In CEGIS, we add a counter example input to the knowledge base, but
 # here we add a *bad program assignment* to the knowledge base.
-def naive_analyze_conflict(ast: AST, kappa, h):
-    lemmas = [Not(Bool(f'c({t[2]}, {t[3]})')) for t in kappa if t[2] == h.id]
-    return lemmas
\ No newline at end of file
+def naive_analyze_conflict(ast: AST, kappa, h, ctx: SpecContext = None, semantics: Semantics = None):
+    lemmas = [Lemma({t[2]: {t[3]}}, local=True) for t in kappa if t[2] == h.id]
+    return lemmas
+
+
+# Blocks the exact combination of operators that conflicts with the spec, i.e., all the nodes of the unsat core at
+# once. It blocks fewer programs than `naive_analyze_conflict`, but it never blocks a program that could be valid.
+def core_analyze_conflict(ast: AST, kappa, h, ctx: SpecContext = None, semantics: Semantics = None):
+    blocked = {t[2]: {t[3]} for t in kappa}
+    if len(blocked) == 0:
+        return []
+    return [Lemma(blocked)]
+
+
+# The ANALYZE-CONFLICT routine of the paper. Starting from the nodes of the unsat core (kappa), it generalizes the
+# operator of each node to every operator whose semantics also gives the conflict, on the example the conflict was
+# found on, and returns a single lemma blocking all those combinations at once.
+# The lemma stands for the formula And([Or(formulas of the ops of n) for n in nodes]), which conflicts with the example
+# iff every combination of the operators does. Only one node's set of operators grows at a time, so adding an operator
+# to it keeps the whole lemma a conflict iff the formula of that operator alone, together with the (disjunctive)
+# formulas of the other nodes, is unsat. Each check is given `timeout` ms, or the time left before the deadline of
+# `ctx` if that is less; an operator whose check doesn't come back unsat in time is left out, which only makes the
+# lemma weaker.
+GENERALIZE_TIMEOUT = 100
+
+# Operators that can return any value of their type when their inputs are free. Such an operator can only conflict
+# through its inputs, so it is skipped when none of its inputs is a node of the conflict. (The solver often can't show
+# these checks are sat before the timeout anyway.)
+SURJECTIVE = {'str.++', 'str.replace', 'str.substr', '+', '-', 'ite'}
+
+
+def generalize_analyze_conflict(ast: AST, kappa, h, ctx: SpecContext, semantics: Semantics,
+                                timeout: int = GENERALIZE_TIMEOUT):
+    i = ctx.failed
+    if i is None:
+        return core_analyze_conflict(ast, kappa, h)
+    nodes = [ast.search(id) for id in sorted(set(t[2] for t in kappa))]
+    root_id = ast.root.id
+    ops = {n.id: {n.terminal} for n in nodes}
+
+    def node_formula(n, node_ops):
+        fmlas = [semantics.production_formula(n, p, n.id == root_id) for p in ast.prods[n.non_terminal]
+                 if p[0] in node_ops]
+        return fmlas[0] if len(fmlas) == 1 else Or(fmlas)
+
+    def free_inputs(n, op) -> bool:
+        k = n.k
+        for p in ast.prods[n.non_terminal]:
+            if p[0] == op:
+                child_ids = [label(k, n.d + 1, (n.i - 1) * k + j + 1) for j in range(len(p[1]))]
+                if any(c in ops for c in child_ids):
+                    return False
+        return True
+
+    for n in nodes:
+        others = [node_formula(m, ops[m.id]) for m in nodes if m is not n]
+        for op in dict.fromkeys(p[0] for p in ast.prods[n.non_terminal]):
+            if op in ops[n.id] or (op in SURJECTIVE and free_inputs(n, op)):
+                continue
+            if ctx.quick_check(i, others + [node_formula(n, {op})], timeout) == unsat:
+                ops[n.id].add(op)
+    return [Lemma(ops)]
@@ -1,5 +1,5 @@
 from z3 import *
-from typing import Union, Tuple, Set
+from typing import Union, Tuple, List
 
 
 
@@ -10,9 +10,34 @@ Terminal = Union[str, int, float]
 Production = Tuple[Terminal, str]
 
 
-# This Node class will represent a part of a program
+# Debugging helpers, shared by `Node` and `AST` and by their array-backed versions in src/compact_ast.py
+def print_node(node):
+    print(f"id: {node.id}")
+    print(f"depth: {node.d}")
+    print(f"num children: {node.num_children}")
+    print(f"non-terminal: {node.non_terminal}")
+    print(f"production applied: {node.terminal} -> {[c.non_terminal for c in node.children]}")
+
+
+def print_program(program):
+    print(program.to_program())
+
+
+# Prints the nodes of a program, breadth first
+def print_nodes(program):
+    stack = [program.root]
+    while stack:
+        v = stack.pop(0)
+        print_node(v)
+        stack.extend(v.children)
+
+
+# This Node class will represent a part of a program. Uses __slots__, since long searches create lots of nodes.
 class Node:
+    __slots__ = ('id', 'd', 'k', 'i', 'non_terminal', 'typ', 'terminal', 'children', 'num_children')
+
     def __init__(self, symbol: str, k: int = None, d: int = None, i: int = None):
+        self.id = None
         self.d = d
         self.k = k
         self.i = i
@@ -25,9 +50,8 @@ class Node:
             self.i = 0
 
         #self.id = label(k, d, i)    # We should probably do this during fill
-        # Just some aliases for the non-terminal
-        self.A = symbol
         self.non_terminal = symbol
+        self.typ = None  # SMT-LIB sort of the non-terminal, e.g., "String". Set by the AST.
 
         # Just some aliases for the terminal symbol/operator
         self.terminal = None
@@ -36,18 +60,18 @@ class Node:
         self.children = []
         self.num_children = 0
 
+    # Just an alias for the non-terminal
+    @property
+    def A(self) -> str:
+        return self.non_terminal
+
     # Checks if a given node is a hole or not. A node is a hole if it does not have a production rule applied.
     def is_hole(self) -> bool:
         if len(self.children) > 0 and self.terminal == None:
             raise ValueError('Node has children, but no production rule!')
         return self.terminal == None
 
-    def print(self):
-        print(f"id: {self.id}")
-        print(f"depth: {self.d}")
-        print(f"num children: {self.num_children}")
-        print(f"non-terminal: {self.non_terminal}")
-        print(f"production applied: {self.terminal} -> {[c.non_terminal for c in self.children]}")
+    print = print_node
 
     # Helper that applies a production rule to a node.
     def apply_prod(self, p: Production):
@@ -70,7 +94,9 @@ class Node:
 
 
 
-# Helper to label
+# Helper to label. Labels are positional: the i-th node at depth d of a complete k-ary tree gets label(k, d, i), and
+# the children of that node are the nodes (i-1)*k + 1, ..., (i-1)*k + k at depth d+1. So a label always refers to the
+# same position in the program, no matter in which order the holes were filled (or undone).
 def label(k: int, d:int, i: int) -> int:
     return (k ** (d - 1)) + i - 1
 
@@ -86,6 +112,7 @@ class AST:
         self.prods = grammar[2]
         self.rules = self.prods  # just an alias
         self.start_symbol = grammar[3]
+        self.types = grammar[4] if len(grammar) > 4 else {}  # Maps each non-terminal to its sort
         self.root = None
         self.arity = None
         self.root = None
@@ -93,6 +120,22 @@ class AST:
         # Maintain a dict of the number of nodes at a certain depth. Note: root node must start at depth 1
         self.num_at_depth = {}
 
+        # Index of the nodes by id, the open holes (a dict used as an ordered set, in the order they were created) and
+        # the operators applied so far. All three are kept up to date by `fill` and `undo`.
+        self.nodes = {}
+        self.open_holes = {}
+        self.assigned = {}
+
+        # Assignment trail, as in CDCL. Every fill pushes an entry (id, production, ids of the children created,
+        # (depth of the children, number of nodes added at that depth)), and trail_lim[l] is the length of the trail
+        # when decision level l+1 started. Backtracking pops entries, so there is no need to copy the program.
+        self.trail = []
+        self.trail_lim = []
+
+        # Objects that want to know about every fill and undo, e.g., the spec cache in `src/semantics.py`. They get
+        # `filled(program, node)` after a hole is filled and `undone(program, node)` after it becomes a hole again.
+        self.listeners = []
+
     # Computes the maximum arity of the grammar operators
     def max_arity(self) -> int:
         arities = []
@@ -102,35 +145,41 @@ class AST:
         return max(arities)
 
     def make_root(self) -> Node:
-        k: int = self.max_arity()
+        k: int = max(self.max_arity(), 2)  # Labels are only unique for k >= 2
         self.arity = k
         r: Node = Node(self.start_symbol)
         r.id = label(self.arity, 1, 1)
         r.d = 1
         r.k = k
         r.i = 1
+        r.typ = self.types.get(r.non_terminal)
         self.root = r
-        self.num_at_depth[1] = 1
+        self.num_at_depth = {1: 1}
+        self.nodes = {r.id: r}
+        self.open_holes = {r.id: None}
+        self.assigned = {}
+        self.trail = []
+        self.trail_lim = []
         return r
 
-    # Returns a set of holes (nodes) starting at the root or some given node
-    def holes(self, r : Node = None) -> Set[Node]:
+    # Returns the holes (nodes) of the program, or of the sub-program at some given node
+    def holes(self, r : Node = None) -> List[Node]:
         if r is None:
-            r = self.root
-        holes = set()
+            return [self.nodes[id] for id in self.open_holes]
+        holes = []
         stack = [r]
         while stack:
             v = stack.pop()
             if v.is_hole():
-                holes.add(v)
+                holes.append(v)
             for c in v.children:
                 stack.append(c)
         return holes
 
-    # DFS search for the tree, to find a node with the matching ID, initialized to root if not passed
+    # Finds the node with the matching ID, or None if there is no such node (under `r`, if it is passed)
     def search(self, id: int, r: Node = None) -> Node:
         if r is None:
-            r = self.root
+            return self.nodes.get(id)
         stack = [r]
         while stack:
             v = stack.pop()
@@ -140,51 +189,75 @@ class AST:
                 for c in v.children:
                     stack.append(c)
 
-    # Helper to fill a given hole with a given production
-    def fill(self, node: Node, id: int, p: Production):
-        if node.id == id:
-            node = node.apply_prod(p)
-
-            # Update the labels of the children nodes, making sure each node has a unique label
-            # Also update the number of ndoes at depth d+1, after the production is applied
-            d: int = node.d
-            k: int = node.k
-            if d+1 not in self.num_at_depth.keys():  # Create a new mapping
-                self.num_at_depth[d+1] = node.num_children
-                labeled_children = []
-                if node.num_children > 0:
-                    for (i, c) in enumerate(node.children):
-                        c.id = label(k, d+1, i+1)
-                        c.d = d+1
-                        c.k = k
-                        c.i = i+1
-                        labeled_children.append(c)
-
-            else:
-                m: int = self.num_at_depth[d+1]
-                self.num_at_depth[d+1] += node.num_children
-                labeled_children = []
-                if node.num_children > 0:
-                    for (i, c) in enumerate(node.children):
-                        c.id = label(k, d+1, i+m+1)
-                        c.d = d+1
-                        c.k = k
-                        labeled_children.append(c)
-
-            node.children = labeled_children
-            return node
-        elif node.num_children == 0:
-            return node
-        else:
-            new_children = [self.fill(c, id, p) for c in node.children]
-            node.children = new_children
-
-            return node
+    # Fills the hole with the given id with a given production. Only touches the node and its new children.
+    def fill(self, id: int, p: Production) -> Node:
+        node = self.nodes[id]
+        if not node.is_hole():
+            raise ValueError(f"Node {id} is not a hole")
+        node = node.apply_prod(p)
+
+        # Label the children nodes by their position, and update the number of nodes at depth d+1
+        d: int = node.d
+        k: int = node.k
+        self.num_at_depth[d+1] = self.num_at_depth.get(d+1, 0) + node.num_children
+        for (i, c) in enumerate(node.children):
+            c.d = d+1
+            c.k = k
+            c.i = (node.i - 1) * k + i + 1
+            c.id = label(k, c.d, c.i)
+            c.typ = self.types.get(c.non_terminal)
+            self.nodes[c.id] = c
+            self.open_holes[c.id] = None
+
+        del self.open_holes[id]
+        self.assigned[id] = node.terminal
+        self.trail.append((id, p, [c.id for c in node.children], (d+1, node.num_children)))
+        for listener in self.listeners:
+            listener.filled(self, node)
+        return node
+
+    # Starts a new decision level, and returns it
+    def new_level(self) -> int:
+        self.trail_lim.append(len(self.trail))
+        return len(self.trail_lim)
+
+    def decision_level(self) -> int:
+        return len(self.trail_lim)
+
+    # Undoes the most recent fill on the trail, and returns the node that became a hole again
+    def undo_last(self) -> Node:
+        (id, p, child_ids, (depth, n)) = self.trail.pop()
+        node = self.nodes[id]
+        for c_id in child_ids:
+            del self.nodes[c_id]
+            del self.open_holes[c_id]
+        self.num_at_depth[depth] -= n
+
+        node.terminal = None
+        node.children = []
+        node.num_children = 0
+        self.open_holes[id] = None
+        del self.assigned[id]
+        for listener in self.listeners:
+            listener.undone(self, node)
+        return node
+
+    # Undoes every fill made after decision level `level`, so that level becomes the current one
+    def backtrack(self, level: int):
+        if level < self.decision_level():
+            while len(self.trail) > self.trail_lim[level]:
+                self.undo_last()
+            del self.trail_lim[level:]
+
+    # Reverts `fill` on the node with the given id, which must be the most recent fill on the trail
+    def undo(self, id: int) -> Node:
+        if len(self.trail) == 0 or self.trail[-1][0] != id:
+            raise ValueError(f"Node {id} is not the most recent fill")
+        return self.undo_last()
 
     # Checks if a program has all its holes filled, and is thus a full program
     def is_concrete(self):
-        holes = self.holes()
-        return len(holes) == 0
+        return len(self.open_holes) == 0
 
     # Returns the partial program as a SAT formula that is compatible with python's Z3 API
     def encode(self):
@@ -202,6 +275,11 @@ class AST:
 
 
 
+    # Returns the operators applied so far, as a dict from node id to terminal. This is the assignment the encoding
+    # makes true.
+    def assignment(self) -> dict:
+        return self.assigned
+
     # converts the AST to an S-expression representing a program
     def to_program(self, r: Node = None):
         if r is None:
@@ -218,23 +296,8 @@ class AST:
                 children.append(p)
             return [r.terminal, children]
 
-
-
-
-    # Can work on this more later
-    def print_program(self):
-        program = self.to_program()
-        #print(p)
-        print(program)
-
-
-    def print_nodes(self):
-        stack = [self.root]
-        while stack:
-            v = stack.pop(0)
-            v.print()
-            for c in v.children:
-                stack.append(c)
+    print_program = print_program
+    print_nodes = print_nodes
 
 
 
@@ -0,0 +1,389 @@
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import resource
+import sys
+import time
+from src.cache import load_problem
+from src.main import solve, ENGINES, LEMMA_POLICIES, PROGRAMS, RESTARTS
+from src.model import load as load_model
+from src.profiling import Profiler, profile_prefix
+from src.stats import Stats
+
+# Benchmark harness. Runs a search engine (--engine) on a set of .sl files under a wall-clock and an iteration budget,
+# and records for each file whether it was solved, the time, rounds, solver calls, lemmas learned and peak RSS. Results
+# are printed as a table and can be written as JSON or CSV. With --baseline, the results are compared against a stored
+# JSON run and regressions are flagged (the exit status is 1 if there are any).
+#
+# Usage:
+#   python -m src.bench small --time 10 --iters 50 --json results.json
+#   python -m src.bench 'phone-*' --baseline results.json
+#   python -m src.bench src/examples/example5.sl
+#   python -m src.bench all -j 16 --mem-mb 2048 --csv sweep.csv
+#
+# A target is a category (see CATEGORIES), a file, or a glob (matched against the bundled suite if it isn't a path).
+# The runs are spread over a pool of worker processes (-j, one per core by default), each with an optional memory cap
+# (--mem-mb). A run that overshoots its wall-clock budget (e.g., inside one long solver call) has its worker killed.
+
+BENCH_DIR = os.path.join(os.path.dirname(__file__), "benchmarks", "PBE_Strings_2018_comp")
+CATEGORIES = ["small", "short", "base", "long", "long-repeat"]
+FIELDS = ["file", "category", "status", "solved", "time", "rounds", "solver_calls", "lemmas", "conflicts",
+          "peak_rss_kb", "phases", "profile", "program", "error"]
+GRACE = 5.0  # Seconds past the budget before a run is killed
+
+
+# The category of a benchmark, from its file name: name_small.sl, name_short.sl, name.sl, name-long.sl and
+# name-long-repeat.sl
+def category(filename: str) -> str:
+    name = os.path.basename(filename)
+    if name.endswith("-long-repeat.sl"):
+        return "long-repeat"
+    if name.endswith("-long.sl"):
+        return "long"
+    if name.endswith("_small.sl"):
+        return "small"
+    if name.endswith("_short.sl"):
+        return "short"
+    return "base"
+
+
+# Expands the targets given on the command line into a sorted list of files, without duplicates
+def resolve(targets: list) -> list:
+    files = []
+    for t in targets:
+        if t in CATEGORIES or t == "all":
+            matched = [f for f in glob.glob(os.path.join(BENCH_DIR, "*.sl")) if t == "all" or category(f) == t]
+        elif os.path.isfile(t):
+            matched = [t]
+        else:
+            matched = glob.glob(t) or glob.glob(os.path.join(BENCH_DIR, t))
+            matched = matched or glob.glob(os.path.join(BENCH_DIR, t + ".sl"))
+        if len(matched) == 0:
+            raise ValueError(f"No benchmark matches {t!r}")
+        files.extend(sorted(matched))
+    return list(dict.fromkeys(files))
+
+
+# The peak RSS of this process, in KB. On Linux this is VmHWM, which `reset_peak_rss` can reset between jobs, so a
+# long-lived worker reports the peak of each job. Elsewhere it is the peak over the life of the process.
+def peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def empty_result(filename: str) -> dict:
+    result = {f: None for f in FIELDS}
+    result["file"] = os.path.basename(filename)
+    result["category"] = category(filename)
+    result["solved"] = False
+    return result
+
+
+# Runs one benchmark in the current process and returns its result record. `options` are the keyword arguments of
+# `solve`, except that 'model' is the file name of a model. With `profile_dir`, the run is profiled (see
+# src/profiling.py), the profiles are written there, and their summary is added to the record.
+# The budget covers loading the problem too: the search gets what is left of it, and stops its solver calls at the
+# deadline (see `SpecContext.set_deadline`). A run that still ends `GRACE` seconds past its budget is reported as a
+# timeout, as `run_batch` reports the runs whose worker it kills, so that in-process results compare with pooled ones.
+def run_one(filename: str, max_iter: int, time_limit: float, verbose: bool = False, options: dict = None,
+            profile_dir: str = None) -> dict:
+    result = empty_result(filename)
+    stats = Stats()
+    stdout = sys.stdout
+    devnull = None
+    if not verbose:
+        devnull = open(os.devnull, "w")
+        sys.stdout = devnull
+    profiler = Profiler() if profile_dir is not None else contextlib.nullcontext()
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        with profiler:
+            grammar, spec = load_problem(filename)
+            options = dict(options or {})
+            if options.get("model") is not None:
+                options["model"] = load_model(options["model"])
+            left = None if time_limit is None else max(0.0, start + time_limit - time.perf_counter())
+            program = solve(grammar, spec, max_iter=max_iter, time_limit=left, stats=stats, **options)
+        result["program"] = str(program)
+        result["status"] = stats.status
+    except Exception as e:  # Includes MemoryError when the worker hits its memory cap
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        sys.stdout = stdout
+        if devnull is not None:
+            devnull.close()
+    if profile_dir is not None and profiler.cpu is not None:
+        result["profile"] = profiler.write(profile_prefix(profile_dir, filename), filename)
+    result["time"] = round(time.perf_counter() - start, 4)
+    if time_limit is not None and result["time"] > time_limit + GRACE:
+        result["status"] = "timeout"
+    result["solved"] = result["status"] == "solved"
+    result["rounds"] = stats.rounds
+    result["solver_calls"] = stats.solver_calls
+    result["lemmas"] = stats.lemmas
+    result["conflicts"] = stats.conflicts
+    result["phases"] = {p: round(t, 4) for (p, t) in stats.phase_time.items()}  # Seconds per phase
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+# The loop of a worker process. Workers live for the whole batch (so Z3 and the python modules stay loaded and warm)
+# and run one file at a time, sent over `conn`, until they get None.
+def worker_loop(conn, max_iter, time_limit, mem_limit_mb, verbose, options, profile_dir):
+    if mem_limit_mb is not None:
+        limit = mem_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        filename = conn.recv()
+        if filename is None:
+            break
+        conn.send(run_one(filename, max_iter, time_limit, verbose, options, profile_dir))
+    conn.close()
+
+
+# A worker process, and the job it is running (if any)
+class Worker:
+    def __init__(self, ctx, args):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_loop, args=(child_conn,) + args, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job = None
+        self.started = None
+
+    def submit(self, filename: str):
+        self.job = filename
+        self.started = time.perf_counter()
+        self.conn.send(filename)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+# Runs the benchmarks on a pool of `jobs` worker processes, and yields each result as soon as it is done (so not in
+# the order of `files`). A job that runs `GRACE` seconds past its wall-clock budget has its worker killed and replaced,
+# and is reported as a timeout. With `mem_limit_mb`, each worker's address space is capped (RLIMIT_AS), so a runaway
+# search fails with a MemoryError (or its worker dies) instead of taking the machine down.
+def run_batch(files: list, max_iter: int, time_limit: float, jobs: int = 1, mem_limit_mb: int = None,
+              verbose: bool = False, options: dict = None, profile_dir: str = None):
+    ctx = multiprocessing.get_context("fork")
+    args = (max_iter, time_limit, mem_limit_mb, verbose, options, profile_dir)
+    pending = list(reversed(files))
+    workers = [Worker(ctx, args) for _ in range(max(1, min(jobs, len(files))))]
+    try:
+        for w in workers:
+            if pending:
+                w.submit(pending.pop())
+        while True:
+            busy = [w for w in workers if w.job is not None]
+            if len(busy) == 0:
+                break
+            timeout = None
+            if time_limit is not None:
+                timeout = max(0.0, min(w.started for w in busy) + time_limit + GRACE - time.perf_counter())
+            ready = multiprocessing.connection.wait([w.conn for w in busy], timeout)
+            now = time.perf_counter()
+            for w in busy:
+                if w.conn in ready:
+                    try:
+                        result = w.conn.recv()
+                    except (EOFError, OSError):  # The worker died, e.g., Z3 aborted when it ran out of memory
+                        w.process.join()
+                        result = empty_result(w.job)
+                        result["status"] = "error"
+                        result["error"] = f"worker died (exit code {w.process.exitcode})"
+                        result["time"] = round(now - w.started, 4)
+                        w = replace(workers, w, Worker(ctx, args))
+                elif time_limit is not None and now > w.started + time_limit + GRACE:
+                    result = empty_result(w.job)
+                    result["status"] = "timeout"
+                    result["time"] = round(now - w.started, 4)
+                    w.kill()
+                    w = replace(workers, w, Worker(ctx, args))
+                else:
+                    continue
+                w.job = None
+                if pending:
+                    w.submit(pending.pop())
+                yield result
+    finally:
+        for w in workers:
+            if w.job is None:
+                w.stop()
+            else:
+                w.kill()
+
+
+def replace(workers: list, old: Worker, new: Worker) -> Worker:
+    workers[workers.index(old)] = new
+    return new
+
+
+def write_json(results: list, filename: str):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=1)
+
+
+def write_csv(results: list, filename: str):
+    with open(filename, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=FIELDS)
+        w.writeheader()
+        for r in results:
+            w.writerow(dict(r, phases=json.dumps(r["phases"]), profile=json.dumps(r["profile"])))
+
+
+def print_table(results: list):
+    print(f"{'file':40} {'status':9} {'time':>8} {'rounds':>7} {'calls':>7} {'lemmas':>7} {'rss(MB)':>8}")
+    for r in results:
+        rss = "" if r["peak_rss_kb"] is None else f"{r['peak_rss_kb'] / 1024:.1f}"
+        print(f"{r['file']:40} {r['status']:9} {r['time']:8.2f} {r['rounds'] or 0:7} {r['solver_calls'] or 0:7} "
+              f"{r['lemmas'] or 0:7} {rss:>8}")
+    solved = sum(1 for r in results if r["solved"])
+    total = sum(r["time"] for r in results)
+    print(f"solved {solved}/{len(results)} in {total:.2f}s")
+
+
+# Compares results against a baseline run. A benchmark regressed if it was solved before and isn't now, or if it got
+# slower by more than `tolerance` (relative) and `min_delta` seconds. Returns a list of (file, reason) for the
+# regressions, and prints them along with the improvements.
+def compare(results: list, baseline: list, tolerance: float = 0.2, min_delta: float = 0.1) -> list:
+    base = {r["file"]: r for r in baseline}
+    regressions = []
+    improvements = []
+    for r in results:
+        b = base.get(r["file"])
+        if b is None:
+            continue
+        if b["solved"] and not r["solved"]:
+            regressions.append((r["file"], f"no longer solved ({r['status']})"))
+        elif r["solved"] and not b["solved"]:
+            improvements.append((r["file"], f"now solved (was {b['status']})"))
+        elif r["solved"] and b["solved"]:
+            if r["time"] > b["time"] * (1 + tolerance) and r["time"] - b["time"] > min_delta:
+                regressions.append((r["file"], f"slower: {b['time']:.2f}s -> {r['time']:.2f}s"))
+            elif b["time"] > r["time"] * (1 + tolerance) and b["time"] - r["time"] > min_delta:
+                improvements.append((r["file"], f"faster: {b['time']:.2f}s -> {r['time']:.2f}s"))
+    for (f, why) in improvements:
+        print(f"  improved   {f}: {why}")
+    for (f, why) in regressions:
+        print(f"  REGRESSED  {f}: {why}")
+    print(f"{len(regressions)} regressions, {len(improvements)} improvements against the baseline")
+    return regressions
+
+
+# Where the time of each profiled run went, Z3 against python. The per-file profiles are in `directory`.
+def print_profiles(results: list, directory: str):
+    print(f"\n{'file':<40} {'profiled':>9} {'z3':>8} {'python':>8} {'z3 %':>6} {'alloc(MB)':>10}")
+    for r in results:
+        p = r.get("profile")
+        if p is None:
+            print(f"{r['file']:<40} {'(no profile, the run was killed)':>45}")
+            continue
+        share = p["z3"] / p["profiled"] if p["profiled"] > 0 else 0.0
+        print(f"{r['file']:<40} {p['profiled']:>9.2f} {p['z3']:>8.2f} {p['python']:>8.2f} {share:>6.1%} "
+              f"{p['peak_alloc_kb'] / 1024:>10.1f}")
+    print(f"Profiles written to {directory}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the synthesizer on a set of benchmarks")
+    parser.add_argument("targets", nargs="*", default=["all"],
+                        help=f"files, globs, or categories ({', '.join(CATEGORIES)}, all)")
+    parser.add_argument("--time", type=float, default=10.0, help="wall-clock budget per benchmark, in seconds")
+    parser.add_argument("--iters", type=int, default=100, help="iteration budget per benchmark")
+    parser.add_argument("--engine", choices=ENGINES, default='cdps', help="the search engine")
+    parser.add_argument("--ast", choices=list(PROGRAMS), default='tree', help="how the cdps engine stores the program")
+    parser.add_argument("--model", help="a model trained with src/model.py, to guide DECIDE")
+    parser.add_argument("--lemma-policy", choices=list(LEMMA_POLICIES), default='decision',
+                        help="how conflicts are turned into lemmas")
+    parser.add_argument("--restarts", choices=list(RESTARTS), default='none', help="the restart policy")
+    parser.add_argument("--backjump", action="store_true", help="backjump to the level the lemmas implicate")
+    parser.add_argument("--no-cegis", action="store_true", help="check every conflict against all the examples")
+    parser.add_argument("--batch", type=int, default=0, metavar="N",
+                        help="check all the examples in one query, split over N threads (0: one example at a time)")
+    parser.add_argument("--no-abstract", action="store_true",
+                        help="call the solver on every partial program, without the abstract pre-filter")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--csv", help="write the results to this CSV file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown that counts as a regression")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--mem-mb", type=int, help="address space cap per worker, in MB")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run the benchmarks in this process (no isolation, but the same budget)")
+    parser.add_argument("--profile", metavar="DIR", help="profile each run, and write the profiles to DIR")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the synthesizer's output")
+    args = parser.parse_args(argv)
+
+    try:
+        files = resolve(args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+    options = {"engine": args.engine}
+    if args.engine == 'cdps':
+        options.update(program_cls=PROGRAMS[args.ast], model=args.model, lemma_policy=args.lemma_policy,
+                       restarts=args.restarts, backjump=args.backjump, cegis=not args.no_cegis,
+                       batch=args.batch, abstract=not args.no_abstract)
+    if args.in_process:
+        runs = (run_one(f, args.iters, args.time, args.verbose, options, args.profile) for f in files)
+    else:
+        runs = run_batch(files, args.iters, args.time, args.jobs, args.mem_mb, args.verbose, options, args.profile)
+    results = []
+    for r in runs:  # Streamed as each run finishes
+        results.append(r)
+        print(f"{r['file']}: {r['status']} in {r['time']:.2f}s" + (f" ({r['error']})" if r["error"] else ""),
+              file=sys.stderr)
+    order = {os.path.basename(f): i for (i, f) in enumerate(files)}
+    results.sort(key=lambda r: order[r["file"]])
+
+    print_table(results)
+    if args.profile:
+        print_profiles(results, args.profile)
+    if args.json:
+        write_json(results, args.json)
+    if args.csv:
+        write_csv(results, args.csv)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import itertools
+import time
+from src.interpreter import EvalError, CONCRETE_SEM, apply_op, literal
+from src.semantics import OPS
+from src.spec import Spec
+from src.stats import Stats
+
+# A bottom-up enumerative engine, as an alternative to the conflict-driven search in `synthesize`. It builds programs
+# by size (number of nodes), smallest first, from the programs already built for the child non-terminals. Every new
+# program is run on all the examples at once, and it is only kept if its vector of outputs is new for its
+# non-terminal (observational equivalence): two programs with the same outputs on every example can be swapped
+# anywhere without changing what the bigger programs compute, so only the smallest one is needed.
+#
+# It works on the same grammar tuple and Spec as `synthesize`, and returns the program as an S-expression in the
+# format of `AST.to_program`, e.g., ['str.++', ['fname', ['str.++', ['" "', 'lname']]]].
+
+
+# Applies an operator to vectors of inputs, one value per example. The types are checked on the first example only,
+# since every value in a vector comes from the same program and has the same type.
+def apply_vec(op, arg_vecs: list, n: int) -> tuple:
+    if len(arg_vecs) == 0:
+        return (apply_op(op, []),) * n
+    apply_op(op, [v[0] for v in arg_vecs])  # Raises EvalError on a type mismatch
+    f = CONCRETE_SEM[op]
+    return tuple(f(*args) for args in zip(*arg_vecs))
+
+
+# The vector of values of a terminal with no inputs
+def leaf_vec(op, envs: list) -> tuple:
+    if op in OPS:  # nullary operators, e.g., `space`
+        return apply_vec(op, [], len(envs))
+    return tuple(literal(op, env) for env in envs)
+
+
+# All the ways to split `total` into `parts` sizes of at least 1
+def compositions(total: int, parts: int):
+    if parts == 1:
+        if total >= 1:
+            yield (total,)
+        return
+    for first in range(1, total - parts + 2):
+        for rest in compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+
+# Enumerates programs of the grammar by size, up to `max_size` nodes, until one matches every example. Returns the
+# program as an S-expression, or None if the budgets run out first. If a `Stats` object is passed, it is filled in;
+# `rounds` counts the candidate programs that were evaluated.
+def bottom_up(grammar, spec: Spec, max_size: int = 20, time_limit: float = None, max_bank: int = 1000000,
+              stats: Stats = None):
+    if stats is None:
+        stats = Stats()
+    start = time.perf_counter()
+    deadline = None if time_limit is None else start + time_limit
+    prods = grammar[2]
+    start_symbol = grammar[3]
+    envs = [ex[0] for ex in spec.examples]
+    target = tuple(ex[1] for ex in spec.examples)
+    n = len(envs)
+
+    # bank[nt][size] is the list of (values, program) kept for a non-terminal and a size. `seen[nt]` indexes the value
+    # vectors of all the programs kept for nt, of any size.
+    bank = {nt: {} for nt in prods}
+    seen = {nt: set() for nt in prods}
+    kept = 0
+    candidates = 0
+    stats.status = "max_iter"
+
+    for size in range(1, max_size + 1):
+        for nt in prods:
+            new = bank[nt].setdefault(size, [])
+            for (op, kids) in prods[nt]:
+                if len(kids) == 0:
+                    combos = [()] if size == 1 else []
+                else:
+                    combos = combinations(bank, kids, size - 1)
+                for combo in combos:
+                    candidates += 1
+                    if deadline is not None and candidates % 1024 == 0 and time.perf_counter() > deadline:
+                        stats.status = "timeout"
+                        return finish(stats, None, candidates, start)
+                    try:
+                        if len(kids) == 0:
+                            values = leaf_vec(op, envs)
+                        else:
+                            values = apply_vec(op, [c[0] for c in combo], n)
+                    except EvalError:  # e.g., the children's types don't fit the operator
+                        continue
+                    if values in seen[nt]:
+                        continue
+                    program = op if len(kids) == 0 else [op, [c[1] for c in combo]]
+                    if nt == start_symbol and values == target:
+                        stats.status = "solved"
+                        return finish(stats, program, candidates, start)
+                    seen[nt].add(values)
+                    new.append((values, program))
+                    kept += 1
+                    if kept >= max_bank:
+                        return finish(stats, None, candidates, start)
+    return finish(stats, None, candidates, start)
+
+
+# The combinations of kept programs for the children of a production, with sizes adding up to `total`
+def combinations(bank: dict, kids: list, total: int):
+    for sizes in compositions(total, len(kids)):
+        lists = [bank[c].get(s, []) for (c, s) in zip(kids, sizes)]
+        if all(lists):
+            yield from itertools.product(*lists)
+
+
+def finish(stats: Stats, program, candidates: int, start: float):
+    stats.rounds = candidates
+    stats.time = time.perf_counter() - start
+    return program
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import pickle
+import re
+import time
+from src.parser import read_problem
+from src.spec import Spec, example_key
+
+# An on-disk cache of parsed problems. An entry holds the grammar tuple, and the signature and examples of the spec,
+# pickled together. Entries are keyed by the sha256 of the .sl file's content and by FORMAT_VERSION, so an edited file
+# or a change to the entry layout is just a cache miss.
+# Bump FORMAT_VERSION whenever the grammar tuple or the Spec changes.
+FORMAT_VERSION = 4
+MAX_ENTRIES = 1024  # The least recently used entries past this are evicted
+
+# The cache lives in $SYNTH_CACHE_DIR, or ~/.cache/cdps by default. Setting SYNTH_CACHE_DIR to an empty string turns
+# the cache off.
+def cache_dir():
+    path = os.environ.get("SYNTH_CACHE_DIR")
+    if path is None:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "cdps")
+    return path
+
+
+def entry_name(digest: str) -> str:
+    return f"{digest}.v{FORMAT_VERSION}.pickle"
+
+
+# The names of the files the cache writes: entries, of any format version, and the temporary files they are written
+# through (`<entry name>.<pid>.tmp`). SYNTH_CACHE_DIR can be any directory, so no other file in it is ever touched.
+CACHE_FILE = re.compile(r"[0-9a-f]{64}\.v(\d+)\.pickle(?:\.(\d+)\.tmp)?")
+
+# Seconds after which a temporary file is left over from a write that failed, even if its pid is running (the pid may
+# have been reused, or belong to another machine sharing the directory). Writing an entry takes milliseconds.
+STALE_TMP = 60.0
+
+
+# Tries to read an entry. Returns None on a miss, or if the entry can't be read (e.g., it was written by an older
+# version, or a concurrent run is replacing it).
+def read_entry(path: str):
+    try:
+        with open(path, "rb") as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get("version") != FORMAT_VERSION:
+        return None
+    try:
+        os.utime(path)  # Mark the entry as recently used
+    except OSError:
+        pass
+    return entry
+
+
+# Writes an entry atomically, so concurrent runs never see half an entry, then evicts stale entries
+def write_entry(directory: str, path: str, entry: dict):
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        return  # The cache is only an optimization
+    evict(directory)
+
+
+# Removes entries of other format versions, left-over temporary files, and the least recently used entries past
+# MAX_ENTRIES. Only called after a miss, so a warm run never lists the directory. A temporary file is only left over if
+# the process that writes it is gone, or it is old (see STALE_TMP): other runs (e.g., the workers of a parallel bench)
+# write their entries through one at the same time.
+def evict(directory: str):
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        m = CACHE_FILE.fullmatch(name)
+        if m is None:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if m.group(2) is not None:
+                if not is_running(int(m.group(2))) or time.time() - os.stat(path).st_mtime > STALE_TMP:
+                    os.remove(path)
+                continue
+            if int(m.group(1)) != FORMAT_VERSION:
+                os.remove(path)
+                continue
+            entries.append((os.stat(path).st_mtime, path))
+        except OSError:
+            continue
+    entries.sort()
+    for (_, path) in entries[:max(0, len(entries) - MAX_ENTRIES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # E.g., it belongs to another user
+        pass
+    return True
+
+
+# Builds a cache entry from the text of a .sl file
+def make_entry(source: str) -> dict:
+    grammar, spec = read_problem(source)
+    return {
+        "version": FORMAT_VERSION,
+        "grammar": grammar,
+        "signature": (spec.func_name, spec.params, spec.ret_type),
+        "examples": spec.examples,
+        "repeats": spec.repeats,
+    }
+
+
+def from_entry(entry: dict):
+    spec = Spec(*entry["signature"])
+    spec.examples = entry["examples"]
+    spec.index = {example_key(ex): i for (i, ex) in enumerate(spec.examples)}
+    spec.repeats = entry["repeats"]
+    return entry["grammar"], spec
+
+
+# Reads the problem in a .sl file, like `read_problem`, going through the cache. Returns the grammar and the Spec.
+def load_problem(filename: str, directory: str = None):
+    with open(filename, "rb") as f:
+        data = f.read()
+    return load_source(data.decode("utf-8"), directory)
+
+
+# Reads a problem from the text of a .sl file, going through the cache
+def load_source(source: str, directory: str = None):
+    if directory is None:
+        directory = cache_dir()
+    if not directory:
+        return read_problem(source)
+
+    path = os.path.join(directory, entry_name(source_digest(source)))
+    entry = read_entry(path)
+    if entry is None:
+        entry = make_entry(source)
+        write_entry(directory, path, entry)
+    return from_entry(entry)
+
+
+# The key of a problem's text in the cache
+def source_digest(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
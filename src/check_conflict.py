@@ -1,62 +1,171 @@
+import time
 from z3 import *
+from src.abstract import AbstractSemantics
 from src.ast import Node, AST, label
-from src.semantics import infer_spec
-
-# dummy tests on the following constraints:
-#(constraint (= (f "Nancy" "FreeHafer") "Nancy FreeHafer"))
-#(constraint (= (f "Andrew" "Cencici") "Andrew Cencici"))
-#(constraint (= (f "Jan" "Kotas") "Jan Kotas"))
-#(constraint (= (f "Mariya" "Sergienko") "Mariya Sergienko"))
-
-
-
-def check_conflict(program : AST):
-    spec_tups = infer_spec(program)  # Gets the program spec. \Phi_P in the paper
-    #print("inferred spec of partial program:")
-    #print(spec_tups)
-
-    io1 = [String('fname') == StringVal('Nancy'),
-           String('lname') == StringVal('FreeHafer'),
-           String('ret_val') == StringVal('Nancy FreeHafer')]
-
-    io2 = [String('fname') == StringVal('Andrew'),
-             String('lname') == StringVal('Cencici'),
-           String('ret_val') == StringVal('Andrew Cencici')]
-
-    io3 = [String('fname') == StringVal('Jan'),
-             String('lname') == StringVal('Kotas'),
-           String('ret_val') == StringVal('Jan Kotas')]
-
-    io4 = [String('fname') == StringVal('Mariya'),
-             String('lname') == StringVal('Sergienko'),
-           String('ret_val') == StringVal('Mariya Sergienko')]
-
-    spec_p = [tup[0] for tup in spec_tups]
-    spec = [io1, io2, io2, io4]
-    #cores = []
-    s = Solver()
-    cores = s.unsat_core()
-    for io_ex in spec:
-        s.push()
-        s.add(io_ex)
-        result = s.check(spec_p)
-        if result == unsat:
-            cores = s.unsat_core()
-            s.pop()
-            break
-        else:
-            s.pop()
-            continue
-    if len(cores) == 0:
-        print("Partial program is feasible.")
+from src.semantics import SpecCache
+from src.interpreter import EvalError, evaluate, complete_subtrees
+from src.spec import SpecContext, to_z3_val
+from src.stats import Stats
+
+# Evaluates the complete sub-programs of a partial program on the examples. Each one can then be replaced by a single
+# equality `v<id> == value` per example, so Z3 only has to reason about the part of the program that still has holes.
+# Returns a map from the id of a sub-program's root to (the root, its values on the examples, the ids of its nodes).
+def concrete_subtrees(program: AST, examples):
+    envs = [ex[0] for ex in examples]
+    subtrees = {}
+    for r in complete_subtrees(program):
+        try:
+            values = evaluate(r, envs)
+        except EvalError:
+            continue  # Leave it to Z3
+        ids = set()
+        stack = [r]
+        while stack:
+            v = stack.pop()
+            ids.add(v.id)
+            stack.extend(v.children)
+        subtrees[r.id] = (r, values, ids)
+    return subtrees
+
+
+# `spec` keeps the program spec (\Phi_P in the paper) in sync with the program, see `SpecCache`
+# Partial programs found to be feasible are remembered in `ctx.feasible`, so the search can come back to one (e.g.,
+# after backjumping or a restart) without calling the solver again. A check that comes back unknown (e.g., out of time)
+# finds no conflict, but sets `ctx.inconclusive` and isn't remembered, so the program is checked again the next time.
+# If `stats` is passed, building Phi_P is timed into its 'infer_spec' phase, and the solver calls are counted in its
+# `conflict_checks`. If `abstract` is passed, partial programs are evaluated with it first, and the conflicts it finds
+# skip the solver.
+def check_conflict(program : AST, ctx: SpecContext, spec: SpecCache, stats: Stats = None,
+                   abstract: AbstractSemantics = None):
+    ctx.failed = None
+    ctx.failures = []
+    ctx.inconclusive = False
+    key = frozenset(program.assignment().items())
+    if key in ctx.feasible:
         return set()
+    calls = ctx.calls
+    kappa = find_conflict(program, ctx, spec, stats, abstract)
+    if stats is not None:
+        stats.conflict_checks += ctx.calls - calls
+    if len(kappa) == 0 and not ctx.inconclusive:
+        ctx.feasible.add(key)
+    return kappa
+
+
+def find_conflict(program : AST, ctx: SpecContext, spec: SpecCache, stats: Stats = None,
+                  abstract: AbstractSemantics = None):
+    start = time.perf_counter()
+    spec_tups = spec.spec()  # Gets the program spec. \Phi_P in the paper
+    if stats is not None:
+        stats.timed('infer_spec', start)
+
+    # Complete programs are just run on the examples, no need to call the solver. One that can't be run on an example
+    # (e.g., it has an input of the wrong type) fails it: the solver could only find it consistent through the free
+    # variables `Semantics` gives such inputs, which doesn't make it a solution.
+    if program.is_concrete():
+        failed = failing_examples(program, ctx.spec.examples)
+        if len(failed) == 0:
+            return set()
+        ctx.failed = failed[0]
+        ctx.failures = failed
+        # The whole program is to blame
+        return set(t for t in spec_tups if not isinstance(t[0], bool))
+
+    # Partial programs whose abstract value can't be an output conflict without calling the solver. The nodes the
+    # abstract conflict needs are to blame.
+    if abstract is not None:
+        start = time.perf_counter()
+        found = abstract.conflict(program, ctx.spec.examples)
+        if stats is not None:
+            stats.timed('abstract', start)
+        if found is not None:
+            (i, blamed) = found
+            ctx.failed = i
+            ctx.failures = [i]
+            if stats is not None:
+                stats.abstract += 1
+            return set(t for t in spec_tups if not isinstance(t[0], bool) and t[2] in blamed)
+
+    subtrees = concrete_subtrees(program, ctx.spec.examples)
+    inside = set()
+    for (r, values, ids) in subtrees.values():
+        inside |= ids
+    spec_p = [tup[0] for tup in spec_tups if tup[2] not in inside]
+    if ctx.batch:
+        (core_ids, blamed) = batch_conflict(ctx, spec, spec_p, subtrees)
     else:
-        print("Partial program is INFEASIBLE!")
-        kappa = set()
-        # Being dumb and inefficient here.
-        for t in spec_tups:
-            if not isinstance(t[0], bool) and t[0] in cores:
-                kappa.add(t)
-        #print("Unsat Core/Kappa:")
-        #print(kappa)
+        (core_ids, blamed) = each_conflict(ctx, spec, spec_p, subtrees)
+    if core_ids is None:
+        return set()
+    kappa = set()
+    for t in spec_tups:
+        if isinstance(t[0], bool):
+            continue
+        if t[2] in blamed or (t[2] not in inside and t[0].get_id() in core_ids):
+            kappa.add(t)
     return kappa
+
+
+# Checks the examples one at a time, and stops at the first one that conflicts. Returns None, or the ids of the
+# formulas in its unsat core and the ids of the nodes of the concrete sub-programs in it, which are blamed as a whole.
+def each_conflict(ctx: SpecContext, spec: SpecCache, spec_p: list, subtrees: dict):
+    for i in range(len(ctx.spec)):
+        hints = {}  # Maps an equality `v<id> == value` to the id of the sub-program it stands for
+        for (r_id, (r, values, ids)) in subtrees.items():
+            hint = spec.semantics.node_sym(r) == to_z3_val(values[i])
+            hints[hint.get_id()] = (hint, r_id)
+        result = ctx.check(i, spec_p + [h[0] for h in hints.values()])
+        if result == unknown:
+            ctx.inconclusive = True
+        if result == unsat:
+            ctx.failed = i
+            ctx.failures = [i]
+            core_ids = set(c.get_id() for c in ctx.unsat_core())
+            blamed = set()
+            for c_id in core_ids:
+                if c_id in hints:
+                    blamed |= subtrees[hints[c_id][1]][2]
+            return (core_ids, blamed)
+    return (None, None)
+
+
+# Checks all the examples in one query (see `SpecContext.batch_check`). Returns the same as `each_conflict`, and its
+# unsat core can span several examples, which are all recorded in `ctx.failures`. The unguarded batched query can come
+# back unknown on formulas that the guarded solver of `each_conflict` decides at once, so it is then checked again one
+# example at a time.
+def batch_conflict(ctx: SpecContext, spec: SpecCache, spec_p: list, subtrees: dict):
+    roots = list(subtrees.keys())
+    hints = [(spec.semantics.node_sym(subtrees[r_id][0]), subtrees[r_id][1]) for r_id in roots]
+    (result, core) = ctx.batch_check(spec_p, hints)
+    if result == unknown:
+        return each_conflict(ctx, spec, spec_p, subtrees)
+    if result != unsat:
+        return (None, None)
+    (core_ids, hint_pos, examples) = core
+    ctx.failures = examples
+    ctx.failed = examples[0] if examples else None
+    blamed = set()
+    for j in hint_pos:
+        blamed |= subtrees[roots[j]][2]
+    return (core_ids, blamed)
+
+
+# The positions of the examples that a complete program gets wrong. Failing to run on an example counts as getting it
+# wrong.
+def failing_examples(program: AST, examples: list) -> list:
+    try:
+        outputs = evaluate(program.root, [ex[0] for ex in examples])
+    except EvalError:
+        outputs = []
+        for ex in examples:
+            try:
+                outputs.extend(evaluate(program.root, [ex[0]]))
+            except EvalError:
+                outputs.append(EvalError)  # Never equal to an output
+    return [i for (i, (out, ex)) in enumerate(zip(outputs, examples)) if out != ex[1]]
+
+
+# For CEGIS: the position of the first example that a complete program gets wrong, or None if it gets them all right
+def counterexample(program: AST, examples: list):
+    failed = failing_examples(program, examples)
+    return failed[0] if failed else None
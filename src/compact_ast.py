@@ -0,0 +1,323 @@
+from array import array
+from z3 import *
+from typing import List
+from src.ast import Production, label, print_node, print_program, print_nodes
+
+# A compact, array-backed alternative to `AST`. Instead of one python object per node, the program is stored as a
+# struct of arrays indexed by a slot number: the interned non-terminal, the interned production (-1 for a hole), the
+# parent slot, the depth, and k child slots per node. Slots of undone nodes go on a free list and are reused.
+# `CompactAST` has the same interface as `AST` (make_root, holes, search, fill, undo, backtrack, encode, assignment,
+# to_program, ...), and hands out light `NodeView`s wherever `AST` returns a `Node`, so the rest of the synthesizer
+# works on either one.
+
+
+# Interns the non-terminals and productions of a grammar as integers
+class GrammarTable:
+    def __init__(self, grammar):
+        prods = grammar[2]
+        types = grammar[4] if len(grammar) > 4 else {}
+        self.non_terminals = list(prods.keys())
+        self.nt_index = {nt: i for (i, nt) in enumerate(self.non_terminals)}
+        self.types = [types.get(nt) for nt in self.non_terminals]
+
+        # For each production index: (lhs non-terminal index, terminal, child non-terminal indices, the production)
+        self.prods = []
+        self.prod_index = {}
+        for nt in self.non_terminals:
+            for p in prods[nt]:
+                key = (nt, p[0], tuple(p[1]))
+                if key in self.prod_index:
+                    continue
+                self.prod_index[key] = len(self.prods)
+                self.prods.append((self.nt_index[nt], p[0], tuple(self.nt_index[c] for c in p[1]), p))
+
+    def lookup(self, nt: str, p: Production) -> int:
+        return self.prod_index[(nt, p[0], tuple(p[1]))]
+
+
+# A view of one slot of a CompactAST, with the same attributes as `Node`. Views are created on demand and hold no
+# state of their own.
+class NodeView:
+    __slots__ = ('store', 'slot')
+
+    def __init__(self, store, slot: int):
+        self.store = store
+        self.slot = slot
+
+    @property
+    def id(self) -> int:
+        return self.store.labels[self.slot]
+
+    @property
+    def d(self) -> int:
+        return self.store.depth[self.slot]
+
+    @property
+    def k(self) -> int:
+        return self.store.arity
+
+    @property
+    def i(self) -> int:
+        return self.store.positions[self.slot]
+
+    @property
+    def non_terminal(self) -> str:
+        return self.store.table.non_terminals[self.store.nt[self.slot]]
+
+    @property
+    def A(self) -> str:
+        return self.non_terminal
+
+    @property
+    def typ(self) -> str:
+        return self.store.table.types[self.store.nt[self.slot]]
+
+    @property
+    def terminal(self):
+        p = self.store.prod[self.slot]
+        if p < 0:
+            return None
+        return self.store.table.prods[p][1]
+
+    @property
+    def num_children(self) -> int:
+        p = self.store.prod[self.slot]
+        if p < 0:
+            return 0
+        return len(self.store.table.prods[p][2])
+
+    @property
+    def children(self) -> list:
+        return [NodeView(self.store, c) for c in self.store.child_slots(self.slot)]
+
+    def is_hole(self) -> bool:
+        return self.store.prod[self.slot] < 0
+
+    def encode_node(self):
+        if self.is_hole():
+            raise ValueError(f"No production assigned to node {self.id}")
+        return Bool(f"c({self.id}, {self.terminal})")
+
+    print = print_node
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and self.store is other.store and self.slot == other.slot
+
+    def __hash__(self):
+        return hash((id(self.store), self.slot))
+
+
+class CompactAST:
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.non_terminals = grammar[0]
+        self.terminals = grammar[1]
+        self.prods = grammar[2]
+        self.rules = self.prods  # just an alias
+        self.start_symbol = grammar[3]
+        self.types = grammar[4] if len(grammar) > 4 else {}
+        self.table = GrammarTable(grammar)
+        self.arity = None
+        self.root = None
+        self.num_at_depth = {}
+
+        # The node arrays, indexed by slot. `labels` and `positions` can grow past 64 bits on deep programs, so they
+        # are plain lists.
+        self.nt = array('i')
+        self.prod = array('i')
+        self.parent = array('i')
+        self.depth = array('i')
+        self.kids = array('i')  # k entries per slot, -1 where there is no child
+        self.labels = []
+        self.positions = []
+        self.free = []  # Slots that can be reused
+
+        self.slot_of = {}  # Maps a node id (label) to its slot
+        self.open_holes = {}  # Ordered set of the ids of the holes
+        self.assigned = {}
+        self.trail = []
+        self.trail_lim = []
+        self.listeners = []  # See `AST.listeners`
+
+    # Computes the maximum arity of the grammar operators
+    def max_arity(self) -> int:
+        return max(len(p[2]) for p in self.table.prods)
+
+    # Allocates a slot for a new hole
+    def alloc(self, nt: int, parent: int, d: int, i: int) -> int:
+        k = self.arity
+        if self.free:
+            slot = self.free.pop()
+            self.nt[slot] = nt
+            self.prod[slot] = -1
+            self.parent[slot] = parent
+            self.depth[slot] = d
+            self.labels[slot] = label(k, d, i)
+            self.positions[slot] = i
+        else:
+            slot = len(self.nt)
+            self.nt.append(nt)
+            self.prod.append(-1)
+            self.parent.append(parent)
+            self.depth.append(d)
+            self.kids.extend([-1] * k)
+            self.labels.append(label(k, d, i))
+            self.positions.append(i)
+        self.slot_of[self.labels[slot]] = slot
+        self.open_holes[self.labels[slot]] = None
+        return slot
+
+    def child_slots(self, slot: int) -> list:
+        k = self.arity
+        return [c for c in self.kids[slot * k:(slot + 1) * k] if c >= 0]
+
+    def make_root(self) -> NodeView:
+        self.arity = max(self.max_arity(), 2)  # Labels are only unique for k >= 2
+        self.nt = array('i')
+        self.prod = array('i')
+        self.parent = array('i')
+        self.depth = array('i')
+        self.kids = array('i')
+        self.labels = []
+        self.positions = []
+        self.free = []
+        self.slot_of = {}
+        self.open_holes = {}
+        self.assigned = {}
+        self.trail = []
+        self.trail_lim = []
+        slot = self.alloc(self.table.nt_index[self.start_symbol], -1, 1, 1)
+        self.num_at_depth = {1: 1}
+        self.root = NodeView(self, slot)
+        return self.root
+
+    # Returns the holes (nodes) of the program, or of the sub-program at some given node
+    def holes(self, r: NodeView = None) -> List[NodeView]:
+        if r is None:
+            return [NodeView(self, self.slot_of[id]) for id in self.open_holes]
+        holes = []
+        stack = [r.slot]
+        while stack:
+            slot = stack.pop()
+            if self.prod[slot] < 0:
+                holes.append(NodeView(self, slot))
+            stack.extend(self.child_slots(slot))
+        return holes
+
+    # Finds the node with the matching ID, or None if there is no such node (under `r`, if it is passed)
+    def search(self, id: int, r: NodeView = None) -> NodeView:
+        slot = self.slot_of.get(id)
+        if slot is None:
+            return None
+        if r is not None:  # Check that the node is below r
+            s = slot
+            while s >= 0 and s != r.slot:
+                s = self.parent[s]
+            if s < 0:
+                return None
+        return NodeView(self, slot)
+
+    # Fills the hole with the given id with a given production
+    def fill(self, id: int, p: Production) -> NodeView:
+        slot = self.slot_of[id]
+        if self.prod[slot] >= 0:
+            raise ValueError(f"Node {id} is not a hole")
+        k = self.arity
+        nt = self.table.non_terminals[self.nt[slot]]
+        prod = self.table.lookup(nt, p)
+        self.prod[slot] = prod
+        d = self.depth[slot] + 1
+        i0 = (self.positions[slot] - 1) * k
+        child_nts = self.table.prods[prod][2]
+        child_ids = []
+        for (j, c_nt) in enumerate(child_nts):
+            c = self.alloc(c_nt, slot, d, i0 + j + 1)
+            self.kids[slot * k + j] = c
+            child_ids.append(self.labels[c])
+        self.num_at_depth[d] = self.num_at_depth.get(d, 0) + len(child_nts)
+
+        del self.open_holes[id]
+        self.assigned[id] = p[0]
+        self.trail.append((id, p, child_ids, (d, len(child_nts))))
+        node = NodeView(self, slot)
+        for listener in self.listeners:
+            listener.filled(self, node)
+        return node
+
+    # Starts a new decision level, and returns it
+    def new_level(self) -> int:
+        self.trail_lim.append(len(self.trail))
+        return len(self.trail_lim)
+
+    def decision_level(self) -> int:
+        return len(self.trail_lim)
+
+    # Undoes the most recent fill on the trail, and returns the node that became a hole again
+    def undo_last(self) -> NodeView:
+        (id, p, child_ids, (d, n)) = self.trail.pop()
+        k = self.arity
+        slot = self.slot_of[id]
+        for c_id in child_ids:
+            c = self.slot_of.pop(c_id)
+            del self.open_holes[c_id]
+            self.free.append(c)
+        for j in range(k):
+            self.kids[slot * k + j] = -1
+        self.num_at_depth[d] -= n
+
+        self.prod[slot] = -1
+        self.open_holes[id] = None
+        del self.assigned[id]
+        node = NodeView(self, slot)
+        for listener in self.listeners:
+            listener.undone(self, node)
+        return node
+
+    # Undoes every fill made after decision level `level`, so that level becomes the current one
+    def backtrack(self, level: int):
+        if level < self.decision_level():
+            while len(self.trail) > self.trail_lim[level]:
+                self.undo_last()
+            del self.trail_lim[level:]
+
+    # Reverts `fill` on the node with the given id, which must be the most recent fill on the trail
+    def undo(self, id: int) -> NodeView:
+        if len(self.trail) == 0 or self.trail[-1][0] != id:
+            raise ValueError(f"Node {id} is not the most recent fill")
+        return self.undo_last()
+
+    # Checks if a program has all its holes filled, and is thus a full program
+    def is_concrete(self):
+        return len(self.open_holes) == 0
+
+    # Returns the partial program as a SAT formula that is compatible with python's Z3 API
+    def encode(self):
+        return [Bool(f"c({id}, {op})") for (id, op) in self.assigned.items()]
+
+    # Returns the operators applied so far, as a dict from node id to terminal
+    def assignment(self) -> dict:
+        return self.assigned
+
+    # converts the AST to an S-expression representing a program
+    def to_program(self, r: NodeView = None):
+        if r is None:
+            r = self.root
+        result = {}
+        stack = [(r.slot, False)]
+        while stack:
+            slot, visited = stack.pop()
+            p = self.prod[slot]
+            kids = self.child_slots(slot)
+            if p < 0:
+                result[slot] = self.table.non_terminals[self.nt[slot]]
+            elif len(kids) == 0:
+                result[slot] = self.table.prods[p][1]
+            elif visited:
+                result[slot] = [self.table.prods[p][1], [result.pop(c) for c in kids]]
+            else:
+                stack.append((slot, True))
+                stack.extend((c, False) for c in kids)
+        return result[r.slot]
+
+    print_program = print_program
+    print_nodes = print_nodes
@@ -0,0 +1,32 @@
+from src.ast import AST
+from src.lemma import Lemma, LemmaDB
+
+# Checking consistency, i.e., fill(P, H, p) ~ Omega in the paper, for every candidate (hole, production) at once.
+# Every lemma only mentions positive literals c(id, op) under a negation, and the program only makes literals true, so
+# a candidate c(h, op) is inconsistent iff some lemma has all of its nodes satisfied once h is filled with op. That can
+# be read off the lemmas in one pass, without copying or re-encoding the program and without calling the solver.
+
+
+# Returns the set of literals (id, op) that would violate a lemma if added to the assignment (a dict id -> op of the
+# filled nodes). Returns None if the assignment already violates a lemma, i.e., nothing is consistent.
+# `omega` is a list of lemmas, or a `LemmaDB`, which only looks at the lemmas its index says can block something.
+def blocked_literals(assignment: dict, omega):
+    if isinstance(omega, LemmaDB):
+        return omega.blocked_literals(assignment)
+    blocked = set()
+    for lemma in omega:
+        (n_missing, missing) = lemma.missing(assignment)
+        if n_missing == 0:
+            return None
+        if n_missing == 1 and missing not in assignment:
+            for op in lemma.blocked[missing]:
+                blocked.add((missing, op))
+    return blocked
+
+
+# Filters a list of candidates (hole, production) down to the ones that are consistent with the lemmas
+def consistent_candidates(ast: AST, candidates: list, omega) -> list:
+    blocked = blocked_literals(ast.assignment(), omega)
+    if blocked is None:
+        return []
+    return [hp for hp in candidates if (hp[0].id, hp[1][0]) not in blocked]
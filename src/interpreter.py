@@ -0,0 +1,172 @@
+import re
+from src.ast import Node, AST
+from src.semantics import OPS
+from src.parser import is_string_literal, unquote
+
+# A concrete (pure python) interpreter for the string/int DSL. It evaluates complete programs, or complete
+# sub-programs of a partial program, directly on the I/O examples, so that wrong candidates can be rejected without
+# calling Z3. The operators follow the SMT-LIB string theory, which is what `sem` encodes symbolically.
+
+
+# Raised when a (sub-)program can't be evaluated concretely, e.g., it still has holes, uses an operator that has no
+# concrete semantics, or applies an operator to an input of the wrong type.
+class EvalError(Exception):
+    pass
+
+
+def _str_at(s: str, n: int) -> str:
+    if 0 <= n < len(s):
+        return s[n]
+    return ""
+
+
+def _str_substr(s: str, n1: int, n2: int) -> str:
+    if 0 <= n1 < len(s) and n2 > 0:
+        return s[n1:n1 + n2]
+    return ""
+
+
+def _str_indexof(s: str, t: str, n: int) -> int:
+    if 0 <= n <= len(s):
+        return s.find(t, n)
+    return -1
+
+
+_DIGITS = re.compile(r"[0-9]+")
+
+
+def _str_to_int(s: str) -> int:
+    if _DIGITS.fullmatch(s):
+        return int(s)
+    return -1
+
+
+def _int_to_str(n: int) -> str:
+    if n >= 0:
+        return str(n)
+    return ""
+
+
+# Concrete semantics of every operator in `OPS`. The inputs are passed in the same order as the children of a node.
+CONCRETE_SEM = {
+    'str.++': lambda s1, s2: s1 + s2,
+    'str.replace': lambda s1, s2, s3: s1.replace(s2, s3, 1),
+    'str.at': _str_at,
+    'int.to.str': _int_to_str,
+    'str.substr': _str_substr,
+    'space': lambda: " ",
+    '+': lambda n1, n2: n1 + n2,
+    '-': lambda n1, n2: n1 - n2,
+    'str.len': len,
+    'str.to.int': _str_to_int,
+    'str.indexof': _str_indexof,
+    'str.prefixof': lambda s1, s2: s2.startswith(s1),
+    'str.suffixof': lambda s1, s2: s2.endswith(s1),
+    'str.contains': lambda s1, s2: s2 in s1,
+    'ite': lambda b, x1, x2: x1 if b else x2,
+    '=': lambda x1, x2: x1 == x2,
+    '<=': lambda n1, n2: n1 <= n2,
+    '>=': lambda n1, n2: n1 >= n2,
+    '<': lambda n1, n2: n1 < n2,
+    '>': lambda n1, n2: n1 > n2,
+    'and': lambda b1, b2: b1 and b2,
+    'or': lambda b1, b2: b1 or b2,
+    'not': lambda b: not b,
+}
+assert CONCRETE_SEM.keys() == OPS.keys()
+
+# Returns the python type of a value, using the same type names as `OPS`
+def type_of(value) -> str:
+    if isinstance(value, bool):  # bool is a subclass of int, so check it first
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    return 'str'
+
+
+# Value of a terminal symbol with no inputs. `env` maps the arguments of the synthesized function to their values.
+def literal(symbol, env: dict):
+    if isinstance(symbol, bool) or isinstance(symbol, int):
+        return symbol
+    if not isinstance(symbol, str):
+        raise EvalError(f"Unsupported terminal: {symbol}")
+    if symbol in env:
+        return env[symbol]
+    if symbol == 'true':
+        return True
+    if symbol == 'false':
+        return False
+    if is_string_literal(symbol):
+        return unquote(symbol)
+    raise EvalError(f"Unknown terminal: {symbol}")
+
+
+# Applies an operator to a list of concrete inputs
+def apply_op(op, args: list):
+    if op not in CONCRETE_SEM:
+        raise EvalError(f"No concrete semantics for operator: {op}")
+    arg_types = OPS[op][1]
+    if len(args) != len(arg_types):
+        raise EvalError(f"Operator {op} expects {len(arg_types)} inputs, got {len(args)}")
+    binding = {}  # For the type variable 'a'
+    for (a, typ) in zip(args, arg_types):
+        if typ == 'a':
+            typ = binding.setdefault('a', type_of(a))
+        if type_of(a) != typ:
+            raise EvalError(f"Operator {op} expects a {typ} input, got {a!r}")
+    return CONCRETE_SEM[op](*args)
+
+
+# Evaluates the (complete) sub-program rooted at `node` on every environment in `envs` at once.
+# Returns a list with the value of the sub-program on each environment. Iterative post-order, so deep programs are fine.
+def evaluate(node: Node, envs: list) -> list:
+    values = {}
+    stack = [(node, False)]
+    while stack:
+        v, visited = stack.pop()
+        if v.is_hole():
+            raise EvalError(f"Node {v.id} is a hole")
+        if v.num_children == 0:
+            if v.terminal in OPS:  # nullary operators, e.g., `space`
+                values[v.id] = [apply_op(v.terminal, [])] * len(envs)
+            else:
+                values[v.id] = [literal(v.terminal, env) for env in envs]
+        elif visited:
+            child_vals = [values.pop(c.id) for c in v.children]
+            values[v.id] = [apply_op(v.terminal, list(args)) for args in zip(*child_vals)]
+        else:
+            stack.append((v, True))
+            for c in v.children:
+                stack.append((c, False))
+    return values[node.id]
+
+
+# Returns the maximal complete sub-programs of a partial program, i.e., the complete sub-trees whose parent still has
+# a hole somewhere below it. If the whole program is complete, this is just the root.
+def complete_subtrees(program: AST) -> list:
+    # First pass (post-order) marks the complete nodes, second pass (pre-order) collects the maximal ones.
+    complete = {}
+    stack = [(program.root, False)]
+    while stack:
+        v, visited = stack.pop()
+        if visited:
+            complete[v.id] = not v.is_hole() and all(complete[c.id] for c in v.children)
+        else:
+            stack.append((v, True))
+            stack.extend((c, False) for c in v.children)
+    result = []
+    stack = [program.root]
+    while stack:
+        v = stack.pop()
+        if complete[v.id]:
+            result.append(v)
+        else:
+            stack.extend(v.children)
+    return result
+
+
+# Runs a complete program on the examples. Each example is a pair (env, output). Returns True iff every output matches.
+def run_examples(program: AST, examples: list) -> bool:
+    envs = [ex[0] for ex in examples]
+    outputs = evaluate(program.root, envs)
+    return all(out == ex[1] for (out, ex) in zip(outputs, examples))
@@ -0,0 +1,177 @@
+from z3 import *
+
+# A learned lemma. It blocks every program where each node listed in `blocked` has one of the listed operators, i.e.,
+#   Not(And([Or([c(id, op) for op in ops]) for (id, ops) in blocked.items()]))
+# The lemma `Not(c(3, fname))` is Lemma({3: {'fname'}}). Keeping lemmas as plain data (instead of only Z3 terms) lets
+# DECIDE check them without calling the solver.
+# A `local` lemma was learned by `naive_analyze_conflict`, which blocks the last decision alone although it was only
+# refuted under the rest of the assignment. It steers the search that learned it, but it isn't implied by the spec, so
+# it mustn't reach a search that relies on its lemmas being sound (see `LemmaExchange` in src/portfolio.py).
+class Lemma:
+    def __init__(self, blocked: dict, local: bool = False):
+        self.blocked = {id: frozenset(ops) for (id, ops) in blocked.items()}
+        self.local = local
+
+    # Checks if a (partial) assignment of operators to nodes, given as a dict id -> op, violates the lemma
+    def is_violated(self, assignment: dict) -> bool:
+        return all(assignment.get(id) in ops for (id, ops) in self.blocked.items())
+
+    # Returns the node of the lemma that the assignment doesn't satisfy yet, if there is exactly one, as (1, id).
+    # Returns (0, None) if the assignment violates the lemma, and (2, None) if two or more nodes are not satisfied.
+    def missing(self, assignment: dict):
+        missing = None
+        n_missing = 0
+        for (id, ops) in self.blocked.items():
+            if assignment.get(id) not in ops:
+                missing = id
+                n_missing += 1
+                if n_missing > 1:
+                    return (2, None)
+        return (n_missing, missing)
+
+    # Checks if this lemma blocks every program that `other` blocks
+    def subsumes(self, other: 'Lemma') -> bool:
+        if len(self.blocked) > len(other.blocked):
+            return False
+        for (id, ops) in self.blocked.items():
+            if id not in other.blocked or not other.blocked[id] <= ops:
+                return False
+        return True
+
+    # The literals c(id, op) of the lemma
+    def literals(self):
+        return [(id, op) for (id, ops) in self.blocked.items() for op in ops]
+
+    # Returns the lemma as a formula that is compatible with python's Z3 API
+    def encode(self):
+        conj = []
+        for (id, ops) in self.blocked.items():
+            lits = [Bool(f"c({id}, {op})") for op in ops]
+            conj.append(lits[0] if len(lits) == 1 else Or(lits))
+        return Not(conj[0] if len(conj) == 1 else And(conj))
+
+    def __eq__(self, other):
+        return isinstance(other, Lemma) and self.blocked == other.blocked
+
+    def __hash__(self):
+        return hash(frozenset(self.blocked.items()))
+
+    def __repr__(self):
+        return str(self.encode())
+
+
+# The knowledge base Omega. Lemmas are indexed by their literals (id, op), so only the lemmas that can block something
+# under an assignment are looked at, and duplicates and lemmas subsumed by another lemma are dropped.
+# There is no solver check of the lemmas as a whole: they are all negative clauses over the literals c(id, op), so they
+# are always satisfiable together (set every literal to false). The search finds that the lemmas block every program
+# when it conflicts at decision level 0.
+# With a `cap`, the database is reduced to half the cap when it grows past it, as in SAT solvers: the least active
+# lemmas are evicted first, and "glue" lemmas (over nodes of at most GLUE different decision levels, their LBD) last.
+# A lemma's activity is bumped when it is learned and every time it blocks a candidate, and decays over the conflicts.
+# Evicting a lemma only forgets what was learned; the search may learn it again.
+GLUE = 2
+
+
+class LemmaDB:
+    def __init__(self, cap: int = None, decay: float = 0.95):
+        self.cap = cap
+        self.decay = decay
+        self.lemmas = {}  # Maps a lemma to its LBD, in the order they were learned
+        self.by_literal = {}  # Maps a literal (id, op) to the set of lemmas that contain it
+        self.units = set()  # The lemmas over a single node
+        self.activity = {}
+        self.inc = 1.0  # The current activity bump
+        self.evicted = 0
+
+        # Objects that want to know about every lemma added and removed, e.g., the propagator in `src/propagate.py`.
+        # They get `added(lemma)` and `dropped(lemma)`.
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.lemmas)
+
+    def __iter__(self):
+        return iter(list(self.lemmas))
+
+    def __contains__(self, lemma):
+        return lemma in self.lemmas
+
+    def __repr__(self):
+        return str(list(self.lemmas))
+
+    # Adds a lemma, unless it is subsumed by one that is already in the database. Removes the lemmas that the new one
+    # subsumes. Returns whether the lemma was added.
+    def add(self, lemma: Lemma, lbd: int = None) -> bool:
+        if lemma in self.lemmas:
+            self.bump(lemma)
+            return False
+        lits = lemma.literals()
+        for l in set(m for lit in lits for m in self.by_literal.get(lit, ())):
+            if l.subsumes(lemma):
+                self.bump(l)
+                return False
+        (first, ops) = next(iter(lemma.blocked.items()))
+        subsumed = set(m for op in ops for m in self.by_literal.get((first, op), ()) if lemma.subsumes(m))
+        for m in subsumed:
+            self.remove(m)
+
+        self.lemmas[lemma] = len(lemma.blocked) if lbd is None else lbd
+        for lit in lits:
+            self.by_literal.setdefault(lit, set()).add(lemma)
+        if len(lemma.blocked) == 1:
+            self.units.add(lemma)
+        self.activity[lemma] = 0.0
+        self.bump(lemma)
+        for listener in self.listeners:
+            listener.added(lemma)
+        if self.cap is not None and len(self.lemmas) > self.cap:
+            self.reduce()
+        return True
+
+    def remove(self, lemma: Lemma):
+        del self.lemmas[lemma]
+        del self.activity[lemma]
+        self.units.discard(lemma)
+        for lit in lemma.literals():
+            s = self.by_literal[lit]
+            s.discard(lemma)
+            if not s:
+                del self.by_literal[lit]
+        for listener in self.listeners:
+            listener.dropped(lemma)
+
+    def bump(self, lemma: Lemma):
+        self.activity[lemma] += self.inc
+        if self.activity[lemma] > 1e100:  # Rescale, as MiniSat does
+            for l in self.activity:
+                self.activity[l] *= 1e-100
+            self.inc *= 1e-100
+
+    # Called once per conflict, so that recent activity counts for more
+    def decay_activity(self):
+        self.inc /= self.decay
+
+    # Evicts lemmas until half the cap is left
+    def reduce(self):
+        candidates = sorted(self.lemmas, key=lambda l: (self.lemmas[l] <= GLUE, self.activity[l]))
+        for l in candidates[:len(candidates) - self.cap // 2]:
+            self.remove(l)
+            self.evicted += 1
+
+    # The literals (id, op) that would violate a lemma if added to the assignment, or None if the assignment already
+    # violates one (see `blocked_literals` in src/consistency.py). Only the lemmas with a literal in the assignment
+    # and the lemmas over a single node can block anything, and those are found through the index.
+    def blocked_literals(self, assignment: dict):
+        candidates = set(l for (id, op) in assignment.items() for l in self.by_literal.get((id, op), ()))
+        candidates.update(self.units)
+        blocked = set()
+        for lemma in candidates:
+            (n_missing, missing) = lemma.missing(assignment)
+            if n_missing == 0:
+                self.bump(lemma)
+                return None
+            if n_missing == 1 and missing not in assignment:
+                self.bump(lemma)
+                for op in lemma.blocked[missing]:
+                    blocked.add((missing, op))
+        return blocked
@@ -1,172 +1,469 @@
+import argparse
+import bisect
+import contextlib
 import os
+import sys
+import threading
+import time
+import weakref
 from z3 import *
 import random as random
-from src.parser import get_grammar, input_to_list
+from src.parser import get_grammar, get_spec, input_to_list
+from src.cache import load_problem
 from src.ast import Node, AST, label
-from src.check_conflict import check_conflict
-from src.analyze_conflict import naive_analyze_conflict
-from copy import deepcopy
+from src.compact_ast import CompactAST
+from src.check_conflict import check_conflict, counterexample
+from src.abstract import AbstractSemantics
+from src.spec import Spec, SpecContext
+from src.analyze_conflict import naive_analyze_conflict, core_analyze_conflict, generalize_analyze_conflict
+from src.consistency import consistent_candidates
+from src.lemma import Lemma, LemmaDB
+from src.propagate import Propagator
 import numpy as np
-from src.semantics import infer_spec
+from src.semantics import Semantics, SpecCache
+from src.stats import Stats, Trace, TRACE_ROUND, TRACE_DETAIL
+from src.bottom_up import bottom_up
+from src.model import Model, ScoreTable, load as load_model
+from src.profiling import Profiler, profile_prefix
 
 
-# Dummy functions for now. Corresponds to checking if fill(P, H, p) ~ Omega in the paper.
-# This is called "checking consistency". Omega is a set of z3 compatible lemmas.
-def is_consistent(ast: AST, hp, omega: list, solver):
-    prog = deepcopy(ast)  # Not sure if needed, but doing this to avoid weird mutability problems
-    id: int = hp[0].id
-    p = hp[1]
-    prog.root = prog.fill(prog.root, id, p)
-    encoding = prog.encode()  # Get the encoding of the program
-    knowledge_base = encoding + omega  # Should be a conjunction of symbolic booleans
-    #print("Knowledge base:")
-    #print(knowledge_base)
-    solver.push()  # New state
-    solver.add(knowledge_base)
-    result = solver.check()  # Will be 'sat' or 'unsat'
-    solver.pop()  # Remove state
-    #print(f"Checking candidates for Node: {id}")
-    #print(f"Production rule: {p[0]}")
-    #print(f"This was {result}")
-    return result == sat
-
-
-def is_unsat(knowledge_base):
-    s = Solver()
-    result = s.check(knowledge_base)
-    print("knowledge check:")
-    print(knowledge_base)
-    print("result:")
-    print(result)
-    return result == unsat
+# Hole-selection heuristics for `arg_max`. Each one maps a candidate (hole, production) to a key, and the candidate
+# with the smallest key is the greedy choice.
+HEURISTICS = {
+    'smallest': lambda hp: len(hp[1][1]),  # The production with the fewest children
+    'shallowest': lambda hp: (hp[0].d, len(hp[1][1])),  # Fill the program top-down, breadth first
+    'deepest': lambda hp: (-hp[0].d, len(hp[1][1])),  # Finish the deepest sub-program first
+    'largest': lambda hp: -len(hp[1][1]),  # The production with the most children
+}
+
 
 # Corresponds to picking the hole that is the most likely choice, according to some probabilistic model.
-# Right now there's no model, so it's just a biased random walk (to avoid local minima)
-# Setting p < 1.0 means that we make the greedy choice 100% of the time. Just for now.
-def arg_max(holes: list):
-    argmin_idx = np.argmin([len(hp[1][1]) for hp in holes])
-    greedy_choice = holes[argmin_idx]
-    random_choice = random.choice(holes)
-    p = random.random()
-    if p < 1.0:
-        final_choice = greedy_choice
+# With a model (see src/model.py), `scores` holds the log probability of each candidate and the most likely one is the
+# greedy choice, with the heuristic breaking ties. Without one, the heuristic alone picks the greedy choice.
+# It's a biased random walk (to avoid local minima): with probability `random_walk` a random candidate is picked
+# instead. Ties between greedy choices go to the first candidate, or to a random one if `rng` is given.
+def arg_max(holes: list, heuristic: str = 'smallest', random_walk: float = 0.0, rng: random.Random = None,
+            scores=None):
+    r = rng if rng is not None else random
+    if random_walk > 0.0 and r.random() < random_walk:
+        final_choice = r.choice(holes)
     else:
-        final_choice = random_choice
-    print(f"Chosen hole was ({final_choice[0].id}, {final_choice[1][0]})")
+        key = HEURISTICS[heuristic]
+        if scores is None:
+            keys = [key(hp) for hp in holes]
+        else:
+            keys = [(-s, key(hp)) for (s, hp) in zip(scores, holes)]
+        best = min(keys)
+        ties = [hp for (k, hp) in zip(keys, holes) if k == best]
+        final_choice = ties[0] if rng is None else rng.choice(ties)
     return final_choice
 
 
-# Dummy function of the DECIDE routine from the paper
-def decide(ast: AST, omega: list):
+# Dummy function of the DECIDE routine from the paper. `table` is a compiled model (a `ScoreTable`), or None.
+# With a `Propagator`, the candidates are read off the domains of the holes, which only hold the productions that are
+# consistent with the lemmas. The consistency phase is timed into `stats`, and the candidates are traced at
+# TRACE_DETAIL.
+def decide(ast: AST, omega: LemmaDB, heuristic: str = 'smallest', random_walk: float = 0.0, rng: random.Random = None,
+           table: ScoreTable = None, prop: Propagator = None, stats: Stats = None, trace: Trace = None):
     holes = ast.holes()
-    print("Current set of holes:")
-    print([h.id for h in holes])
-    prods = ast.prods
-    s = Solver()
-    v0 = [(h, p) for h in holes for p in prods[h.non_terminal]]
-    v1 = [hp for hp in v0 if is_consistent(ast, hp, omega, s)]
+    t = time.perf_counter()
+    if prop is not None:
+        v1 = [(h, p) for h in holes for p in prop.candidates(h)]
+    else:
+        prods = ast.prods
+        v0 = [(h, p) for h in holes for p in prods[h.non_terminal]]
+        v1 = consistent_candidates(ast, v0, omega)  # Corresponds to checking if fill(P, H, p) ~ Omega in the paper
+    if stats is not None:
+        stats.timed('consistency', t)
+    if trace is not None and trace.level >= TRACE_DETAIL:
+        trace.emit("candidates", holes=[h.id for h in holes], candidates=len(v1))
     if len(v1) == 0:
-        print("No possible completion found")
-        print(omega)
-    return arg_max(v1)
+        return None
+    scores = None if table is None else table.scores(ast, v1)
+    return arg_max(v1, heuristic, random_walk, rng, scores)
 
 
-# Dummy function of the PROPOGATE routine. Currently just fills the hole.
-def propogate(program: AST, hp, omega) -> AST:
+# The PROPOGATE routine. Fills the hole, then fills the holes the lemmas leave a single production for (see
+# src/propagate.py). Returns a lemma the assignment violates if propagation finds a conflict, or None.
+def propogate(program: AST, hp, prop: Propagator) -> Lemma:
     id = hp[0].id
     p = hp[1]
-    program.root = program.fill(program.root, id, p)
-    #program.print_program()
-    return program
+    program.fill(id, p)
+    return prop.propagate(program)
+
 
-# Transforms the AST representing a program into an SMT formula. Denoted as Phi_P in the paper
+# The number of distinct decision levels that the nodes of a lemma were filled at (the "literal block distance" of
+# SAT solvers). Lemmas with a low LBD tie few decisions together, and are kept when the lemma database is reduced.
+def lbd(program: AST, lemma: Lemma) -> int:
+    levels = set()
+    for (t, entry) in enumerate(program.trail):
+        if entry[0] in lemma.blocked:
+            levels.add(bisect.bisect_right(program.trail_lim, t))
+    return max(len(levels), 1)
 
 
+# The BACKTRACK routine. Undoes the assignments made after the given decision level.
+def backtrack(ast: AST, level: int):
+    ast.backtrack(level)
+    return ast
 
 
+# The decision level to backjump to after learning `lemmas` on a conflict at the current level. For each lemma, that is
+# the deepest level at which it has a single node left to undo: every other node of the lemma keeps its operator, and
+# the node that is undone still exists, so the propagator prunes its operators right away. Levels in between have no
+# part in the conflict, and their decisions are undone too instead of being searched under first. Nodes created by a
+# fill count at that fill's level. Goes back at least one level.
+def backjump_level(program: AST, lemmas: list) -> int:
+    top = program.decision_level()
+    if len(lemmas) == 0:
+        return top - 1
+    pos = {}  # The trail position of each filled node
+    created = {}  # The trail position of the fill that created each node
+    for (t, entry) in enumerate(program.trail):
+        pos[entry[0]] = t
+        for c in entry[2]:
+            created[c] = t
+    target = 0
+    for lemma in lemmas:
+        if any(n not in pos for n in lemma.blocked):  # Not violated, so it doesn't say which decisions to undo
+            return top - 1
+        u = max(lemma.blocked, key=pos.get)
+        levels = [bisect.bisect_right(program.trail_lim, pos[n]) for n in lemma.blocked if n != u]
+        if u in created:
+            levels.append(bisect.bisect_right(program.trail_lim, created[u]))
+        level_u = bisect.bisect_right(program.trail_lim, pos[u])
+        target = max(target, min(max(levels + [0]), level_u - 1))
+    return min(target, top - 1)
+
+
+# Restart policies: the number of conflicts allowed before the i-th restart (i = 0, 1, ...), as a multiple of
+# RESTART_BASE. A restart undoes every decision but keeps the lemmas, so the search starts over from the top of the
+# program with what it learned, instead of staying stuck under an early bad decision.
+RESTART_BASE = 16
+RESTART_FACTOR = 1.5
 
-# Dummy function of the BACKTRACK routine
-def backtrack(ast: AST, omega):
-    return ast
 
-#
-def is_not_empty(kappa : set) -> bool:
-    return bool(kappa)
+# The i-th term of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, ...
+def luby(i: int) -> int:
+    (size, k) = (1, 0)  # The prefix of the sequence that contains the i-th term has 2^(k+1) - 1 terms
+    while size < i + 1:
+        (size, k) = (2 * size + 1, k + 1)
+    while size - 1 != i:
+        (size, k) = ((size - 1) // 2, k - 1)
+        i = i % size
+    return 1 << k
+
+
+RESTARTS = {
+    'none': None,
+    'luby': lambda i: RESTART_BASE * luby(i),
+    'geometric': lambda i: int(RESTART_BASE * RESTART_FACTOR ** i),
+}
+
+# The number of examples CEGIS starts with
+CEGIS_START = 1
+
+# The ways to learn lemmas from a conflict: 'decision' blocks the operator of the last decision, 'core' blocks the
+# combination of operators of all the nodes in the conflict, and 'generalize' also blocks every other operator of
+# those nodes that conflicts for the same reason
+LEMMA_POLICIES = {
+    'decision': naive_analyze_conflict,
+    'core': core_analyze_conflict,
+    'generalize': generalize_analyze_conflict,
+}
+
+CANCEL_POLL = 0.05  # Seconds between two looks at the cancel event of a search, see `interrupt_on_cancel`
 
 # The SYNTHESIZE loop to be called from main.
-def synthesize(max_iter: int, grammar):
+# `program_cls` picks how the program is stored: `AST` (a tree of Node objects) or `CompactAST` (arrays).
+# `time_limit` is a wall-clock budget in seconds. If a `Stats` object is passed, it is filled in with the outcome and
+# the counters of the run. Returns the program and the `Stats` of the run.
+# The search can be varied (e.g., by the portfolio in src/portfolio.py) with:
+#   seed         - seeds the random choices of DECIDE, which also breaks ties between greedy choices at random
+#   heuristic    - the hole-selection heuristic, a key of HEURISTICS
+#   random_walk  - the probability of picking a random candidate instead of the greedy one
+#   lemma_policy - a key of LEMMA_POLICIES, how a conflict is turned into lemmas
+#   exchange     - an object with `send(lemmas)` and `receive()`, to share lemmas with other searches
+#   model        - a trained `Model` (src/model.py) that ranks the candidates of DECIDE
+#   lemma_cap    - the number of lemmas past which the least useful ones are evicted (see `LemmaDB`)
+#   backjump     - on a conflict, go back to the level the lemmas implicate (see `backjump_level`) instead of the
+#                  previous level
+#   restarts     - a key of RESTARTS, when to start over from the root program (keeping the lemmas)
+#   cegis        - check conflicts against a small active set of examples (the first CEGIS_START), verify every
+#                  complete program on all the examples with the interpreter, and add the first one it gets wrong
+#                  to the active set. The solver's work then grows with the examples that matter, not the spec.
+#   batch        - 0 to check conflicts one example at a time, n > 0 to check all the examples in one query per
+#                  batch, over n batches on n threads (see `SpecContext.batch_check`). A batched query that comes back
+#                  unknown is checked again one example at a time.
+#   abstract     - evaluate partial programs abstractly on the examples before calling the solver on them (see
+#                  src/abstract.py); a program that can't produce an output conflicts without a solver call
+#   trace        - a `Trace` (src/stats.py) to log the search to, as JSON lines
+#   semantics    - a `Semantics` of the grammar to reuse, e.g., one kept warm across requests by src/server.py
+#   cancel       - an object with `is_set()`, e.g., an Event; once it is set, the solver check that is running is
+#                  interrupted, and the search stops at the next round
+def synthesize(max_iter: int, grammar, spec: Spec, program_cls=AST, time_limit: float = None, stats: Stats = None,
+               seed: int = None, heuristic: str = 'smallest', random_walk: float = 0.0, lemma_policy: str = 'decision',
+               exchange=None, model: Model = None, lemma_cap: int = None, backjump: bool = False,
+               restarts: str = 'none', cegis: bool = True, batch: int = 0, abstract: bool = True,
+               trace: Trace = None, semantics: Semantics = None, cancel=None):
     # Initialize
-    omega = []  # List of lemmas learned
-    program = AST(grammar)
+    if stats is None:
+        stats = Stats()
+    rounds = trace if trace is not None and trace.level >= TRACE_ROUND else None  # Per-round events
+    detail = trace if trace is not None and trace.level >= TRACE_DETAIL else None
+    rng = None if seed is None else random.Random(seed)
+    analyze_conflict = LEMMA_POLICIES[lemma_policy]
+    jump = backjump_level if backjump else (lambda program, lemmas: program.decision_level() - 1)
+    restart_limit = RESTARTS[restarts]
+    conflicts = 0  # Since the last restart
+    table = None if model is None else model.compile(grammar)  # Log probabilities of the productions, per context
+    start = time.perf_counter()
+    deadline = None if time_limit is None else start + time_limit
+    omega = LemmaDB(lemma_cap)  # The lemmas learned
+    active = spec.subset(range(min(CEGIS_START, len(spec)))) if cegis else spec  # The examples conflicts are checked on
+    ctx = SpecContext(active, batch)  # The examples are compiled into a solver once, and reused by every conflict check
+    ctx.set_deadline(deadline)  # Every check gets the time left, so none runs past the budget
+    ctx.cancel = cancel
+    done = threading.Event()
+    if cancel is not None:
+        threading.Thread(target=interrupt_on_cancel, args=(weakref.ref(ctx), cancel, done), daemon=True).start()
+    if semantics is None:
+        semantics = Semantics(grammar)  # The formulas of the operators, built once per grammar
+    prefilter = AbstractSemantics(semantics) if abstract else None
+    program = program_cls(grammar)
     program.root = program.make_root()
-    print(f"Starting program: {program.root.non_terminal}")
+    spec_cache = SpecCache(program, semantics)  # Phi_P, updated on every fill and undo
+    prop = Propagator(program, omega)  # The domains of the holes, updated on every fill, undo and new lemma
+    if rounds:
+        rounds.emit("start", root=program.root.non_terminal, examples=len(spec.examples), policy=lemma_policy)
+
+    # Adds lemmas to the knowledge base, and counts the new ones
+    def learn(lemmas: list):
+        for l in lemmas:
+            stats.learned += omega.add(l, lbd(program, l))
+        if rounds:
+            rounds.emit("lemmas", level=program.decision_level(), lemmas=[repr(l) for l in lemmas])
 
+    stats.status = "max_iter"
     # Setting an iteration cap since there is no guarantee of termination yet
     for i in range(max_iter):
-        (h, p) = decide(program, omega)
-        prev_program = deepcopy(program)  # to undo the current assignment
-        program = propogate(program, (h, p), omega)
-        kappa = check_conflict(program)
-
-        #print("Previous program:")
-        #prev_program.print_program()
-        print(f"Program on round {i + 1}:")
-        program.print_program()  # Just to check progress
-
-        if is_not_empty(kappa):
-            print("Blocking current assignment and backtracking.")
-            new_lemmas = naive_analyze_conflict(program, kappa, h)
-            omega = omega + new_lemmas
-            print("Current Knowledge base:")
-            print(omega)
-            program = prev_program  # this is "backtracking"
-            print("Previous program:")
-            program.print_program()
-            #program = backtrack(program, omega)
-
-        if is_unsat(omega):
-            print("Program Spec Cannot Be Satisified!")
-            return program
-        elif program.is_concrete():
-            print("A valid program was found. Returning program.")
-            return program
-
-    return program
-
-
-
-
-def main():
-    # Example:
-    dir = os.path.dirname(__file__)
+        if deadline is not None and time.perf_counter() > deadline:
+            stats.status = "timeout"
+            break
+        if cancel is not None and cancel.is_set():
+            stats.status = "cancelled"
+            break
+        stats.rounds += 1
+        if exchange is not None:
+            for l in exchange.receive():
+                omega.add(l)
+        t = time.perf_counter()
+        conflict = prop.propagate(program)  # The lemmas learned since the last round
+        stats.timed('propagate', t)
+        choice = None
+        if conflict is None:
+            t = time.perf_counter()
+            choice = decide(program, omega, heuristic, random_walk, rng, table, prop, stats, detail)
+            stats.timed('decide', t)
+            if choice is None:
+                # No hole can be filled without violating a lemma, so the assignment itself is a conflict
+                conflict = Lemma({id: {op} for (id, op) in program.assignment().items()})
+        if conflict is not None:
+            stats.conflicts += 1
+            if program.decision_level() == 0:
+                stats.status = "unsat"
+                break
+            learn([conflict])
+            program = backtrack(program, jump(program, [conflict]))
+            conflicts += 1
+            continue
+        (h, p) = choice
+        program.new_level()
+        t = time.perf_counter()
+        conflict = propogate(program, (h, p), prop)
+        stats.timed('propagate', t)
+        kappa = None
+        if conflict is None:
+            t = time.perf_counter()
+            kappa = check_conflict(program, ctx, spec_cache, stats, prefilter)
+            if cegis and not kappa and program.is_concrete():
+                j = counterexample(program, spec.examples)
+                if j is not None:  # Check again with the counterexample, which now conflicts
+                    ctx.add_example(spec.examples[j])
+                    if rounds:
+                        rounds.emit("counterexample", example=j, active=len(ctx.spec))
+                    kappa = check_conflict(program, ctx, spec_cache, stats, prefilter)
+            stats.timed('check_conflict', t)
+        if rounds:
+            rounds.emit("round", round=i + 1, level=program.decision_level(), hole=h.id, op=p[0],
+                        conflict=conflict is not None or bool(kappa))
+        if detail:
+            detail.emit("program", program=program.to_program())
+
+        if conflict is not None:
+            stats.conflicts += 1
+            learn([conflict])
+            program = backtrack(program, jump(program, [conflict]))
+            conflicts += 1
+        elif kappa:
+            stats.conflicts += 1
+            t = time.perf_counter()
+            new_lemmas = analyze_conflict(program, kappa, h, ctx, semantics)
+            level = jump(program, new_lemmas)
+            if len(new_lemmas) == 0 or all(t[2] != h.id for t in kappa):
+                # The conflict doesn't involve the last decision, e.g., a counterexample made an earlier partial program
+                # infeasible. Undoing the decision alone would only lead to making it again, so block the nodes of the
+                # conflict and go back to the level they implicate.
+                if len(new_lemmas) == 0:
+                    new_lemmas = core_analyze_conflict(program, kappa, h)
+                level = backjump_level(program, new_lemmas)
+            if len(new_lemmas) == 0:  # Never go back without learning something: block the whole assignment
+                new_lemmas = [Lemma({id: {op} for (id, op) in program.assignment().items()})]
+            stats.timed('analyze', t)
+            learn(new_lemmas)
+            omega.decay_activity()
+            if exchange is not None:
+                exchange.send(new_lemmas)
+            program = backtrack(program, level)
+            conflicts += 1
+
+        if restart_limit is not None and conflicts >= restart_limit(stats.restarts):
+            if rounds:
+                rounds.emit("restart", restarts=stats.restarts + 1, lemmas=len(omega))
+            program = backtrack(program, 0)
+            stats.restarts += 1
+            conflicts = 0
+
+        if program.is_concrete():
+            stats.status = "solved"
+            break
+
+    stats.examples = len(ctx.spec)
+    stats.solver_calls = ctx.calls
+    stats.lemmas = len(omega)
+    stats.evicted = omega.evicted
+    stats.forced = prop.forced
+    stats.time = time.perf_counter() - start
+    done.set()
+    if rounds:
+        rounds.emit("end", status=stats.status, rounds=stats.rounds, time=stats.time, program=program.to_program())
+    return (program, stats)
+
+
+
+
+# Interrupts the solver checks of a `SpecContext` while `cancel` is set, on a thread of its own, so that a cancelled
+# search doesn't wait for the check that is running to end. Runs until `done` is set, or until the search drops the
+# context (e.g., it raised). The interrupt is repeated, in case a check starts just as `cancel` is set; the checks that
+# start later see `cancel` themselves (see `SpecContext.expired`).
+def interrupt_on_cancel(ctx: weakref.ref, cancel, done):
+    while not done.wait(CANCEL_POLL):
+        c = ctx()
+        if c is None:
+            return
+        if cancel.is_set():
+            c.interrupt()
+        del c  # Not held while waiting
+
+
+# The search engines: the conflict-driven `synthesize` loop, and bottom-up enumeration (src/bottom_up.py)
+ENGINES = ['cdps', 'bottom-up']
+
+# How `synthesize` stores the program (its `program_cls`): a tree of Node objects, or arrays (src/compact_ast.py)
+PROGRAMS = {'tree': AST, 'compact': CompactAST}
+
+
+# Runs one of the ENGINES on a problem. Returns the program as an S-expression (see `AST.to_program`); a partial program
+# or None if it wasn't solved, which `stats.status` tells apart. `options` are passed on to `synthesize`.
+def solve(grammar, spec: Spec, engine: str = 'cdps', max_iter: int = 20, time_limit: float = None,
+          stats: Stats = None, **options):
+    if engine == 'bottom-up':
+        return bottom_up(grammar, spec, time_limit=time_limit, stats=stats)
+    if engine != 'cdps':
+        raise ValueError(f"Unknown engine: {engine}")
+    (program, stats) = synthesize(max_iter, grammar, spec, time_limit=time_limit, stats=stats, **options)
+    return program.to_program()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthesize a program for a SyGuS PBE problem")
     # NOTE: Certain examples don't parse at the moment. See more in the README
-    file = "examples/example5.sl"
-    filename = os.path.join(dir, file)
-    with open(filename) as f:
-        input_str = f.read()
-        lines = input_to_list(input_str)
-        nonterms, terms, productions, start_sym = get_grammar(lines)
-
-        print("Non-terminals (V):")
-        print(nonterms[0])
-        print("Non-terminal types:")
-        print(nonterms[1])
-        print("Terminal Symbols (Sigma):")
-        print(terms)
-        print("Production/Rewrite Rules (R):")
-        for k in productions.keys():
-            for p in productions[k]:
-                if len(p[1]) > 0:
-                    print(f"{k} -> {p[0]} {p[1]}")
-                else:
-                    print(f"{k} -> {p[0]}")
-        print("Start Symbol (S):")
-        print(start_sym)
-        print("\n")
-
-    max_iter: int = 20
-    g = ([t[0] for t in nonterms[0]], list(terms), productions, start_sym[0])
-    p = synthesize(max_iter, g)
+    parser.add_argument("file", nargs="?", default=os.path.join(os.path.dirname(__file__), "examples/example5.sl"),
+                        help="a .sl file (examples/example5.sl by default)")
+    parser.add_argument("--engine", choices=ENGINES, default='cdps', help="the search engine")
+    parser.add_argument("--iters", type=int, default=20, help="iteration budget of the cdps engine")
+    parser.add_argument("--ast", choices=list(PROGRAMS), default='tree', help="how the cdps engine stores the program")
+    parser.add_argument("--model", help="a model trained with src/model.py, to guide DECIDE")
+    parser.add_argument("--lemma-policy", choices=list(LEMMA_POLICIES), default='decision',
+                        help="how conflicts are turned into lemmas")
+    parser.add_argument("--backjump", action="store_true", help="backjump to the level the lemmas implicate")
+    parser.add_argument("--restarts", choices=list(RESTARTS), default='none', help="the restart policy")
+    parser.add_argument("--no-cegis", action="store_true", help="check every conflict against all the examples")
+    parser.add_argument("--batch", type=int, default=0, metavar="N",
+                        help="check all the examples in one query, split over N threads (0: one example at a time)")
+    parser.add_argument("--no-abstract", action="store_true",
+                        help="call the solver on every partial program, without the abstract pre-filter")
+    parser.add_argument("--trace", help="write a JSON lines trace of the search to this file ('-' for stderr)")
+    parser.add_argument("--trace-level", type=int, choices=[TRACE_ROUND, TRACE_DETAIL], default=TRACE_ROUND,
+                        help="1: one event per round, 2: also the candidates and the program of every round")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile the search, and write the profiles to DIR (see src/profiling.py)")
+    args = parser.parse_args(argv)
+    filename = args.file
+    g, spec = load_problem(filename)  # Parsed once, then read from the cache (see src/cache.py)
+    non_terminals, terminals, productions, start_sym, types = g
+
+    print("Non-terminals (V):")
+    print(non_terminals)
+    print("Non-terminal types:")
+    print(types)
+    print("Terminal Symbols (Sigma):")
+    print(terminals)
+    print("Production/Rewrite Rules (R):")
+    for k in productions.keys():
+        for p in productions[k]:
+            if len(p[1]) > 0:
+                print(f"{k} -> {p[0]} {p[1]}")
+            else:
+                print(f"{k} -> {p[0]}")
+    print("Start Symbol (S):")
+    print(start_sym)
+    print("Examples:")
+    for (env, out) in spec.examples:
+        print(f"{env} -> {out!r}")
+    print("\n")
+
+    profiler = Profiler() if args.profile is not None else contextlib.nullcontext()
+    if args.engine == 'bottom-up':
+        with profiler:
+            p = bottom_up(g, spec)
+        print(p)
+        if args.profile is not None:
+            profiler.write(profile_prefix(args.profile, filename), filename)
+        return p
+    max_iter: int = args.iters
+    model = None if args.model is None else load_model(args.model)
+    trace = None
+    if args.trace is not None:
+        stream = sys.stderr if args.trace == '-' else open(args.trace, "w")
+        trace = Trace(stream, args.trace_level)
+    try:
+        with profiler:
+            (p, stats) = synthesize(max_iter, g, spec, program_cls=PROGRAMS[args.ast], model=model,
+                                    lemma_policy=args.lemma_policy, backjump=args.backjump, restarts=args.restarts,
+                                    cegis=not args.no_cegis, batch=args.batch, abstract=not args.no_abstract,
+                                    trace=trace)
+    finally:
+        if trace is not None and trace.stream is not sys.stderr:
+            trace.stream.close()
+    if args.profile is not None:
+        prefix = profile_prefix(args.profile, filename)
+        summary = profiler.write(prefix, filename)
+        print(f"Profile written to {prefix}.*: Z3 {summary['z3']:.2f}s, python {summary['python']:.2f}s")
+    print(f"Status: {stats.status} after {stats.rounds} rounds, {stats.solver_calls} solver calls, "
+          f"{stats.lemmas} lemmas")
+    p.print_program()
+    print(stats.report())
     return p
 
 
@@ -0,0 +1,181 @@
+import argparse
+import ast
+import json
+import math
+import sys
+import numpy as np
+from src.ast import AST, label
+from src.parser import is_string_literal
+from src.semantics import OPS
+
+# A probabilistic model of programs for DECIDE: a PCFG whose context is the operator of the parent node and the
+# position of the child under it. It is trained offline on solved programs (e.g., the results of src/bench.py) and
+# saved as JSON counts. For a given grammar the counts are compiled once into a `ScoreTable`, a numpy array of log
+# probabilities indexed by (context, production), so scoring every candidate of a decision is one array lookup.
+#
+# Usage:
+#   python -m src.model train results.json [more.json ...] -o model.json
+#   python -m src.bench small --model model.json
+#
+# Input variables are named differently in every benchmark, so they are all counted as the token '<var>'. Operators
+# and constants are counted as themselves.
+
+VERSION = 1
+ROOT = '<root>'
+VAR = '<var>'
+
+
+# The token a terminal is counted as
+def token(op) -> str:
+    if isinstance(op, bool):
+        return str(op).lower()
+    if isinstance(op, int) or op in OPS or is_string_literal(op) or op in ('true', 'false'):
+        return str(op)
+    return VAR
+
+
+class Model:
+    # `alpha` smooths the unconditional distribution of the tokens, and `beta` is the weight of that distribution as a
+    # prior of the distribution in each context
+    def __init__(self, alpha: float = 1.0, beta: float = 2.0):
+        self.alpha = alpha
+        self.beta = beta
+        self.counts = {}  # Maps a context "parent op/position" to a dict token -> count
+        self.totals = {}  # Maps a token to its count over all contexts
+
+    # Counts the productions of a program, given as an S-expression (see `AST.to_program`)
+    def add_program(self, program):
+        stack = [(program, ROOT, 0)]
+        while stack:
+            (p, parent, j) = stack.pop()
+            if isinstance(p, list):
+                (op, children) = (p[0], p[1])
+            else:
+                (op, children) = (p, [])
+            tok = token(op)
+            ctx = context_key(parent, j)
+            self.counts.setdefault(ctx, {})
+            self.counts[ctx][tok] = self.counts[ctx].get(tok, 0) + 1
+            self.totals[tok] = self.totals.get(tok, 0) + 1
+            for (i, c) in enumerate(children):
+                stack.append((c, token(op), i))
+
+    def train(self, programs: list):
+        for p in programs:
+            self.add_program(p)
+        return self
+
+    # log P(tok | ctx), with the unconditional distribution as a Dirichlet prior
+    def log_prob(self, ctx: str, tok: str) -> float:
+        n = sum(self.totals.values())
+        v = len(self.totals) + 1  # +1 for the tokens that were never seen
+        prior = (self.totals.get(tok, 0) + self.alpha) / (n + self.alpha * v)
+        counts = self.counts.get(ctx, {})
+        total = sum(counts.values())
+        return math.log((counts.get(tok, 0) + self.beta * prior) / (total + self.beta))
+
+    def save(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump({"version": VERSION, "alpha": self.alpha, "beta": self.beta, "counts": self.counts}, f, indent=1)
+
+    # Compiles the model for a grammar
+    def compile(self, grammar) -> 'ScoreTable':
+        return ScoreTable(self, grammar)
+
+
+def context_key(parent: str, j: int) -> str:
+    return f"{parent}/{j}"
+
+
+# The key of a production of a non-terminal, by value
+def prod_key(nt: str, p) -> tuple:
+    return (nt, p[0], tuple(p[1]))
+
+
+def load(filename: str) -> Model:
+    with open(filename) as f:
+        data = json.load(f)
+    if data.get("version") != VERSION:
+        raise ValueError(f"{filename}: unsupported model version {data.get('version')}")
+    model = Model(data["alpha"], data["beta"])
+    model.counts = data["counts"]
+    for counts in model.counts.values():
+        for (tok, n) in counts.items():
+            model.totals[tok] = model.totals.get(tok, 0) + n
+    return model
+
+
+# Reads the solved programs out of result files of src/bench.py
+def read_results(filenames: list) -> list:
+    programs = []
+    for filename in filenames:
+        with open(filename) as f:
+            results = json.load(f)
+        for r in results:
+            if r.get("solved") and r.get("program"):
+                programs.append(ast.literal_eval(r["program"]))
+    return programs
+
+
+# The log probabilities of a model for one grammar. Contexts are numbered 0 for the root, and 1 + op * k + j for the
+# j-th child of a node with the op-th operator of the grammar; productions are numbered in the order of the grammar.
+class ScoreTable:
+    def __init__(self, model: Model, grammar):
+        prods = grammar[2]
+        self.ops = list(dict.fromkeys(p[0] for nt in prods for p in prods[nt] if len(p[1]) > 0))
+        self.op_index = {op: i for (i, op) in enumerate(self.ops)}
+        self.k = max(max([len(p[1]) for nt in prods for p in prods[nt]] + [0]), 2)  # The arity of the AST labels
+        self.prod_index = {}  # Keyed by `prod_key`, so a copy of the grammar (e.g., from the cache) scores the same
+        toks = []
+        for nt in prods:
+            for p in prods[nt]:
+                self.prod_index[prod_key(nt, p)] = len(toks)
+                toks.append(token(p[0]))
+        contexts = [context_key(ROOT, 0)]
+        for op in self.ops:
+            contexts.extend(context_key(token(op), j) for j in range(self.k))
+        self.table = np.array([[model.log_prob(ctx, tok) for tok in toks] for ctx in contexts])
+
+    # The context index of a hole, from its position: the parent's id is found from the hole's label, and its operator
+    # from the program's assignment
+    def context(self, program: AST, h) -> int:
+        if h.d == 1:
+            return 0
+        k = self.k
+        parent = label(k, h.d - 1, (h.i - 1) // k + 1)
+        op = program.assignment().get(parent)
+        if op not in self.op_index:
+            return 0
+        return 1 + self.op_index[op] * k + (h.i - 1) % k
+
+    # The log probabilities of a list of candidates (hole, production)
+    def scores(self, program: AST, candidates: list):
+        ctx = {}
+        rows = []
+        for (h, p) in candidates:
+            if h.id not in ctx:
+                ctx[h.id] = self.context(program, h)
+            rows.append(ctx[h.id])
+        cols = [self.prod_index[prod_key(h.non_terminal, p)] for (h, p) in candidates]
+        return self.table[rows, cols]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the DECIDE model on solved programs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="train a model on the results of src/bench.py")
+    train.add_argument("results", nargs="+", help="JSON result files")
+    train.add_argument("-o", "--output", required=True, help="where to save the model")
+    train.add_argument("--alpha", type=float, default=1.0)
+    train.add_argument("--beta", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    programs = read_results(args.results)
+    model = Model(args.alpha, args.beta).train(programs)
+    model.save(args.output)
+    print(f"Trained on {len(programs)} programs, {len(model.counts)} contexts, {len(model.totals)} tokens")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
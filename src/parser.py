@@ -1,3 +1,6 @@
+import re
+from src.spec import Spec
+
 # Being explicit about Types
 Symbol = str
 Number = (int, float)
@@ -6,27 +9,45 @@ List = list
 Expr = (Atom, List)
 
 
-def input_to_list(string: str) -> [str]:
+# A token is a string literal (which may contain spaces, parentheses and escaped quotes `""`), a parenthesis, a
+# comment (dropped), or an atom. A lone `"` starts a string literal that continues on the next line.
+TOKEN = re.compile(r'"(?:[^"]|"")*"|[()]|;.*|[^\s()";]+|"')
+
+
+def generate_tokens(source):
+    "Lazily convert a string, or an iterable of lines (e.g., an open file), into tokens. One pass, linear time."
+    if isinstance(source, str):
+        source = source.splitlines(keepends=True)
+    pending: str = ""  # The start of a string literal that spans several lines
+    for line in source:
+        if pending:
+            line = pending + line
+            pending = ""
+        for m in TOKEN.finditer(line):
+            token = m.group()
+            if token[0] == ";":
+                continue
+            if token == '"':
+                pending = line[m.start():]
+                break
+            yield token
+    if pending:
+        raise SyntaxError('unterminated string literal')
+
+
+def read_sexprs(source):
+    "Lazily read the top-level S-expressions (the commands of a .sl file) from a string or an iterable of lines."
+    return read_sexprs_from_tokens(generate_tokens(source))
+
+
+def input_to_list(string: str) -> [Expr]:
     "Parse a .sl file into a list of S-Expressions."
-    n: int = 0
-    result: [str] = []
-    s: str = ""
-    for c in string:
-        if c == "(":
-            n += 1
-        if c == ")":
-            n -= 1
-        if c != "\n":
-            s += c
-        if n == 0 and s != "":
-            result.append(s)
-            s = ""
-    return result
+    return list(read_sexprs(string))
 
 
 def tokenize(chars: str) -> list:
     "Convert a string of characters into a list of tokens."
-    return chars.replace('(', ' ( ').replace(')', ' ) ').replace('" "', 'space').split()
+    return list(generate_tokens(chars))
 
 
 def parse(program: str) -> Expr:
@@ -34,25 +55,39 @@ def parse(program: str) -> Expr:
     return read_from_tokens(tokenize(program))
 
 
-def read_from_tokens(tokens: list) -> Expr:
+def read_from_tokens(tokens) -> Expr:
     "Read an expression from a sequence of tokens."
-    if len(tokens) == 0:
+    exprs = read_sexprs_from_tokens(iter(tokens))
+    try:
+        return next(exprs)
+    except StopIteration:
+        raise SyntaxError('unexpected EOF')
+
+
+def read_sexprs_from_tokens(tokens):
+    "Build the S-expressions from a stream of tokens with an explicit stack, yielding each top-level one when done."
+    stack = []  # The lists that are still open, innermost last
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) == 0:
+                raise SyntaxError('unexpected )')
+            expr = stack.pop()
+            if stack:
+                stack[-1].append(expr)
+            else:
+                yield expr
+        elif stack:
+            stack[-1].append(atom(token))
+        else:
+            yield atom(token)
+    if stack:
         raise SyntaxError('unexpected EOF')
-    token = tokens.pop(0)
-    if token == '(':
-        L = []
-        while tokens[0] != ')':
-            L.append(read_from_tokens(tokens))
-        tokens.pop(0)  # pop off ')'
-        return L
-    elif token == ')':
-        raise SyntaxError('unexpected )')
-    else:
-        return atom(token)
 
 
 def atom(token: str) -> Atom:
-    "Numbers become numbers; every other token is a symbol."
+    "Numbers become numbers; every other token is a symbol. String literals keep their quotes."
     try:
         return int(token)
     except ValueError:
@@ -62,34 +97,71 @@ def atom(token: str) -> Atom:
             return Symbol(token)
 
 
+UNICODE_ESCAPE = re.compile(r'\\u\{([0-9a-fA-F]{1,5})\}|\\u([0-9a-fA-F]{4})')
+
+
+def unquote(literal: str) -> str:
+    "The value of a string literal token: `\"a\"\"b\"` is 'a\"b', and unicode escapes like `\\u{48}` are decoded."
+    s = literal[1:-1].replace('""', '"')
+    if "\\u" in s:
+        s = UNICODE_ESCAPE.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)), s)
+    return s
+
+
+def is_string_literal(symbol) -> bool:
+    return isinstance(symbol, str) and len(symbol) >= 2 and symbol[0] == '"' and symbol[-1] == '"'
+
+
+# Commands may be given as strings (they are parsed) or as already parsed S-expressions
+def as_command(line):
+    if isinstance(line, str):
+        return parse(line)
+    return line
+
+
 def get_start(cmd) -> str:
     assert (cmd[0] == "synth-fun")
     return cmd[4][0]
 
 
+# The non-terminals in the order they are declared, and their sorts
 def get_nonterminals(cmd):
-    nonterms = set()
+    nonterms = []
     type_dict = {}
     assert (cmd[0] == "synth-fun")
     for elem in cmd[4]:
         nt = elem[0]
         typ = elem[1]
-        nonterms.add(nt)
+        if nt not in type_dict:
+            nonterms.append(nt)
         type_dict[nt] = typ
     return (nonterms, type_dict)
 
 
+# The grammar is either given as a list of non-terminal declarations followed by the rules (SyGuS v2, e.g.,
+# `examples/example5.sl`), or as the rules alone (SyGuS v1, e.g., the PBE_Strings benchmarks)
+def get_rules(cmd):
+    if len(cmd) > 5:
+        return cmd[5]
+    return cmd[4]
+
+
+# The terminals and the productions of each non-terminal, in the order of the file. The terminals are a dict used as an
+# ordered set, so the grammar (and the search, which goes through it in order) is the same from one run to the next.
 def get_terms_prods(cmd):
-    terminals = set()
+    terminals = {}
     productions = {}
-    for nonterm_list in cmd[5]:
+    for nonterm_list in get_rules(cmd):
         non_term = nonterm_list[0]
         product = []
         for t in nonterm_list[2]:
             # Non-terminals that go with a production
             nts = []
 
-            if isinstance(t, list):
+            if isinstance(t, list) and t[0] in ("Constant", "Variable"):
+                # SyGuS v2 `(Constant Int)` and `(Variable Int)` stand for any constant or input of that sort
+                term = t
+            elif isinstance(t, list):
                 # gets a terminal from the input, e.g., `"+"`
                 term = t[0]
                 # List of potential non-terminal children, e.g, `["I", "I"]` for `"+"`
@@ -99,20 +171,123 @@ def get_terms_prods(cmd):
 
             if isinstance(term, list):
                 term = tuple(term)
-            terminals.add(term)
+            terminals[term] = None
 
             product.append((term, nts))
         productions[non_term] = product
+    inline_chain_rules(terminals, productions)
     return terminals, productions
 
+
+# Replaces rules like `Start -> ntString`, where the right-hand side is a lone non-terminal, by the productions of that
+# non-terminal. Cycles like `A -> B`, `B -> A` are dropped.
+def inline_chain_rules(terminals: dict, productions: dict):
+    def expand(nt, seen):
+        result = []
+        for p in productions[nt]:
+            if len(p[1]) == 0 and isinstance(p[0], str) and p[0] in productions:
+                if p[0] not in seen:
+                    result += expand(p[0], seen | {p[0]})
+            else:
+                result.append(p)
+        return result
+
+    expanded = {nt: expand(nt, {nt}) for nt in productions}
+    for nt in productions:
+        terminals.pop(nt, None)
+        productions[nt] = expanded[nt]
+
+
 def get_grammar(lines: [str]):
-    s_exprs = []
     for line in lines:
-        s_exprs.append(parse(line))
-    for s in s_exprs:
-        if s[0] == "synth-fun":
+        s = as_command(line)
+        if isinstance(s, list) and s[0] == "synth-fun":
             start_sym = get_start(s)
             nonterminals = get_nonterminals(s)
             terminals, productions = get_terms_prods(s)
             return nonterminals, terminals, productions, start_sym
 
+
+# Converts a literal in a constraint to a python value, e.g., `"Nancy"` becomes 'Nancy' and `-1` stays an int.
+def get_value(expr):
+    if isinstance(expr, list) and len(expr) == 2 and expr[0] == "-" and isinstance(expr[1], int):
+        return -expr[1]
+    if isinstance(expr, str):
+        if expr == "true":
+            return True
+        if expr == "false":
+            return False
+        if is_string_literal(expr):
+            return unquote(expr)
+    if isinstance(expr, (int, str)):
+        return expr
+    raise SyntaxError(f"Not a literal: {expr}")
+
+
+# Reads an example from a constraint of the form `(= (f "in1" "in2") "out")` (or with the sides swapped)
+def get_example(cmd, func_name: str, params: list):
+    body = cmd[1]
+    if not (isinstance(body, list) and len(body) == 3 and body[0] == "="):
+        raise SyntaxError(f"Only input/output constraints are supported: {cmd}")
+    if isinstance(body[1], list) and len(body[1]) > 0 and body[1][0] == func_name:
+        call, out = body[1], body[2]
+    elif isinstance(body[2], list) and len(body[2]) > 0 and body[2][0] == func_name:
+        call, out = body[2], body[1]
+    else:
+        raise SyntaxError(f"Only input/output constraints are supported: {cmd}")
+    if len(call) - 1 != len(params):
+        raise SyntaxError(f"Wrong number of inputs to {func_name}: {cmd}")
+    env = {p[0]: get_value(v) for (p, v) in zip(params, call[1:])}
+    return (env, get_value(out))
+
+
+# Reads the signature of the synthesized function, given by a `synth-fun` command, into an empty Spec
+def get_signature(synth_fun) -> Spec:
+    func_name = synth_fun[1]
+    params = [(p[0], p[1]) for p in synth_fun[2]]
+    return Spec(func_name, params, synth_fun[3])
+
+
+# Reads the signature of the synthesized function and the `constraint` commands into a Spec
+def get_spec(lines: [str]) -> Spec:
+    spec = None
+    constraints = []  # Constraints that come before the synth-fun command
+    for line in lines:
+        s = as_command(line)
+        if not isinstance(s, list):
+            continue
+        if s[0] == "synth-fun" and spec is None:
+            spec = get_signature(s)
+        elif s[0] == "constraint":
+            constraints.append(s)
+        if spec is not None:
+            for c in constraints:
+                spec.add_example(get_example(c, spec.func_name, spec.params))
+            constraints = []
+    if spec is None:
+        raise SyntaxError("No synth-fun command in the input")
+    return spec
+
+
+# Reads a whole problem in one pass over the commands of a .sl file (a string, or an iterable of lines such as an open
+# file), without keeping the commands around. Returns the grammar, as the tuple `AST` takes, and the Spec.
+def read_problem(source):
+    grammar = None
+    spec = None
+    constraints = []  # Constraints that come before the synth-fun command
+    for s in read_sexprs(source):
+        if not isinstance(s, list):
+            continue
+        if s[0] == "synth-fun" and grammar is None:
+            nonterms, terms, productions, start_sym = get_grammar([s])
+            grammar = (list(nonterms[0]), list(terms), productions, start_sym[0], nonterms[1])
+            spec = get_signature(s)
+        elif s[0] == "constraint":
+            constraints.append(s)
+        if spec is not None:
+            for c in constraints:
+                spec.add_example(get_example(c, spec.func_name, spec.params))
+            constraints = []
+    if grammar is None:
+        raise SyntaxError("No synth-fun command in the input")
+    return grammar, spec
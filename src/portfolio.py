@@ -0,0 +1,157 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from src.cache import load_problem
+from src.interpreter import EvalError, run_examples
+from src.main import synthesize, HEURISTICS
+from src.stats import Stats
+
+# Portfolio synthesis. Races N differently configured `synthesize` searches on the same problem, one process each, and
+# returns the first program that is verified against the examples; the other searches are then killed. Solve times on
+# the harder problems vary a lot with the search order, so racing a few diverse searches cuts the tail.
+#
+# Usage:
+#   python -m src.portfolio src/benchmarks/PBE_Strings_2018_comp/phone-10.sl -n 4 --time 60
+#
+# Searches can share their lemmas: a lemma with at most `share_size` nodes is sent to every other search, which adds
+# it to its knowledge base at the start of its next round. Node ids are positional, so a lemma means the same thing in
+# every search of the same grammar. Only lemmas implied by the spec are shared: the `local` ones of the 'decision'
+# policy would make the searches that learn sound lemmas ('core', 'generalize') miss solutions.
+
+SHARE_SIZE = 2
+HEURISTIC_ORDER = ['smallest', 'shallowest', 'deepest', 'largest']
+LEMMA_ORDER = ['decision', 'decision', 'core', 'generalize', 'decision', 'generalize']
+RESTART_ORDER = ['none', 'luby', 'none', 'geometric']
+assert set(HEURISTIC_ORDER) == set(HEURISTICS.keys())
+
+
+# Returns n search configurations (keyword arguments of `synthesize`). The first one is the default search, and the
+# others vary the seed, the heuristic, the random walk probability, the lemma policy, backjumping and restarts.
+def make_configs(n: int, seed: int = 0) -> list:
+    configs = [{'seed': None, 'heuristic': 'smallest', 'random_walk': 0.0, 'lemma_policy': 'decision',
+                'backjump': False, 'restarts': 'none'}]
+    walks = [0.0, 0.05, 0.1, 0.2]
+    for i in range(1, n):
+        configs.append({
+            'seed': seed + i,
+            'heuristic': HEURISTIC_ORDER[i % len(HEURISTIC_ORDER)],
+            'random_walk': walks[(i // len(HEURISTIC_ORDER) + i) % len(walks)],
+            'lemma_policy': LEMMA_ORDER[i % len(LEMMA_ORDER)],
+            'backjump': i % 2 == 1,
+            'restarts': RESTART_ORDER[i % len(RESTART_ORDER)],
+        })
+    return configs[:n]
+
+
+# Passes lemmas between the searches of a portfolio. Every search has an inbox, and sends its short lemmas that aren't
+# `local` to the inboxes of all the others.
+class LemmaExchange:
+    def __init__(self, index: int, inboxes: list, share_size: int = SHARE_SIZE):
+        self.inbox = inboxes[index]
+        self.others = [q for (j, q) in enumerate(inboxes) if j != index]
+        self.share_size = share_size
+
+    def send(self, lemmas: list):
+        short = [l for l in lemmas if not l.local and len(l.blocked) <= self.share_size]
+        if short:
+            for q in self.others:
+                q.put(short)
+
+    def receive(self) -> list:
+        lemmas = []
+        while True:
+            try:
+                lemmas.extend(self.inbox.get_nowait())
+            except queue.Empty:
+                return lemmas
+
+
+def worker(index, config, grammar, spec, max_iter, time_limit, inboxes, results, verbose):
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    stats = Stats()
+    exchange = None
+    if inboxes is not None:
+        for q in inboxes:
+            q.cancel_join_thread()  # Don't wait at exit for searches that stopped reading their inbox
+        exchange = LemmaExchange(index, inboxes)
+    try:
+        (program, stats) = synthesize(max_iter, grammar, spec, time_limit=time_limit, stats=stats, exchange=exchange,
+                                      **config)
+        verified = False
+        if program.is_concrete():
+            try:
+                verified = run_examples(program, spec.examples)
+            except EvalError:
+                pass
+        results.put((index, stats.status, verified, program.to_program(), stats.as_dict(), None))
+    except Exception as e:
+        results.put((index, "error", False, None, stats.as_dict(), f"{type(e).__name__}: {e}"))
+
+
+# Races the configurations on one problem. Returns (program, config, stats) of the first search that finds a verified
+# program, or None if none of them does within the budgets. The program is an S-expression, as `to_program` returns.
+def portfolio(grammar, spec, n: int = None, max_iter: int = 1000, time_limit: float = None, share: bool = True,
+              configs: list = None, verbose: bool = False):
+    if configs is None:
+        configs = make_configs(n or os.cpu_count() or 1)
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    inboxes = [ctx.Queue() for _ in configs] if share else None
+    workers = []
+    for (i, config) in enumerate(configs):
+        p = ctx.Process(target=worker, args=(i, config, grammar, spec, max_iter, time_limit, inboxes, results, verbose),
+                        daemon=True)
+        p.start()
+        workers.append(p)
+
+    deadline = None if time_limit is None else time.perf_counter() + time_limit + 5.0
+    winner = None
+    try:
+        for _ in configs:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            try:
+                (i, status, verified, program, stats, error) = results.get(timeout=timeout)
+            except queue.Empty:
+                break
+            print(f"search {i} {configs[i]}: {status}" + (f" ({error})" if error else ""), file=sys.stderr)
+            if status == "solved" and verified:
+                winner = (program, configs[i], stats)
+                break
+    finally:
+        for p in workers:  # Cancel the searches that are still running
+            if p.is_alive():
+                p.kill()
+            p.join()
+    return winner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Race several search configurations on one problem")
+    parser.add_argument("file", help="a .sl file")
+    parser.add_argument("-n", type=int, default=os.cpu_count() or 1, help="number of searches")
+    parser.add_argument("--time", type=float, default=60.0, help="wall-clock budget, in seconds")
+    parser.add_argument("--iters", type=int, default=1000, help="iteration budget of each search")
+    parser.add_argument("--seed", type=int, default=0, help="base seed of the randomized searches")
+    parser.add_argument("--no-share", action="store_true", help="don't share lemmas between the searches")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of the searches")
+    args = parser.parse_args(argv)
+
+    grammar, spec = load_problem(args.file)
+    start = time.perf_counter()
+    result = portfolio(grammar, spec, max_iter=args.iters, time_limit=args.time, share=not args.no_share,
+                       configs=make_configs(args.n, args.seed), verbose=args.verbose)
+    if result is None:
+        print(f"No program found in {time.perf_counter() - start:.2f}s")
+        return 1
+    (program, config, stats) = result
+    print(f"Solved in {time.perf_counter() - start:.2f}s by {config}")
+    print(program)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
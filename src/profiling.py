@@ -0,0 +1,138 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Profiling of one run (see --profile in src/main.py and src/bench.py). A `Profiler` wraps a run in three profilers at
+# once, and writes what they found next to each other:
+#   <name>.pstats    - the cProfile data, for pstats, snakeviz, etc.
+#   <name>.collapsed - samples of the stack as collapsed stacks ("frame;frame;frame weight" per line, the weight in
+#                      microseconds), which flamegraph.pl, speedscope and inferno read
+#   <name>.txt       - the time inside Z3 against the time in python, the top functions by cumulative time, and the
+#                      top allocation sites (tracemalloc)
+#
+# Time inside Z3 is the cumulative time of the calls into the z3 package from outside it, which includes the native
+# solver. The stacks are sampled by a thread rather than on a signal: a signal handler only runs once a native call
+# returns, so the solver's time would land on whatever python line comes after it. The Z3 bindings release the GIL
+# during native calls (ctypes does), so the sampling thread sees the stack at the call instead. Each sample is
+# weighted by the time since the previous one.
+# The three profilers slow the run down (tracemalloc most of all), so the times are only good relative to each other.
+
+SAMPLE_INTERVAL = 0.005  # Seconds between samples
+TOP = 25  # Lines in each of the top-N reports
+TRACE_FRAMES = 8  # Frames kept per allocation by tracemalloc
+
+
+# Whether a function of the profile (a (filename, line, name) key of pstats) is part of the Z3 bindings
+def is_z3(func) -> bool:
+    return f"{os.sep}z3{os.sep}" in func[0]
+
+
+# A short name for a frame of a collapsed stack: the module file and the function
+def frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profiler:
+    def __init__(self, interval: float = SAMPLE_INTERVAL, top: int = TOP):
+        self.interval = interval
+        self.top = top
+        self.stacks = {}  # Maps a collapsed stack to its time, in microseconds
+        self.cpu = None
+        self.snapshot = None
+        self.peak = 0  # Peak traced memory, in bytes
+        self.wall = 0.0
+        self.sampler = None
+        self.done = threading.Event()
+
+    # The loop of the sampling thread, which samples the thread that started the profiler
+    def sample(self, thread_id: int):
+        last = time.perf_counter()
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            weight = int((now - last) * 1e6)
+            last = now
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + weight
+
+    def __enter__(self):
+        self.cpu = cProfile.Profile()
+        tracemalloc.start(TRACE_FRAMES)
+        self.done.clear()
+        self.sampler = threading.Thread(target=self.sample, args=(threading.get_ident(),), daemon=True)
+        self.sampler.start()
+        self.start = time.perf_counter()
+        self.cpu.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.cpu.disable()
+        self.wall = time.perf_counter() - self.start
+        self.done.set()
+        self.sampler.join()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return False
+
+    # Returns (seconds inside Z3, seconds profiled). The calls from Z3 back into python (e.g., __del__) are few and are
+    # left in the Z3 share.
+    def z3_split(self):
+        stats = pstats.Stats(self.cpu)
+        z3_time = 0.0
+        for (func, (cc, nc, tt, ct, callers)) in stats.stats.items():
+            if is_z3(func):
+                z3_time += sum(c[3] for (caller, c) in callers.items() if not is_z3(caller))
+        return (z3_time, stats.total_tt)
+
+    def summary(self) -> dict:
+        (z3_time, total) = self.z3_split()
+        return {
+            "wall": round(self.wall, 4),
+            "profiled": round(total, 4),
+            "z3": round(z3_time, 4),
+            "python": round(total - z3_time, 4),
+            "peak_alloc_kb": self.peak // 1024,
+        }
+
+    def report(self, title: str = "") -> str:
+        s = self.summary()
+        share = s["z3"] / s["profiled"] if s["profiled"] > 0 else 0.0
+        out = io.StringIO()
+        out.write(f"{title}\n" if title else "")
+        out.write(f"wall {s['wall']:.3f}s, profiled {s['profiled']:.3f}s: Z3 {s['z3']:.3f}s ({share:.1%}), "
+                  f"python {s['python']:.3f}s ({1 - share:.1%})\n")
+        out.write(f"peak traced memory {s['peak_alloc_kb']} KB\n\n")
+        out.write(f"Top {self.top} functions by cumulative time:\n")
+        pstats.Stats(self.cpu, stream=out).sort_stats("cumulative").print_stats(self.top)
+        out.write(f"Top {self.top} allocation sites (live at the end of the run):\n")
+        for stat in self.snapshot.statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            out.write(f"{stat.size / 1024:10.1f} KB {stat.count:8} blocks  {frame.filename}:{frame.lineno}\n")
+        return out.getvalue()
+
+    # Writes <prefix>.pstats, <prefix>.collapsed and <prefix>.txt, and returns the summary
+    def write(self, prefix: str, title: str = "") -> dict:
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        self.cpu.dump_stats(prefix + ".pstats")
+        with open(prefix + ".collapsed", "w") as f:
+            for (stack, weight) in sorted(self.stacks.items()):
+                if weight > 0:
+                    f.write(f"{stack} {weight}\n")
+        with open(prefix + ".txt", "w") as f:
+            f.write(self.report(title))
+        return self.summary()
+
+
+# The prefix of the profile files of a benchmark in a profile directory
+def profile_prefix(directory: str, filename: str) -> str:
+    return os.path.join(directory, os.path.splitext(os.path.basename(filename))[0])
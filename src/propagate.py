@@ -0,0 +1,205 @@
+from src.ast import AST, label
+from src.lemma import Lemma, LemmaDB
+
+# Unit propagation for PROPOGATE, in-process, over the same c(id, op) encoding as the lemmas. Every node has a domain:
+# a bitset over the operators of the grammar (bit j stands for the j-th operator), with the bits of the operators that
+# would violate a lemma cleared. A node takes exactly one operator, so filling it falsifies c(id, op) for every other
+# op, and a lemma Not(And([Or(c(id, op) for op in ops) ...])) is read as the clause "some node of the lemma doesn't
+# take one of its ops". A node of a lemma is falsified once it is filled with one of the lemma's ops.
+#
+# Lemmas are watched on two nodes that aren't falsified, as in SAT solvers (two watched literals), so a fill only looks
+# at the lemmas watching the filled node. When a lemma is left with a single node that isn't falsified, and that node
+# isn't filled, the lemma's ops are cleared from its domain (the node may not exist yet, the pruning then waits for it
+# to be created). A hole whose domain is empty is a conflict, and a hole with a single production left is filled right
+# away, at the current decision level. Lemmas over a single node are kept out of the watches, and prune their node for
+# good.
+#
+# Every pruning is tagged with the trail position of the latest fill it depends on, and is undone together with it,
+# so backtracking needs no work besides that. DECIDE reads the candidates of a hole off its domain (`candidates`).
+
+
+class Propagator:
+    def __init__(self, program: AST, omega: LemmaDB = None):
+        self.prods = program.prods
+        self.ops = list(dict.fromkeys(p[0] for nt in self.prods for p in self.prods[nt]))
+        self.bit = {op: 1 << j for (j, op) in enumerate(self.ops)}
+        self.nt_mask = {nt: self.mask(p[0] for p in self.prods[nt]) for nt in self.prods}
+        self.units = {}  # Maps a node id to the ops blocked by lemmas over that node alone
+        self.pruned = {}  # Maps a node id to a list of (trail position, ops, lemma) pruned from it by the other lemmas
+        self.removed = {}  # Maps a node id to all the ops pruned from it, units included
+        self.by_pos = {}  # Maps a trail position to the ids of the nodes pruned at that position
+        self.pos = {}  # Maps the id of a filled node to its position on the trail
+        self.watches = {}  # Maps a node id to the lemmas watching it
+        self.watched = {}  # Maps a lemma to the two nodes it watches
+        self.queue = []  # The nodes filled since the last call to `propagate`
+        self.pending = []  # Lemmas to attach at the next call to `propagate`
+        self.forced = 0  # Number of holes filled by propagation
+        self.omega = omega
+        program.listeners.append(self)
+        if omega is not None:
+            omega.listeners.append(self)
+            for l in omega:
+                self.added(l)
+
+    def mask(self, ops) -> int:
+        m = 0
+        for op in ops:
+            m |= self.bit.get(op, 0)
+        return m
+
+    # The ops a node can still take, as a bitset
+    def domain(self, node) -> int:
+        return self.nt_mask[node.non_terminal] & ~self.removed.get(node.id, 0)
+
+    # The productions a hole can still be filled with
+    def candidates(self, node) -> list:
+        dom = self.domain(node)
+        return [p for p in self.prods[node.non_terminal] if self.bit[p[0]] & dom]
+
+    # Called by the lemma database
+    def added(self, lemma: Lemma):
+        self.pending.append(lemma)
+
+    def dropped(self, lemma: Lemma):
+        self.detach(lemma)
+        if lemma in self.pending:
+            self.pending.remove(lemma)
+
+    # Called by the program
+    def filled(self, program: AST, node):
+        self.pos[node.id] = len(program.trail) - 1
+        self.queue.append(node.id)
+
+    def undone(self, program: AST, node):
+        pos = self.pos.pop(node.id)
+        for id in self.by_pos.pop(pos, ()):
+            self.pruned[id] = [e for e in self.pruned[id] if e[0] != pos]
+            m = self.units.get(id, 0)
+            for e in self.pruned[id]:
+                m |= e[1]
+            self.removed[id] = m
+        if node.id in self.queue:
+            self.queue.remove(node.id)
+
+    # Attaches the new lemmas and propagates the fills made since the last call, until nothing changes. Returns None,
+    # or a lemma that the current assignment violates if there is a conflict.
+    def propagate(self, program: AST):
+        while self.pending:
+            conflict = self.attach(program, self.pending.pop())
+            if conflict is not None:
+                return conflict
+        while self.queue:
+            id = self.queue.pop(0)
+            op = program.assignment()[id]
+            for lemma in list(self.watches.get(id, ())):
+                if op in lemma.blocked[id]:
+                    conflict = self.update(program, lemma, id)
+                    if conflict is not None:
+                        return conflict
+            for c in program.trail[self.pos[id]][2]:
+                conflict = self.check(program, c)
+                if conflict is not None:
+                    return conflict
+        return None
+
+    def watch(self, lemma: Lemma, a, b):
+        self.detach(lemma)
+        self.watched[lemma] = (a, b)
+        self.watches.setdefault(a, set()).add(lemma)
+        self.watches.setdefault(b, set()).add(lemma)
+
+    def detach(self, lemma: Lemma):
+        for n in self.watched.pop(lemma, ()):
+            self.watches[n].discard(lemma)
+
+    # Sets up the watches of a lemma under the current assignment, and propagates it if it is unit. A violated lemma
+    # is put back on the pending list, to be attached again after backtracking.
+    def attach(self, program: AST, lemma: Lemma):
+        assigned = program.assignment()
+        if len(lemma.blocked) == 1:
+            (u, ops) = next(iter(lemma.blocked.items()))
+            m = self.mask(ops)
+            self.units[u] = self.units.get(u, 0) | m
+            self.removed[u] = self.removed.get(u, 0) | m
+            if assigned.get(u) in ops:
+                self.pending.append(lemma)
+                return lemma
+            return self.check(program, u)
+        free = [n for (n, ops) in lemma.blocked.items() if assigned.get(n) not in ops]
+        if len(free) == 0:
+            self.pending.append(lemma)
+            return lemma
+        if len(free) >= 2:
+            self.watch(lemma, free[0], free[1])
+            return None
+        u = free[0]
+        self.watch(lemma, u, max((n for n in lemma.blocked if n != u), key=lambda n: self.pos[n]))
+        if u in assigned:
+            return None
+        return self.prune(program, lemma, u)
+
+    # A watched node `id` of the lemma was just falsified: moves the watch to another node that isn't, or propagates
+    def update(self, program: AST, lemma: Lemma, id):
+        assigned = program.assignment()
+        (a, b) = self.watched[lemma]
+        other = b if a == id else a
+        for (n, ops) in lemma.blocked.items():
+            if n != a and n != b and assigned.get(n) not in ops:
+                self.watch(lemma, other, n)
+                return None
+        op = assigned.get(other)
+        if op is None:  # A hole, or a node that doesn't exist yet
+            self.watch(lemma, other, max((n for n in lemma.blocked if n != other), key=lambda n: self.pos[n]))
+            return self.prune(program, lemma, other)
+        if op in lemma.blocked[other]:  # Every node is falsified
+            self.detach(lemma)
+            self.pending.append(lemma)
+            return lemma
+        return None
+
+    # Clears the ops of the lemma from the domain of its only node that isn't falsified
+    def prune(self, program: AST, lemma: Lemma, u):
+        pos = max(self.pos[n] for n in lemma.blocked if n != u)
+        m = self.mask(lemma.blocked[u])
+        self.pruned.setdefault(u, []).append((pos, m, lemma))
+        self.by_pos.setdefault(pos, set()).add(u)
+        self.removed[u] = self.removed.get(u, 0) | m
+        if self.omega is not None and lemma in self.omega:
+            self.omega.bump(lemma)
+        return self.check(program, u)
+
+    # Looks at the domain of a node: fills it if it is a hole with a single production left, and returns a conflict
+    # if it is a hole with none
+    def check(self, program: AST, id):
+        node = program.search(id)
+        if node is None or not node.is_hole():
+            return None
+        dom = self.domain(node)
+        if dom == 0:
+            return self.explain(program, node)
+        if dom & (dom - 1) == 0:
+            ps = self.candidates(node)
+            if len(ps) == 1:
+                self.forced += 1
+                program.fill(id, ps[0])
+        return None
+
+    # The lemma behind an empty domain: the hole's parent keeps its operator (so the hole exists), and the other nodes
+    # of the lemmas that pruned the hole keep theirs, so every production of the hole violates one of the lemmas
+    def explain(self, program: AST, node) -> Lemma:
+        assigned = program.assignment()
+        nt_mask = self.nt_mask[node.non_terminal]
+        blocked = {}
+        local = False
+        for (pos, m, lemma) in self.pruned.get(node.id, ()):
+            if m & nt_mask == 0:
+                continue
+            local = local or lemma.local
+            for (n, ops) in lemma.blocked.items():
+                if n != node.id:
+                    blocked[n] = blocked[n] & ops if n in blocked else ops
+        if node.d > 1:
+            k = node.k
+            parent = label(k, node.d - 1, (node.i - 1) // k + 1)
+            blocked[parent] = {assigned[parent]}
+        return Lemma(blocked, local)  # Only as sound as the lemmas it is made of
@@ -1,75 +1,75 @@
 from z3 import *
-from src.ast import Node, AST
+from src.ast import Node, AST, label
+from src.parser import is_string_literal, unquote
+
+# Table of the built-in operators, shared by the symbolic semantics below and the concrete interpreter in
+# `src/interpreter.py`. Maps an operator to its return type and the types of its inputs, in the order the children
+# appear in the grammar. 'a' is a type variable, for the operators that work on any type (e.g., `ite`).
+OPS = {
+    'str.++': ('str', ('str', 'str')),
+    'str.replace': ('str', ('str', 'str', 'str')),
+    'str.at': ('str', ('str', 'int')),
+    'int.to.str': ('str', ('int',)),
+    'str.substr': ('str', ('str', 'int', 'int')),
+    'space': ('str', ()),
+    '+': ('int', ('int', 'int')),
+    '-': ('int', ('int', 'int')),
+    'str.len': ('int', ('str',)),
+    'str.to.int': ('int', ('str',)),
+    'str.indexof': ('int', ('str', 'str', 'int')),
+    'str.prefixof': ('bool', ('str', 'str')),
+    'str.suffixof': ('bool', ('str', 'str')),
+    'str.contains': ('bool', ('str', 'str')),
+    'ite': ('a', ('bool', 'a', 'a')),
+    '=': ('bool', ('a', 'a')),
+    '<=': ('bool', ('int', 'int')),
+    '>=': ('bool', ('int', 'int')),
+    '<': ('bool', ('int', 'int')),
+    '>': ('bool', ('int', 'int')),
+    'and': ('bool', ('bool', 'bool')),
+    'or': ('bool', ('bool', 'bool')),
+    'not': ('bool', ('bool',)),
+}
 
 # We define the 'semantics' as a mapping `sem: Terminals -> Formula` where Formula is a set of first-order logical
 # formulas over y, x[1], x[2], ..., x[n], where x[i] is the i-th input to the operator, and y represents a return value.
-# Some semantics will be hard-coded for now, and can be extended later.
-# Note: Hard-coding for now. Not sure what the best option is to generate programmatically.
-def sem(symbol):
-    ret_val_s = String("ret_val")  # the string returned by a subprogram
-    ret_val_i = Int("ret_val")  # integer returned by sub-program
-    ret_val_b = Bool("ret_val")
-    s1 = String("s1")
-    s2 = String("s2")
-    s3 = String("s3")
-
-    n1 = Int("n1")
-    n2 = Int("n2")
-    #n3 = Int("n3")  # Not needed?
-
-    # operators on strings/integers
-    ops = ['str.++', 'str.replace', 'str.at', 'int.to.str', 'str.substr', 'str.len',
-           'str.to.int', 'str.indexof', '+', '-', 'str.prefixof', 'str.suffixof', 'space']
-
-
-    if isinstance(symbol, int):  # Terminal integers go to integers
-        return ret_val_i == symbol
-
-    if isinstance(symbol, bool):  # Terminal bools go to bools
-        return ret_val_b == symbol
-
-    if isinstance(symbol, str):  # have to check cases
-        if symbol not in ops:  # I think the symbol is actually just a terminal string here
-            return ret_val_s == String(symbol)
-        else:
+# Each entry of `SEM` builds the value y of an operator from the Z3 terms of its inputs x[1], ..., x[n].
+SEM = {
+    'str.++': lambda x: Concat(x[0], x[1]),
+    'str.replace': lambda x: Replace(x[0], x[1], x[2]),  # replace first occur of x2 by x3 in string x1
+    'str.at': lambda x: SubString(x[0], x[1], 1),  # a single character at a given index, starting from 0
+    'int.to.str': lambda x: IntToStr(x[0]),
+    'str.substr': lambda x: SubString(x[0], x[1], x[2]),  # a substring of length x3, at offset x2
+    'space': lambda x: StringVal(" "),
+    '+': lambda x: x[0] + x[1],
+    '-': lambda x: x[0] - x[1],
+    'str.len': lambda x: Length(x[0]),
+    'str.to.int': lambda x: StrToInt(x[0]),
+    'str.indexof': lambda x: IndexOf(x[0], x[1], x[2]),
+    'str.prefixof': lambda x: PrefixOf(x[0], x[1]),
+    'str.suffixof': lambda x: SuffixOf(x[0], x[1]),
+    'str.contains': lambda x: Contains(x[0], x[1]),
+    'ite': lambda x: If(x[0], x[1], x[2]),
+    '=': lambda x: x[0] == x[1],
+    '<=': lambda x: x[0] <= x[1],
+    '>=': lambda x: x[0] >= x[1],
+    '<': lambda x: x[0] < x[1],
+    '>': lambda x: x[0] > x[1],
+    'and': lambda x: And(x[0], x[1]),
+    'or': lambda x: Or(x[0], x[1]),
+    'not': lambda x: Not(x[0]),
+}
+assert SEM.keys() == OPS.keys()
+
+
+# Helper to infer the type of a node. Uses the sort the grammar declares for the node's non-terminal, and falls back
+# on the names used in the examples otherwise.
+SORTS = {"Int": "int", "String": "str", "Bool": "bool"}
+
 
-            # This section returns strings
-            if symbol == 'str.++':  # concatenation of two strings
-                return ret_val_s == Concat(s1, s2)
-            if symbol == 'str.replace':  # replace first occur of x2 by x3 in string x1
-                return ret_val_s == Replace(s1, s2, s3)
-            if symbol == 'str.at':  # returns a single character at a given index, starting from 0
-                return ret_val_s == SubString(s1, n1, 1)
-            if symbol == 'int.to.str':
-                return ret_val_s == IntToStr(n1)
-            if symbol == 'str.substr':  # return a substring of length n2, at offset n1
-                return ret_val_s == SubString(s1, n1, n2)
-            if symbol == 'space':
-                return ret_val_s == StringVal(" ")
-
-
-            # This section returns ints
-            if symbol == '+':
-                return ret_val_i == n1 + n2
-            if symbol == '-':
-                return ret_val_i == n1 - n2
-            if symbol == 'str.len':
-                return ret_val_i == Length(s1)
-            if symbol == 'str.to.int':
-                return ret_val_i == StrToInt(s1)
-            if symbol == 'str.indexof':
-                return ret_val_i == IndexOf(s1, s2, n1)
-
-            # This section returns bools
-            if symbol == 'str.prefixof':
-                return ret_val_b == PrefixOf(s1, s2)
-            if symbol == 'str.suffixof':
-                return ret_val_b == SuffixOf(s1, s2)
-
-
-
-# Helper to infer the type of a node. Hard coding some stuff for now.
 def infer_type(node: Node):
+    if node.typ in SORTS:
+        return SORTS[node.typ]
     if node.non_terminal == "ntInt":
         return "int"
     if node.non_terminal == "ntString":
@@ -78,115 +78,201 @@ def infer_type(node: Node):
         return 'bool'
 
 
-# Returns a symbolic return variable of a node.
-def get_sym(node: Node):
-    typ = infer_type(node)
-    node_id = "v" + str(node.id)
-    if typ == "int":
-        return Int(node_id)
-    if typ == "bool":
-        return Bool(node_id)
-    if typ == 'str':
-        return String(node_id)
+Z3_SORTS = {"int": IntSort(), "str": StringSort(), "bool": BoolSort()}
+
 
+# Checks if the declared types of a production match the signature of its operator in `OPS`
+def matches_signature(op, ret_type: str, arg_types: tuple) -> bool:
+    if op not in OPS:
+        return False
+    sig_ret, sig_args = OPS[op]
+    if len(sig_args) != len(arg_types):
+        return False
+    binding = {}
+    for (expected, actual) in zip((sig_ret,) + sig_args, (ret_type,) + tuple(arg_types)):
+        if expected == 'a':
+            expected = binding.setdefault('a', actual)
+        if expected != actual:
+            return False
+    return True
 
-# This function gets the "return values" of the children sub-programs rooted at a given node.
-def get_child_returns(node: Node):
-    assert(node.num_children > 0)
-    ret_symbols = [get_sym(c) for c in node.children]
-    return ret_symbols
 
+# The semantics of a grammar. For every production it builds a template formula `ret_val == op(x1, ..., xn)` once,
+# and it caches the formula of every (node, production) after substituting the node's symbols into the template.
+# Node ids are positional, so the cached formulas stay valid across backtracking.
+# If the declared type of an input doesn't match the operator's signature (e.g., `int.to.str ntString` in example 5),
+# that input is left unconstrained: it gets a fresh variable of the right type for every node. Operators that are not
+# in `SEM` at all get an uninterpreted function, so the solver treats their result as unknown but consistent.
+class Semantics:
+    def __init__(self, grammar):
+        self.prods = grammar[2]
+        self.types = grammar[4] if len(grammar) > 4 else {}
+        self.syms = {}  # Interned symbols, keyed by (name, type)
+        self.templates = {}  # Keyed by (non-terminal, terminal, child non-terminals)
+        self.fmlas = {}  # Substituted formulas, keyed by (node id, non-terminal, terminal, child non-terminals)
+        for nt in self.prods:
+            for p in self.prods[nt]:
+                key = (nt, p[0], tuple(p[1]))
+                if key not in self.templates:
+                    self.templates[key] = self.make_template(nt, p)
+
+    # The type of a non-terminal, e.g., 'str'
+    def type_of(self, nt: str):
+        if nt in self.types:
+            return SORTS.get(self.types[nt])
+        return {"ntInt": "int", "ntString": "str", "ntBool": "bool"}.get(nt)
+
+    # Returns an interned Z3 constant
+    def sym(self, name: str, typ: str):
+        key = (name, typ)
+        if key not in self.syms:
+            self.syms[key] = Const(name, Z3_SORTS[typ])
+        return self.syms[key]
+
+    # Returns the template of a production: (formula, return symbol, input symbols, free input symbols). An input
+    # symbol is None when the child can't be used as that input; the matching free symbol stands in for it.
+    def make_template(self, nt: str, p):
+        op, child_nts = p[0], p[1]
+        ret_type = self.type_of(nt)
+        arg_types = tuple(self.type_of(c) for c in child_nts)
+        ret = self.sym("ret_val", ret_type)
+        xs = [self.sym(f"x{i + 1}", typ) for (i, typ) in enumerate(arg_types)]
+        free = []
+        if matches_signature(op, ret_type, arg_types):
+            value = SEM[op](xs)
+        elif op in OPS and len(OPS[op][1]) == len(arg_types) and 'a' not in OPS[op][1]:
+            sig_types = OPS[op][1]
+            args = list(xs)
+            for i in range(len(xs)):
+                if sig_types[i] != arg_types[i]:
+                    args[i] = self.sym(f"y{i + 1}", sig_types[i])
+                    free.append((i, args[i]))
+                    xs[i] = None
+            value = SEM[op](args)
+        elif len(child_nts) > 0 or op in OPS:
+            f = Function(str(op), *[Z3_SORTS[t] for t in arg_types], Z3_SORTS[ret_type])
+            value = f(*xs)
+        else:
+            value = self.literal(op, ret_type)
+        return (ret == value, ret, xs, free)
+
+    # The value of a terminal with no inputs: a constant, or one of the inputs of the synthesized function
+    def literal(self, symbol, typ: str):
+        if isinstance(symbol, bool) or symbol in ('true', 'false'):
+            return BoolVal(symbol is True or symbol == 'true')
+        if isinstance(symbol, int):
+            return IntVal(symbol)
+        if is_string_literal(symbol):
+            return StringVal(unquote(symbol))
+        return self.sym(str(symbol), typ)  # An input variable, e.g., `fname`
 
+    # Returns a symbolic return variable of a node
+    def node_sym(self, node: Node):
+        return self.sym("v" + str(node.id), infer_type(node) or self.type_of(node.non_terminal))
 
-# Helper function that can perform substitutions in a first order formula. Used on nodes, helpful for the 'Infer-Spec'
+    # Returns the formula of a filled node, with the node's symbol and its children's symbols substituted in
+    def formula(self, node: Node):
+        child_nts = tuple(c.non_terminal for c in node.children)
+        key = (node.id, node.non_terminal, node.terminal, child_nts)
+        fmla = self.fmlas.get(key)
+        if fmla is None:
+            template, ret, xs, free = self.templates[key[1:]]
+            subst = [(ret, self.node_sym(node))]
+            subst += [(x, self.node_sym(c)) for (x, c) in zip(xs, node.children) if x is not None]
+            subst += [(y, Const(f"v{node.id}_{i + 1}", y.sort())) for (i, y) in free]
+            fmla = substitute(template, subst)
+            self.fmlas[key] = fmla
+        return fmla
+
+    # Returns the formula that a node would have if it were filled with production `p`, whether or not it is. The
+    # children's symbols are those of the positions the children would get, so the formula agrees with `formula` on
+    # the children the node already has.
+    def production_formula(self, node: Node, p, root: bool = False):
+        nt = node.non_terminal
+        key = (node.id, nt, p[0], tuple(p[1]))
+        fmla = self.fmlas.get(key)
+        if fmla is None:
+            template, ret, xs, free = self.templates[key[1:]]
+            k, d = node.k, node.d
+            child_ids = [label(k, d + 1, (node.i - 1) * k + j + 1) for j in range(len(p[1]))]
+            subst = [(ret, self.sym("v" + str(node.id), self.type_of(nt)))]
+            subst += [(x, self.sym("v" + str(c), self.type_of(c_nt)))
+                      for (x, c, c_nt) in zip(xs, child_ids, p[1]) if x is not None]
+            subst += [(y, Const(f"v{node.id}_{i + 1}", y.sort())) for (i, y) in free]
+            fmla = substitute(template, subst)
+            self.fmlas[key] = fmla
+        if root:  # The root symbol is renamed to 'ret_val', as in `root_formula`
+            root_key = ('root',) + key
+            if root_key not in self.fmlas:
+                ret_val = self.sym('ret_val', self.type_of(nt))
+                self.fmlas[root_key] = substitute(fmla, (self.sym("v" + str(node.id), self.type_of(nt)), ret_val))
+            fmla = self.fmlas[root_key]
+        return fmla
+
+    # The formula of the root node. The root symbol is renamed to 'ret_val', which represents the return value of the
+    # whole program, once per root production.
+    def root_formula(self, node: Node):
+        key = ('root', node.id, node.non_terminal, node.terminal, tuple(c.non_terminal for c in node.children))
+        fmla = self.fmlas.get(key)
+        if fmla is None:
+            r_sym = self.node_sym(node)
+            ret_val = self.sym('ret_val', infer_type(node) or self.type_of(node.non_terminal))
+            fmla = substitute(self.formula(node), (r_sym, ret_val))
+            self.fmlas[key] = fmla
+        return fmla
+
+    # The raw (unsubstituted) formula of a filled node
+    def template(self, node: Node):
+        return self.templates[(node.non_terminal, node.terminal, tuple(c.non_terminal for c in node.children))][0]
+
+
+# Helper function that does the substitutions in a node's formula. Used on nodes, helpful for the 'Infer-Spec'
 # function used in CHECK-CONFLICT.
 # This returns a 4-tuple: a formula with substituted values, the raw formula, the node value, and the terminal operator
 # that was applied to the node.
-def subst_sem(node: Node):
+def subst_sem(node: Node, semantics: Semantics):
     if node.is_hole():  # Hole nodes are always true
         return tuple([True, True, node.id, None])
-    elif node.num_children == 0:  # We have a leaf node
-        ret_sym = get_sym(node)
-        fmla = sem(node.terminal)
-        if ret_sym.sort() == IntSort():
-            subbed_fmla = substitute(fmla, (Int('ret_val'), ret_sym))
-        if ret_sym.sort() == BoolSort():
-            subbed_fmla = substitute(fmla, (Bool('ret_val'), ret_sym))
-        if ret_sym.sort() == StringSort():
-            subbed_fmla = substitute(fmla, (String('ret_val'), ret_sym))
-        return tuple([subbed_fmla, fmla, node.id, node.terminal])
-
-    else:
-        child_syms = get_child_returns(node)
-        ret_sym = get_sym(node)
-        subst_tuple = []
-        fmla = sem(node.terminal)
-        if ret_sym.sort() == IntSort():
-            subst_tuple.append((Int('ret_val'), ret_sym))
-        elif ret_sym.sort() == BoolSort():
-            subst_tuple.append((Bool('ret_val'), ret_sym))
-        elif ret_sym.sort() == StringSort():
-            subst_tuple.append((String('ret_val'), ret_sym))
-
-        # For indexing correctly
-        num_bool = 1
-        num_int = 1
-        num_str = 1
-        for sym in child_syms:
-            if sym.sort() == IntSort():
-                t1 = Int('n' + str(num_int))
-                t2 = sym
-                tup = (t1, t2)
-                num_int += 1
-            elif sym.sort() == BoolSort():
-                t1 = Bool('b' + str(num_bool))
-                t2 = sym
-                tup = (t1, t2)
-                num_bool += 1
-            elif sym.sort() == StringSort():
-                t1 = String('s' + str(num_str))
-                t2 = sym
-                tup = (t1, t2)
-                num_str += 1
-
-            subst_tuple.append(tup)
-        subbed_fmla = substitute(fmla, subst_tuple)
-        return tuple([subbed_fmla, fmla, node.id, node.terminal])
+    return tuple([semantics.formula(node), semantics.template(node), node.id, node.terminal])
 
 # Function that transforms a program into an SMT formula over output y, inputs x, and intermediate values v
-# representing the return values of sub-programs. Recursive for now, so may have stack overflow issues on large
-# programs, but I suppose this can be converted to a loop
-def infer_spec_(r: Node):
-    if r.num_children == 0:  # We have a leaf
-        return [subst_sem(r)]
-    else:
-        r_fmla = subst_sem(r)
-        sub_fmlas = [r_fmla]
-        for c in r.children:
-            sub_fmlas = sub_fmlas + infer_spec_(c)
-        return sub_fmlas  # List representing conjunction of all the children formulas
-
-def infer_spec(program: AST):
+# representing the return values of sub-programs. Holes are left out, since their formula is just True.
+# Returns a list of tuples as `subst_sem` does, representing the conjunction of the formulas of the filled nodes.
+def infer_spec(program: AST, semantics: Semantics):
     r = program.root
-    r_sym = get_sym(r)
-    spec = infer_spec_(r)
-    # One last substitution, but this time change the root symbol to 'ret_val' which represents the return value
-    if r_sym.sort() == IntSort():
-        replacement_tup = (r_sym, Int('ret_val'))
-    if r_sym.sort() == BoolSort():
-        replacement_tup = (r_sym, Bool('ret_val'))
-    if r_sym.sort() == StringSort():
-        replacement_tup = (r_sym, String('ret_val'))
-    #print("root symbol")
-    #print(r_sym)
-    #print(spec)
     spec_p = []
-    for t in spec:
-        if isinstance(t[0], bool):
-            spec_p.append(t)
+    stack = [r]
+    while stack:
+        v = stack.pop()
+        if v.is_hole():
+            continue
+        # The root symbol is changed to 'ret_val', which represents the return value
+        fmla = semantics.root_formula(v) if v.id == r.id else semantics.formula(v)
+        spec_p.append(tuple([fmla, semantics.template(v), v.id, v.terminal]))
+        stack.extend(v.children)
+    return spec_p
+
+
+# A cache of the program spec (the result of `infer_spec`), keyed by node id. It listens to the fills and undos of a
+# program, so each round only computes the formula of the node that changed, instead of the whole program again.
+class SpecCache:
+    def __init__(self, program: AST, semantics: Semantics):
+        self.semantics = semantics
+        self.entries = {}
+        for t in infer_spec(program, semantics):
+            self.entries[t[2]] = t
+        program.listeners.append(self)
+
+    def filled(self, program: AST, node: Node):
+        if node.id == program.root.id:
+            fmla = self.semantics.root_formula(node)
         else:
-            t0 = substitute(t[0], replacement_tup)
-            spec_p.append(tuple([t0, t[1], t[2], t[3]]))
+            fmla = self.semantics.formula(node)
+        self.entries[node.id] = tuple([fmla, self.semantics.template(node), node.id, node.terminal])
 
-    return spec_p
+    def undone(self, program: AST, node: Node):
+        del self.entries[node.id]
 
+    # Returns the current spec, as a list of tuples like `infer_spec`
+    def spec(self) -> list:
+        return list(self.entries.values())
@@ -0,0 +1,471 @@
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from src.cache import load_source, source_digest
+from src.interpreter import EvalError, run_examples
+from src.main import synthesize
+from src.semantics import Semantics
+from src.spec import Spec
+from src.stats import Stats, TRACE_ROUND
+
+# Synthesis as a long-running service, for callers that synthesize many times a minute and would otherwise pay for
+# python, Z3, parsing and the semantics of the grammar on every call. Requests and responses are JSON objects, one per
+# line, over stdin/stdout or a Unix socket. Searches run on a bounded pool of worker processes (Z3 and the search are
+# not thread-safe, and are CPU bound anyway). Each worker keeps the problems it has parsed, and the `Semantics` of
+# their grammars, warm across requests, and a request goes to a worker that has its problem warm if one is free.
+#
+# Usage:
+#   python -m src.server                              # JSON lines on stdin/stdout, until EOF
+#   python -m src.server --socket /tmp/cdps.sock -j 4
+#
+# Requests:
+#   {"op": "synthesize", "id": 1, "sl": "<text of a .sl file>"}
+#   {"op": "synthesize", "id": 2, "grammar": [...], "spec": {...}}   # see `problem_from_json`
+#       optional: "deadline" (seconds from now), "max_iter", "progress" (false for no progress events), and
+#       "options", keyword arguments of `synthesize` (see OPTIONS), e.g. {"lemma_policy": "core", "seed": 3}
+#   {"op": "cancel", "target": 1}
+#   {"op": "status"}
+#   {"op": "shutdown"}                                # finishes the jobs it has, then exits
+#
+# Responses carry the "id" of their job and an "event":
+#   queued    - the job was accepted, "position" in the queue
+#   started   - a worker picked it up, "warm" if the worker had its problem parsed already
+#   progress  - the round, decision level, conflicts and lemmas so far, at most every PROGRESS_INTERVAL seconds; and
+#               the restarts and counterexamples of the search as they come (see `Trace` in src/stats.py)
+#   result    - the "status" (as in `Stats`, or 'cancelled'), the "program" as an S-expression if solved, whether it
+#               was "verified" on the examples, and the "stats" of the search
+#   error     - the request was bad, or the search failed
+# A search stops at its deadline, as every solver call is given the time left, and a cancel interrupts the solver call
+# that is running (see `interrupt_on_cancel` in src/main.py), so the worker and the problems it has warm are kept. Only
+# a search that still hasn't stopped GRACE seconds later (Z3 can miss a timeout or an interrupt) has its worker killed
+# and replaced.
+
+WORKERS = os.cpu_count() or 1
+QUEUE_LIMIT = 256
+MAX_ITER = 1000
+GRACE = 2.0
+PROGRESS_INTERVAL = 0.5
+WARM_PROBLEMS = 64  # Problems (and as many grammars) each worker keeps warm
+OPTIONS = {'seed', 'heuristic', 'random_walk', 'lemma_policy', 'lemma_cap', 'backjump', 'restarts', 'cegis', 'batch',
+           'abstract'}
+
+
+# A problem given as JSON: the grammar tuple of `read_problem` ([non-terminals, terminals, productions, start symbol,
+# sorts of the non-terminals], the productions as {non-terminal: [[op, [child non-terminals]], ...]}), and the spec
+# as {"name": ..., "params": [[name, sort], ...], "ret_type": ..., "examples": [[{input: value}, output], ...]}
+def problem_from_json(grammar: list, spec: dict):
+    prods = {nt: [(p[0], list(p[1])) for p in ps] for (nt, ps) in grammar[2].items()}
+    types = dict(grammar[4]) if len(grammar) > 4 else {}
+    g = (list(grammar[0]), list(grammar[1]), prods, grammar[3], types)
+    s = Spec(spec["name"], [tuple(p) for p in spec["params"]], spec["ret_type"])
+    for (env, output) in spec["examples"]:
+        s.add_example((env, output))
+    return g, s
+
+
+# The key of a request's problem, which is the same for the same problem whichever way it is given
+def problem_key(request: dict) -> str:
+    if "sl" in request:
+        return source_digest(request["sl"])
+    return source_digest(json.dumps([request["grammar"], request["spec"]], sort_keys=True))
+
+
+# Returns the value of `key` in an LRU cache (an OrderedDict), making it with `make` on a miss
+def lru_get(cache: collections.OrderedDict, key, make, limit: int = WARM_PROBLEMS):
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = make()
+    cache[key] = value
+    while len(cache) > limit:
+        cache.popitem(last=False)
+    return value
+
+
+# Stands in for a `Trace` in a worker, and sends the events of a search back to the server as progress
+class Progress:
+    def __init__(self, conn, job_id, stats: Stats):
+        self.conn = conn
+        self.job_id = job_id
+        self.stats = stats
+        self.level = TRACE_ROUND
+        self.last = time.perf_counter()
+
+    def emit(self, event: str, **fields):
+        if event == "round":
+            now = time.perf_counter()
+            if now - self.last < PROGRESS_INTERVAL:
+                return
+            self.last = now
+            self.conn.send((self.job_id, {"event": "progress", "round": fields["round"], "level": fields["level"],
+                                          "conflicts": self.stats.conflicts, "lemmas": self.stats.learned}))
+        elif event in ("restart", "counterexample"):
+            self.conn.send((self.job_id, dict(fields, event=event)))
+
+
+# Runs one job in a worker, and returns its result event
+def run_job(conn, cancel, job: dict, problems, semantics) -> dict:
+    request = job["request"]
+    stats = Stats()
+    try:
+        if "sl" in request:
+            make = lambda: load_source(request["sl"])
+        else:
+            make = lambda: problem_from_json(request["grammar"], request["spec"])
+        (grammar, spec) = lru_get(problems, job["key"], make)
+        sem = lru_get(semantics, json.dumps(grammar, sort_keys=True, default=str), lambda: Semantics(grammar))
+        trace = Progress(conn, job["id"], stats) if request.get("progress", True) else None
+        (program, stats) = synthesize(request.get("max_iter", MAX_ITER), grammar, spec, time_limit=job["time_limit"],
+                                      stats=stats, trace=trace, semantics=sem, cancel=cancel,
+                                      **request.get("options", {}))
+    except Exception as e:
+        return {"event": "error", "error": f"{type(e).__name__}: {e}"}
+    verified = False
+    if program.is_concrete():
+        try:
+            verified = run_examples(program, spec.examples)
+        except EvalError:
+            pass
+    return {"event": "result", "status": stats.status, "verified": verified,
+            "program": program.to_program() if stats.status == "solved" else None, "stats": stats.as_dict()}
+
+
+# The loop of a worker process: runs one job at a time, sent over `conn`, until it gets None
+def worker_loop(conn, cancel):
+    sys.stdout = open(os.devnull, "w")  # The server may be talking on stdout
+    problems = collections.OrderedDict()
+    semantics = collections.OrderedDict()
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send((job["id"], run_job(conn, cancel, job, problems, semantics)))
+    conn.close()
+
+
+# A request to synthesize, from its arrival to its result
+class Job:
+    def __init__(self, client, request: dict):
+        self.client = client
+        self.id = request["id"]
+        self.request = request
+        self.key = problem_key(request)
+        self.received = time.perf_counter()
+        self.deadline = None if request.get("deadline") is None else self.received + float(request["deadline"])
+        self.worker = None
+        self.timer = None  # Kills the worker if the search doesn't stop in time
+
+
+# A worker process, with the event that asks its search to stop, and the problems it has warm
+class Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.cancel = ctx.Event()
+        self.process = ctx.Process(target=worker_loop, args=(child_conn, self.cancel), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job = None
+        self.warm = collections.OrderedDict()  # Keys of the problems it has warm, mirroring its LRU cache (`lru_get`)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+# A connection to the server. `write` sends one line.
+class Client:
+    def __init__(self, write):
+        self.write = write
+        self.closed = False
+
+    def send(self, message: dict):
+        if not self.closed:
+            self.write(json.dumps(message, default=str) + "\n")
+
+
+class Server:
+    def __init__(self, workers: int = WORKERS, queue_limit: int = QUEUE_LIMIT):
+        self.mp = multiprocessing.get_context("fork")
+        self.n = max(1, workers)
+        self.queue_limit = queue_limit
+        self.workers = []
+        self.queue = collections.deque()
+        self.jobs = {}  # Maps (client, job id) to the jobs that are queued or running
+        self.done = 0
+        self.loop = None
+        self.idle = None  # Set when there are no jobs
+        self.stopping = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        for _ in range(self.n):
+            self.workers.append(self.spawn())
+
+    def spawn(self) -> Worker:
+        w = Worker(self.mp)
+        self.loop.add_reader(w.conn.fileno(), self.receive, w)
+        return w
+
+    def stop(self):
+        for w in self.workers:
+            self.loop.remove_reader(w.conn.fileno())
+            if w.job is None:
+                try:
+                    w.conn.send(None)
+                except OSError:
+                    pass
+                w.process.join(1.0)
+            if w.process.is_alive():
+                w.process.kill()
+                w.process.join()
+            w.conn.close()
+
+    # Handles one line from a client
+    def handle(self, client: Client, line: str):
+        try:
+            request = json.loads(line)
+            op = request.get("op", "synthesize")
+        except (ValueError, AttributeError) as e:
+            client.send({"id": None, "event": "error", "error": f"bad request: {e}"})
+            return
+        if op == "synthesize":
+            self.submit(client, request)
+        elif op == "cancel":
+            self.cancel(client, request.get("target"))
+        elif op == "status":
+            client.send({"id": request.get("id"), "event": "status", "workers": len(self.workers),
+                         "busy": sum(1 for w in self.workers if w.job is not None), "queued": len(self.queue),
+                         "done": self.done})
+        elif op == "shutdown":
+            self.stopping = True
+        else:
+            client.send({"id": request.get("id"), "event": "error", "error": f"unknown op: {op}"})
+
+    def submit(self, client: Client, request: dict):
+        job_id = request.get("id")
+        error = None
+        if not isinstance(job_id, (str, int)):
+            error = "a request needs an id (a string or an integer)"
+        elif (client, job_id) in self.jobs:
+            error = f"job {job_id} is already running"
+        elif "sl" not in request and ("grammar" not in request or "spec" not in request):
+            error = "a request needs an 'sl' problem, or a 'grammar' and a 'spec'"
+        elif not set(request.get("options", {})) <= OPTIONS:
+            error = f"unknown options: {sorted(set(request['options']) - OPTIONS)}"
+        elif self.stopping:
+            error = "the server is shutting down"
+        elif len(self.queue) >= self.queue_limit:
+            error = "the queue is full"
+        if error is not None:
+            client.send({"id": job_id, "event": "error", "error": error})
+            return
+        try:
+            job = Job(client, request)
+        except (TypeError, ValueError) as e:
+            client.send({"id": job_id, "event": "error", "error": f"bad request: {e}"})
+            return
+        self.jobs[(client, job.id)] = job
+        self.idle.clear()
+        self.queue.append(job)
+        client.send({"id": job.id, "event": "queued", "position": len(self.queue)})
+        self.schedule()
+
+    # Hands out queued jobs to free workers, preferring a worker that has the job's problem warm
+    def schedule(self):
+        while self.queue:
+            free = [w for w in self.workers if w.job is None]
+            if len(free) == 0:
+                return
+            job = self.queue.popleft()
+            now = time.perf_counter()
+            if job.deadline is not None and now >= job.deadline:
+                self.finish(job, {"event": "result", "status": "timeout", "program": None})
+                continue
+            w = next((w for w in free if job.key in w.warm), free[0])
+            job.client.send({"id": job.id, "event": "started", "warm": job.key in w.warm})
+            time_limit = None if job.deadline is None else job.deadline - now
+            w.cancel.clear()
+            w.conn.send({"id": job.id, "key": job.key, "request": job.request, "time_limit": time_limit})
+            w.job = job
+            lru_get(w.warm, job.key, lambda: True)  # Evicts what the worker's cache will evict
+            job.worker = w
+            if time_limit is not None:
+                job.timer = self.loop.call_later(time_limit + GRACE, self.reap, job, "timeout")
+
+    # Reads the messages of a worker: progress events, and the result of its job
+    def receive(self, w: Worker):
+        while True:
+            try:
+                if not w.conn.poll():
+                    return
+                (job_id, event) = w.conn.recv()
+            except (EOFError, OSError):  # The worker died, e.g., Z3 aborted
+                w.process.join()
+                job = w.job
+                self.replace(w)
+                if job is not None:
+                    self.finish(job, {"event": "error", "error": f"worker died (exit code {w.process.exitcode})"})
+                return
+            job = w.job
+            if job is None or job.id != job_id:  # Left over from a job that was given up on
+                continue
+            if event["event"] in ("result", "error"):
+                w.job = None
+                if event["event"] == "error":  # The problem may not have made it into the worker's cache
+                    w.warm.pop(job.key, None)
+                self.finish(job, event)
+            else:
+                job.client.send({"id": job.id, **event})
+
+    def replace(self, w: Worker):
+        self.loop.remove_reader(w.conn.fileno())
+        if w.process.is_alive():
+            w.kill()
+        else:
+            w.conn.close()
+        self.workers[self.workers.index(w)] = self.spawn()
+
+    # A job whose search didn't stop within GRACE of its deadline or cancel: its worker is replaced
+    def reap(self, job: Job, status: str):
+        w = job.worker
+        if w is None or w.job is not job:
+            return
+        self.replace(w)
+        self.finish(job, {"event": "result", "status": status, "program": None})
+
+    def cancel(self, client: Client, job_id):
+        job = self.jobs.get((client, job_id))
+        if job is None:
+            client.send({"id": job_id, "event": "error", "error": f"no job {job_id}"})
+            return
+        if job.worker is None:
+            self.queue.remove(job)
+            self.finish(job, {"event": "result", "status": "cancelled", "program": None})
+            return
+        job.worker.cancel.set()
+        if job.timer is not None:
+            job.timer.cancel()
+        job.timer = self.loop.call_later(GRACE, self.reap, job, "cancelled")
+
+    # Cancels the jobs of a client that went away
+    def disconnect(self, client: Client):
+        client.closed = True
+        for (c, job_id) in list(self.jobs):
+            if c is client:
+                self.cancel(client, job_id)
+
+    def finish(self, job: Job, event: dict):
+        if job.timer is not None:
+            job.timer.cancel()
+        if self.jobs.pop((job.client, job.id), None) is None:
+            return
+        if job.worker is not None and job.worker.job is job:
+            job.worker.job = None
+        event = {"id": job.id, **event, "time": round(time.perf_counter() - job.received, 4)}
+        job.client.send(event)
+        self.done += 1
+        if len(self.jobs) == 0:
+            self.idle.set()
+        self.schedule()
+
+    # Waits until every job is done
+    async def drain(self):
+        while self.jobs:
+            await self.idle.wait()
+
+
+async def serve_stdio(server: Server):
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+
+    # stdin may be a file, which asyncio can't watch, so it is read on a thread (a daemon, so that a shutdown request
+    # doesn't wait for the next line)
+    def read():
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+        loop.call_soon_threadsafe(lines.put_nowait, None)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    def write(line: str):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    client = Client(write)
+    while not server.stopping:
+        line = await lines.get()
+        if line is None:
+            break
+        if line.strip():
+            server.handle(client, line)
+    server.stopping = True
+    await server.drain()
+
+
+async def serve_socket(server: Server, path: str):
+    done = asyncio.Event()
+
+    async def connection(reader, writer):
+        client = Client(lambda line: writer.write(line.encode("utf-8")))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    server.handle(client, line.decode("utf-8"))
+                    await writer.drain()
+                if server.stopping:
+                    done.set()
+        finally:
+            server.disconnect(client)
+            writer.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    unix_server = await asyncio.start_unix_server(connection, path)
+    try:
+        await done.wait()
+        await server.drain()
+    finally:
+        unix_server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def serve(workers: int, queue_limit: int, socket_path: str = None):
+    server = Server(workers, queue_limit)
+    server.start()
+    try:
+        if socket_path is None:
+            await serve_stdio(server)
+        else:
+            await serve_socket(server, socket_path)
+    finally:
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthesis requests, as JSON lines")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("-j", "--workers", type=int, default=WORKERS, help="number of worker processes")
+    parser.add_argument("--queue", type=int, default=QUEUE_LIMIT, help="most jobs waiting for a worker")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.workers, args.queue, args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from z3 import *
+
+UINT_MAX = 4294967295  # Z3's default timeout, i.e., none
+
+
+# The timeout of a check, in ms: `timeout`, cut to the time left before `deadline` (a `time.perf_counter()`, or None).
+# Z3 counts its timeout per check, so a deadline has to be turned into a timeout again before every check.
+def time_left(timeout: int, deadline: float) -> int:
+    if deadline is not None:
+        left = max(1, int((deadline - time.perf_counter()) * 1000))
+        timeout = left if timeout is None else min(timeout, left)
+    return UINT_MAX if timeout is None else timeout
+
+# The specification of a PBE problem: the signature of the function to synthesize, and its input/output examples,
+# read from the `constraint` commands of a .sl file (see `get_spec` in `src/parser.py`).
+# Each example is a pair (env, output), where env maps the inputs of the function to their values.
+# Examples that are exact duplicates of one already in the spec are dropped (the -long-repeat benchmarks are mostly
+# repeats), and counted in `repeats`.
+class Spec:
+    def __init__(self, func_name: str, params: list, ret_type: str):
+        self.func_name = func_name
+        self.params = params  # List of (name, type) pairs, e.g., [("fname", "String"), ("lname", "String")]
+        self.ret_type = ret_type
+        self.examples = []
+        self.index = {}  # Maps the key of an example (see `example_key`) to its position in `examples`
+        self.repeats = 0
+
+    # Adds an example, unless it is a duplicate. Returns whether it was added.
+    def add_example(self, example) -> bool:
+        key = example_key(example)
+        if key in self.index:
+            self.repeats += 1
+            return False
+        self.index[key] = len(self.examples)
+        self.examples.append(example)
+        return True
+
+    # A spec with the same signature and some of the examples, given by position
+    def subset(self, positions: list) -> 'Spec':
+        sub = Spec(self.func_name, self.params, self.ret_type)
+        for i in positions:
+            sub.add_example(self.examples[i])
+        return sub
+
+    def __len__(self):
+        return len(self.examples)
+
+
+# A hashable key of an example, equal for exact duplicates
+def example_key(example):
+    (env, output) = example
+    return (tuple(sorted(env.items())), output)
+
+
+# Converts a concrete python value into a Z3 value, in the given Z3 context (None for the main one)
+def to_z3_val(value, context=None):
+    if isinstance(value, bool):
+        return BoolVal(value, context)
+    if isinstance(value, int):
+        return IntVal(value, context)
+    return StringVal(value, context)
+
+
+# Returns a Z3 variable of the given SMT-LIB sort
+def to_z3_var(name: str, typ: str, context=None):
+    if typ == "Int":
+        return Int(name, context)
+    if typ == "Bool":
+        return Bool(name, context)
+    if typ == "String":
+        return String(name, context)
+    raise ValueError(f"Unsupported sort: {typ}")
+
+
+# The constants of a formula, i.e., its variables (values, such as 1 or "a", are not constants here)
+def free_consts(fmla) -> list:
+    consts = {}
+    seen = set()
+    stack = [fmla]
+    while stack:
+        e = stack.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        if is_const(e) and e.decl().kind() == Z3_OP_UNINTERPRETED:
+            consts[e.get_id()] = e
+        else:
+            stack.extend(e.children())
+    return list(consts.values())
+
+
+# Returns an example as a list of Z3 constraints on the inputs and on the return value 'ret_val'
+def encode_example(spec: Spec, example):
+    env, output = example
+    io_ex = [to_z3_var(x, typ) == to_z3_val(env[x]) for (x, typ) in spec.params]
+    io_ex.append(to_z3_var('ret_val', spec.ret_type) == to_z3_val(output))
+    return io_ex
+
+
+# A Spec compiled into a long-lived solver. Every example is asserted once, behind a guard literal `ex(i)`, so a
+# conflict check only needs to pass the guard of the example it wants as an assumption. Nothing about the examples is
+# rebuilt between rounds.
+#
+# With `batch` > 0, `check_conflict` goes through `batch_check` instead, which checks a program against all the examples
+# in one query per `ExampleBatch`. The examples are split round-robin over `batch` batches, each in its own Z3 context
+# if there can be more than one, and the batches are checked on as many threads. A batch is opened for each example
+# until there are `batch` of them, so the examples that CEGIS adds one at a time spread over the batches too.
+class SpecContext:
+    def __init__(self, spec: Spec, batch: int = 0):
+        self.spec = spec
+        self.batch = batch
+        self.batches = []  # Built on the first `batch_check`
+        self.pool = None
+        self.solver = Solver()
+        self.guards = [Bool(f"ex({i})") for i in range(len(spec.examples))]
+        self.calls = 0  # Number of calls to the solver
+        self.failed = None  # The example that the last conflict was found on, set by `check_conflict`
+        self.failures = []  # All the examples in the unsat core of the last conflict
+        self.inconclusive = False  # Whether a check of the last conflict check came back unknown, e.g., out of time
+        self.timeout = None
+        self.deadline = None  # No check runs past it, see `set_deadline`
+        self.cancel = None  # An object with `is_set()`, e.g., an Event; once it is set, no check runs either
+        self.quick_solvers = {}  # Per example, see `quick_check`
+        self.feasible = set()  # Assignments (frozensets of (id, op)) already found to be feasible, see `check_conflict`
+        for (g, ex) in zip(self.guards, spec.examples):
+            self.solver.add(Implies(g, And(encode_example(spec, ex))))
+
+    # Sets the timeout of every check, in ms (None for no timeout)
+    def set_timeout(self, timeout: int):
+        self.timeout = timeout
+        self.solver.set("timeout", UINT_MAX if timeout is None else timeout)
+        for b in self.batches:
+            b.set_timeout(timeout)
+
+    # Sets the time (a `time.perf_counter()`, or None) that no check may run past, e.g., the end of the budget of the
+    # search. Every check then gets the time left as its timeout, if that is less than the one of `set_timeout`, and
+    # past the deadline a check is unknown without calling the solver (which takes a while even with a 1 ms timeout).
+    def set_deadline(self, deadline: float):
+        self.deadline = deadline
+        for b in self.batches:
+            b.deadline = deadline
+
+    def expired(self) -> bool:
+        if self.cancel is not None and self.cancel.is_set():
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    # Stops the checks that are running, in every Z3 context of the checks, with an unknown result. Meant to be called
+    # from another thread (see `interrupt_on_cancel` in src/main.py).
+    def interrupt(self):
+        main_ctx().interrupt()
+        for b in list(self.batches):
+            if b.context is not None:
+                b.context.interrupt()
+
+    # Checks the program formulas against the i-th example. `fmlas` are passed as assumptions, so the unsat core is
+    # a subset of them (plus the guard of the example).
+    def check(self, i: int, fmlas: list):
+        if self.expired():
+            return unknown
+        self.calls += 1
+        if self.deadline is not None:
+            self.solver.set("timeout", time_left(self.timeout, self.deadline))
+        return self.solver.check(fmlas + [self.guards[i]])
+
+    # Checks formulas against the i-th example on a separate solver, with a timeout in ms. Meant for the many short
+    # queries of conflict analysis: a query that times out can leave a solver slower for the ones after it, so they are
+    # kept away from the main solver.
+    def quick_check(self, i: int, fmlas: list, timeout: int):
+        if self.expired():
+            return unknown
+        self.calls += 1
+        if i not in self.quick_solvers:
+            s = Solver()
+            s.add(encode_example(self.spec, self.spec.examples[i]))
+            self.quick_solvers[i] = s
+        s = self.quick_solvers[i]
+        s.set("timeout", time_left(timeout if self.timeout is None else min(timeout, self.timeout), self.deadline))
+        return s.check(fmlas)
+
+    def unsat_core(self):
+        return self.solver.unsat_core()
+
+    # Adds an example to the spec and to the solver, e.g., a counterexample found by CEGIS (see `synthesize`). The
+    # partial programs found to be feasible so far may not be on the new example, so they are forgotten.
+    def add_example(self, example) -> int:
+        if not self.spec.add_example(example):
+            return self.spec.index[example_key(example)]
+        i = len(self.guards)
+        self.guards.append(Bool(f"ex({i})"))
+        self.solver.add(Implies(self.guards[i], And(encode_example(self.spec, example))))
+        if self.batches:
+            self.add_to_batch(i)
+        self.feasible.clear()
+        return i
+
+    # Puts the i-th example in the batch it falls in round-robin, opening that batch if it is a new one
+    def add_to_batch(self, i: int):
+        if len(self.batches) < self.batch:
+            b = ExampleBatch(self.spec, [i], None if self.batch == 1 else Context())
+            b.set_timeout(self.timeout)
+            b.deadline = self.deadline
+            self.batches.append(b)
+            if len(self.batches) == 2:
+                self.pool = ThreadPoolExecutor(self.batch)
+        else:
+            self.batches[i % self.batch].add_example(i)
+
+    # Checks the program formulas `fmlas` against every example at once, with one query per batch. `hints` are
+    # (symbol, values) pairs, each standing for the equalities `symbol == values[i]` on every example i (see
+    # `concrete_subtrees`). Returns (result, core) where the core, if the result is unsat, is (the ids of the formulas,
+    # the positions of the hints, the positions of the examples) of the unsat core. If several batches are unsat, the
+    # core is the one of the batch with the first example.
+    def batch_check(self, fmlas: list, hints: list):
+        if not self.batches:
+            for i in range(len(self.spec)):
+                self.add_to_batch(i)
+        if not self.batches:  # No examples, nothing to conflict with
+            return (sat, None)
+        if self.expired():
+            return (unknown, None)
+        # The formulas are moved to the batches' contexts on this thread, then the batches are checked in parallel
+        queries = [b.prepare(fmlas, hints) for b in self.batches]
+        calls = sum(b.calls for b in self.batches)
+        if self.pool is None:
+            results = [self.batches[0].check(queries[0])]
+        else:
+            results = list(self.pool.map(lambda bq: bq[0].check(bq[1]), zip(self.batches, queries)))
+        self.calls += sum(b.calls for b in self.batches) - calls
+        cores = [r[1] for r in results if r[0] == unsat]
+        if len(cores) > 0:
+            (fmla_pos, hint_pos, examples) = min(cores, key=lambda c: min(c[2], default=-1))
+            return (unsat, (set(fmlas[j].get_id() for j in fmla_pos), hint_pos, examples))
+        if any(r[0] == unknown for r in results):
+            return (unknown, None)
+        return (sat, None)
+
+
+# Some of the examples of a spec, for batched conflict checks (see `SpecContext.batch_check`). The copy of a formula
+# for example i has its variables renamed to `<name>@<i>` (the inputs, 'ret_val', and the `v<id>` of the nodes), so
+# the copies share no variable and each one is checked on its own values. The copies of the examples and of the
+# program formulas are built once and cached, since the same formulas come back round after round.
+# A check asserts all the copies, without guards, in a fresh solver, and calls it once. Guards or scopes would be the
+# natural way to reuse a solver, but either one keeps Z3 from solving the equalities of the examples up front, and the
+# string solver then takes seconds on a few dozen copies that are solved in milliseconds otherwise. Only if the check
+# is unsat does a second call find the core, with a literal `f(<id>)@<i>` for the copy of a formula on the i-th example
+# (and `h(<j>)@<i>` for the j-th hint); a core is found fast, unlike a model under assumptions.
+# ('@' keeps the copies apart from the `v<id>_<j>` variables that `Semantics` gives to free inputs.)
+class ExampleBatch:
+    def __init__(self, spec: Spec, positions, context=None):
+        self.spec = spec
+        self.context = context  # A Z3 context of its own, or None for the main one
+        self.timeout = None
+        self.deadline = None
+        self.calls = 0
+        self.positions = []
+        self.io = []  # The copies of the examples, as (guard, copy, guarded copy)
+        self.io_all = None  # The conjunction of the copies
+        self.copies = {}  # Maps the id of a program formula (in the main context) to (its literal, its copies, guarded)
+        for i in positions:
+            self.add_example(i)
+
+    def set_timeout(self, timeout: int):
+        self.timeout = timeout
+
+    # The copy of a formula (in this batch's context) for the i-th example
+    def rename(self, fmla, i: int):
+        return substitute(fmla, [(c, Const(f"{c.decl().name()}@{i}", c.sort())) for c in free_consts(fmla)])
+
+    def add_example(self, i: int):
+        (env, output) = self.spec.examples[i]
+        io_ex = [to_z3_var(f"{x}@{i}", typ, self.context) == to_z3_val(env[x], self.context)
+                 for (x, typ) in self.spec.params]
+        io_ex.append(to_z3_var(f"ret_val@{i}", self.spec.ret_type, self.context) == to_z3_val(output, self.context))
+        g = Bool(f"bx({i})", self.context)
+        self.io.append((g, And(io_ex), Implies(g, And(io_ex))))
+        self.io_all = And([e[1] for e in self.io])
+        self.positions.append(i)
+
+    # The copies of a program formula for the examples of the batch, as (literal, conjunction, guarded conjunction)
+    def copy(self, fmla):
+        entry = self.copies.get(fmla.get_id())
+        if entry is None or entry[3] != len(self.positions):
+            here = fmla if self.context is None else fmla.translate(self.context)
+            lit = Bool(f"f({fmla.get_id()})", self.context)
+            conj = And([self.rename(here, i) for i in self.positions])
+            entry = (lit, conj, Implies(lit, conj), len(self.positions))
+            self.copies[fmla.get_id()] = entry
+        return entry[:3]
+
+    # Everything of a check that touches the main context. Returns the copies of the program formulas and those of the
+    # hints, each as (literal, conjunction, guarded conjunction).
+    def prepare(self, fmlas: list, hints: list):
+        query = ([self.copy(f) for f in fmlas], [])
+        for (j, (sym, values)) in enumerate(hints):
+            name = sym.decl().name()
+            eqs = []
+            for i in self.positions:
+                v = to_z3_val(values[i], self.context)
+                eqs.append(Const(f"{name}@{i}", v.sort()) == v)
+            lit = Bool(f"h({j})", self.context)
+            query[1].append((lit, And(eqs), Implies(lit, And(eqs))))
+        return query
+
+    def solver(self):
+        s = Solver(ctx=self.context)
+        s.set("timeout", time_left(self.timeout, self.deadline))
+        return s
+
+    # Runs a prepared check, and returns (result, core) as `SpecContext.batch_check` does, with the core's formulas
+    # given by position. Only touches this batch's context, so batches can be checked on separate threads.
+    def check(self, query):
+        parts = query[0] + query[1]
+        s = self.solver()
+        s.add(self.io_all)
+        s.add([q[1] for q in parts])
+        self.calls += 1
+        result = s.check()
+        if result != unsat:
+            return (result, None)
+        s = self.solver()
+        s.add([e[2] for e in self.io])
+        s.add([q[2] for q in parts])
+        self.calls += 1
+        if s.check([e[0] for e in self.io] + [q[0] for q in parts]) != unsat:  # Out of time
+            return (unknown, None)
+        core = set(c.get_id() for c in s.unsat_core())
+        fmlas = set(j for (j, q) in enumerate(query[0]) if q[0].get_id() in core)
+        hints = set(j for (j, q) in enumerate(query[1]) if q[0].get_id() in core)
+        examples = [i for (e, i) in zip(self.io, self.positions) if e[0].get_id() in core]
+        return (unsat, (fmlas, hints, examples))
@@ -0,0 +1,87 @@
+import json
+import time
+
+# The phases of a `synthesize` round that are timed. 'decide' includes 'consistency' (filtering the candidates), and
+# 'check_conflict' includes 'infer_spec' (building Phi_P) and 'abstract' (the abstract pre-filter, src/abstract.py).
+PHASES = ['decide', 'consistency', 'propagate', 'infer_spec', 'abstract', 'check_conflict', 'analyze']
+
+
+# Counters for one run of `synthesize`, filled in as the search goes. Used by the benchmark harness (src/bench.py).
+# `status` is one of:
+#   'solved'   - a complete program that satisfies the examples was found
+#   'unsat'    - the lemmas block every program
+#   'timeout'  - the wall-clock budget ran out
+#   'max_iter' - the iteration budget ran out
+#   'cancelled' - the caller asked the search to stop (see `cancel` in `synthesize`)
+class Stats:
+    def __init__(self):
+        self.status = None
+        self.rounds = 0
+        self.solver_calls = 0  # Every call to Z3, including those of conflict analysis
+        self.lemmas = 0
+        self.time = 0.0
+        self.conflict_checks = 0  # The solver calls of CHECK-CONFLICT alone
+        self.conflicts = 0
+        self.abstract = 0  # Conflicts found by abstract evaluation, without calling the solver
+        self.learned = 0  # Lemmas added to the knowledge base (`lemmas` is how many are left at the end)
+        self.evicted = 0
+        self.forced = 0  # Holes filled by propagation
+        self.restarts = 0
+        self.examples = 0  # Examples the conflicts were checked on (under CEGIS, fewer than the spec has)
+        self.phase_time = dict.fromkeys(PHASES, 0.0)
+        self.phase_calls = dict.fromkeys(PHASES, 0)
+
+    # Adds one call of a phase that started at the `time.perf_counter()` reading `start`
+    def timed(self, phase: str, start: float):
+        self.phase_time[phase] += time.perf_counter() - start
+        self.phase_calls[phase] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "rounds": self.rounds,
+            "solver_calls": self.solver_calls,
+            "lemmas": self.lemmas,
+            "time": self.time,
+            "conflict_checks": self.conflict_checks,
+            "conflicts": self.conflicts,
+            "abstract": self.abstract,
+            "learned": self.learned,
+            "evicted": self.evicted,
+            "forced": self.forced,
+            "restarts": self.restarts,
+            "examples": self.examples,
+            "phases": {p: {"calls": self.phase_calls[p], "time": self.phase_time[p]} for p in PHASES},
+        }
+
+    # A table of where the time went, one line per phase
+    def report(self) -> str:
+        lines = [f"{'phase':<16}{'calls':>8}{'time':>10}{'share':>8}"]
+        for p in PHASES:
+            share = self.phase_time[p] / self.time if self.time > 0 else 0.0
+            lines.append(f"{p:<16}{self.phase_calls[p]:>8}{self.phase_time[p]:>10.3f}{share:>8.1%}")
+        lines.append(f"{'total':<16}{self.rounds:>8}{self.time:>10.3f}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+
+# Trace levels. A trace at some level gets the events of that level and the ones below.
+TRACE_ROUND = 1  # One event per round (the decision, and whether it conflicted), plus conflicts, lemmas and restarts
+TRACE_DETAIL = 2  # Also the holes and the number of candidates of each decision, and the program after each round
+
+
+# A structured trace of a run, written as JSON lines to `stream`. Every event has the seconds since the trace started
+# ("t") and its name ("event"). The search only builds an event after checking `trace.level`, so a run without a trace
+# pays for nothing but that check.
+class Trace:
+    def __init__(self, stream, level: int = TRACE_ROUND):
+        self.stream = stream
+        self.level = level
+        self.start = time.perf_counter()
+
+    def emit(self, event: str, **fields):
+        record = {"t": round(time.perf_counter() - self.start, 6), "event": event}
+        record.update(fields)
+        self.stream.write(json.dumps(record, default=str) + "\n")
@@ -0,0 +1,40 @@
+import os
+from src.abstract import AbstractSemantics, covers
+from src.cache import load_problem
+from src.check_conflict import check_conflict
+from src.main import synthesize
+from src.semantics import Semantics
+from src.spec import SpecContext
+from tests.test_check_conflict import EXAMPLE5, make_program
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "src", "benchmarks", "PBE_Strings_2018_comp")
+
+
+# (str.++ (str.at fname ?) (str.at ? ?)) has at most 2 characters, whatever `fname` is, so `fname` isn't to blame
+def test_abstract_conflict_only_blames_its_core():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    (program, spec_cache) = make_program(grammar, ['str.++', 'str.at', 'str.at', 'fname'])
+    abstract = AbstractSemantics(Semantics(grammar))
+    (i, blamed) = abstract.conflict(program, spec.examples)
+    (at, fname) = (program.root.children[0], program.root.children[0].children[0])
+    assert blamed == {program.root.id, at.id, program.root.children[1].id}
+    (env, output) = spec.examples[i]
+    assert not covers(abstract.evaluate(program, env, forgotten={fname.id}), output)
+
+    ctx = SpecContext(spec, 0)
+    kappa = check_conflict(program, ctx, spec_cache, abstract=abstract)
+    assert set(t[2] for t in kappa) == blamed
+    assert ctx.calls == 0
+    # The solver finds the conflict too
+    ctx = SpecContext(spec, 0)
+    assert len(check_conflict(program, ctx, spec_cache)) > 0
+    assert ctx.calls > 0
+
+
+# The pre-filter only saves solver calls: the search finds the same program with or without it
+def test_no_abstract_finds_the_same_solution():
+    for path in (EXAMPLE5, os.path.join(BENCHMARKS, "univ_1_short.sl")):
+        (grammar, spec) = load_problem(path, directory="")
+        results = [synthesize(200, grammar, spec, abstract=abstract) for abstract in (True, False)]
+        assert [stats.status for (_, stats) in results] == ["solved", "solved"]
+        assert results[0][0].to_program() == results[1][0].to_program()
@@ -0,0 +1,32 @@
+import os
+import time
+import src.bench
+from src.bench import GRACE, run_one
+
+PHONE = os.path.join(os.path.dirname(__file__), "..", "src", "benchmarks", "PBE_Strings_2018_comp", "phone.sl")
+
+
+# An in-process run has no worker to kill, so the search itself has to stop at its budget. phone.sl used to take 28s
+# against 3s, inside solver calls that each had the whole budget.
+def test_in_process_run_stops_within_its_budget(monkeypatch):
+    monkeypatch.setenv("SYNTH_CACHE_DIR", "")  # No cache
+    for options in ({}, {"cegis": False}):
+        start = time.perf_counter()
+        result = run_one(PHONE, 1000, 1.0, options=options)
+        assert result["status"] == "timeout"
+        assert time.perf_counter() - start < 1.0 + GRACE
+        assert result["time"] < 1.0 + GRACE
+
+
+# A run that ends past the grace period counts as a timeout, as if its worker had been killed
+def test_in_process_run_past_the_grace_period_is_a_timeout(monkeypatch):
+    def slow_solve(grammar, spec, stats=None, **options):
+        time.sleep(0.3)
+        stats.status = "solved"
+        return None
+    monkeypatch.setattr(src.bench, "solve", slow_solve)
+    monkeypatch.setattr(src.bench, "GRACE", 0.1)
+    monkeypatch.setenv("SYNTH_CACHE_DIR", "")
+    result = run_one(PHONE, 10, 0.1)
+    assert result["status"] == "timeout"
+    assert not result["solved"]
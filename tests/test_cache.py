@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import time
+from src.cache import FORMAT_VERSION, STALE_TMP, entry_name, evict, load_problem, source_digest
+
+EXAMPLE5 = os.path.join(os.path.dirname(__file__), "..", "src", "examples", "example5.sl")
+
+
+def touch(directory, name: str) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x")
+    return path
+
+
+# SYNTH_CACHE_DIR can point anywhere, so eviction only removes the files the cache itself writes
+def test_evict_only_removes_cache_files(tmp_path):
+    digest = "0" * 64
+    current = touch(tmp_path, entry_name(digest))
+    stale = [touch(tmp_path, f"{digest}.v{FORMAT_VERSION - 1}.pickle")]
+    foreign = [touch(tmp_path, name) for name in ("model.pickle", "notes.tmp", "abc.v1.pickle", f"{digest}.pickle")]
+    evict(str(tmp_path))
+    assert os.path.exists(current)
+    assert not any(os.path.exists(p) for p in stale)
+    assert all(os.path.exists(p) for p in foreign)
+
+
+# Another run may be writing an entry through its temporary file: only the ones whose writer is gone are removed
+def test_evict_keeps_the_temporary_files_of_running_writers(tmp_path):
+    name = entry_name("1" * 64)
+    gone = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead = touch(tmp_path, f"{name}.{int(gone.stdout)}.tmp")
+    writing = touch(tmp_path, f"{name}.{os.getpid()}.tmp")
+    old = touch(tmp_path, f"{entry_name('2' * 64)}.{os.getpid()}.tmp")
+    past = time.time() - 2 * STALE_TMP
+    os.utime(old, (past, past))
+    evict(str(tmp_path))
+    assert os.path.exists(writing)
+    assert not os.path.exists(dead)
+    assert not os.path.exists(old)
+
+
+def test_a_cached_problem_loads_like_a_parsed_one(tmp_path):
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    for _ in range(2):  # A miss, then a hit
+        (cached_grammar, cached_spec) = load_problem(EXAMPLE5, directory=str(tmp_path))
+        assert cached_grammar == grammar
+        assert cached_spec.examples == spec.examples
+        assert cached_spec.params == spec.params
+    with open(EXAMPLE5) as f:
+        assert os.path.exists(os.path.join(tmp_path, entry_name(source_digest(f.read()))))
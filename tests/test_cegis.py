@@ -0,0 +1,40 @@
+import io
+import json
+import os
+from src.cache import load_problem
+from src.interpreter import run_examples
+from src.main import synthesize
+from src.stats import Trace
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "src", "benchmarks", "PBE_Strings_2018_comp")
+
+
+def load(name: str):
+    return load_problem(os.path.join(BENCHMARKS, name), directory="")  # No cache
+
+
+def run_traced(name: str, max_iter: int, **options):
+    (grammar, spec) = load(name)
+    stream = io.StringIO()
+    (program, stats) = synthesize(max_iter, grammar, spec, trace=Trace(stream), **options)
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    return (program, stats, events)
+
+
+# A counterexample can make an earlier partial program infeasible without involving the last decision. The search
+# used to learn nothing from such a conflict, go back one level, and make the same decision again until max_iter.
+# (The rounds are the same with batched checks, which answer these queries faster.)
+def test_counterexample_conflicts_always_learn():
+    (program, stats, events) = run_traced("univ_2_short.sl", 150, batch=1)
+    assert any(e["event"] == "counterexample" for e in events)
+    assert [e for e in events if e["event"] == "lemmas" and len(e["lemmas"]) == 0] == []
+    assert stats.status in ("solved", "unsat", "max_iter")
+    assert stats.learned > 0
+
+
+def test_cegis_finds_a_solution_every_example_accepts():
+    (grammar, spec) = load("univ_1_short.sl")
+    for options in ({}, {"lemma_policy": 'core', "backjump": True}):
+        (program, stats) = synthesize(200, grammar, spec, **options)
+        assert stats.status == "solved"
+        assert run_examples(program, spec.examples)
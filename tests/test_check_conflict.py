@@ -0,0 +1,62 @@
+import os
+from z3 import unknown
+from src.ast import AST
+from src.cache import load_problem
+from src.check_conflict import check_conflict
+from src.semantics import Semantics, SpecCache
+from src.spec import SpecContext
+
+EXAMPLE5 = os.path.join(os.path.dirname(__file__), "..", "src", "examples", "example5.sl")
+
+
+# The production of a non-terminal with the given operator
+def prod(grammar, nt: str, op):
+    return next(p for p in grammar[2][nt] if p[0] == op)
+
+
+# A program of example 5, filled top-down (breadth first) with the given operators
+def make_program(grammar, ops: list):
+    program = AST(grammar)
+    program.root = program.make_root()
+    spec = SpecCache(program, Semantics(grammar))
+    for op in ops:
+        h = program.holes()[0]
+        program.fill(h.id, prod(grammar, h.non_terminal, op))
+    return (program, spec)
+
+
+def test_unknown_is_not_remembered_as_feasible():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    (program, spec_cache) = make_program(grammar, ['str.++'])
+    for batch in (0, 1):
+        ctx = SpecContext(spec, batch)
+        ctx.check = lambda i, fmlas: unknown
+        ctx.batch_check = lambda fmlas, hints: (unknown, None)
+        assert check_conflict(program, ctx, spec_cache) == set()
+        assert ctx.inconclusive
+        assert len(ctx.feasible) == 0
+
+
+# `int.to.str` of a string can't be run, and the solver would only find it consistent through a free input
+def test_a_program_that_cant_be_run_is_never_accepted():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    (program, spec_cache) = make_program(grammar, ['int.to.str', 'fname'])
+    assert program.is_concrete()
+    for batch in (0, 1):
+        ctx = SpecContext(spec, batch)
+        kappa = check_conflict(program, ctx, spec_cache)
+        assert set(t[2] for t in kappa) == {program.root.id, program.root.children[0].id}
+        assert ctx.failures == list(range(len(spec)))
+        assert ctx.calls == 0
+
+
+# The batched query can give up on formulas the per-example solver decides at once, which then still finds the conflict
+def test_an_unknown_batched_check_falls_back_to_one_example_at_a_time():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    (program, spec_cache) = make_program(grammar, ['str.at', 'fname'])
+    ctx = SpecContext(spec, 1)
+    ctx.batch_check = lambda fmlas, hints: (unknown, None)
+    kappa = check_conflict(program, ctx, spec_cache)
+    assert program.root.id in set(t[2] for t in kappa)
+    assert not ctx.inconclusive
+    assert ctx.failures == [0]
@@ -0,0 +1,16 @@
+import os
+from src.ast import AST
+from src.cache import load_problem
+from src.compact_ast import CompactAST
+from src.main import synthesize
+
+EXAMPLE5 = os.path.join(os.path.dirname(__file__), "..", "src", "examples", "example5.sl")
+
+
+# `--ast compact` only changes how the program is stored, so the search takes the same steps
+def test_compact_ast_finds_the_same_solution():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    results = [synthesize(100, grammar, spec, program_cls=cls) for cls in (AST, CompactAST)]
+    assert [stats.status for (_, stats) in results] == ["solved", "solved"]
+    assert results[0][0].to_program() == results[1][0].to_program()
+    assert results[0][1].rounds == results[1][1].rounds
@@ -0,0 +1,56 @@
+from src.lemma import GLUE, Lemma, LemmaDB
+
+
+# Records what the database tells its listeners, as the propagator would see it
+class Listener:
+    def __init__(self, db: LemmaDB):
+        self.lemmas = []
+        db.listeners.append(self)
+
+    def added(self, lemma: Lemma):
+        self.lemmas.append(lemma)
+
+    def dropped(self, lemma: Lemma):
+        self.lemmas.remove(lemma)
+
+
+def test_a_subsumed_lemma_is_not_added():
+    db = LemmaDB()
+    general = Lemma({1: {'f', 'g'}, 2: {'a'}})
+    assert db.add(general)
+    assert not db.add(Lemma({1: {'f'}, 2: {'a'}, 3: {'b'}}))  # Blocks fewer programs
+    assert not db.add(Lemma({1: {'f'}, 2: {'a'}}))
+    assert not db.add(Lemma({1: {'f', 'g'}, 2: {'a'}}))  # A duplicate
+    assert list(db) == [general]
+
+
+def test_a_new_lemma_removes_the_ones_it_subsumes():
+    db = LemmaDB()
+    listener = Listener(db)
+    specific = [Lemma({1: {'f'}, 2: {'a'}, 3: {'b'}}), Lemma({1: {'g'}, 2: {'a'}}), Lemma({1: {'f'}, 4: {'a'}})]
+    for l in specific:
+        assert db.add(l)
+    general = Lemma({1: {'f', 'g'}, 2: {'a'}})
+    assert db.add(general)
+    assert list(db) == [specific[2], general]  # The last one has a node that the new lemma doesn't
+    assert listener.lemmas == list(db)
+    assert db.blocked_literals({1: 'g'}) == {(2, 'a')}  # The index has no trace of the removed lemmas
+    assert db.blocked_literals({1: 'f', 3: 'b'}) == {(2, 'a'), (4, 'a')}
+
+
+# Reducing evicts the least active lemmas, but keeps the glue lemmas (a low LBD) even when they are the least active
+def test_reduce_keeps_low_lbd_lemmas():
+    db = LemmaDB(cap=4)
+    listener = Listener(db)
+    glue = Lemma({1: {'a'}, 11: {'b'}})
+    db.add(glue, GLUE)
+    others = [Lemma({i: {'a'}, i + 10: {'b'}}) for i in range(2, 6)]
+    for l in others:
+        db.decay_activity()  # Later lemmas are bumped by more, as after more conflicts
+        db.add(l, GLUE + 3)
+        if l is others[0]:
+            for _ in range(10):
+                db.bump(l)  # E.g., it blocked many candidates
+    assert db.evicted == 3
+    assert set(db) == {glue, others[0]}
+    assert set(listener.lemmas) == set(db)
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from src.ast import AST
+from src.cache import load_problem
+from src.lemma import Lemma
+from src.main import backjump_level, luby, synthesize
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "src", "benchmarks", "PBE_Strings_2018_comp")
+
+
+# Without a time limit, one check of phone.sl runs for minutes: a cancel has to interrupt it, not wait for the next
+# round
+def test_cancel_interrupts_the_running_check():
+    (grammar, spec) = load_problem(os.path.join(BENCHMARKS, "phone.sl"), directory="")
+    cancel = threading.Event()
+    timer = threading.Timer(0.5, cancel.set)
+    timer.start()
+    start = time.perf_counter()
+    (program, stats) = synthesize(1000, grammar, spec, cegis=False, cancel=cancel)
+    timer.cancel()
+    assert stats.status == "cancelled"
+    assert time.perf_counter() - start < 2.0
+
+
+def test_luby():
+    assert [luby(i) for i in range(15)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
+    assert luby(30) == 16
+
+
+# S -> (f A A) | x, A -> (g A A) | a | b
+GRAMMAR = (["S", "A"], ["f", "g", "x", "a", "b"],
+           {"S": [("f", ["A", "A"]), ("x", [])], "A": [("g", ["A", "A"]), ("a", []), ("b", [])]}, "S",
+           {"S": "String", "A": "String"})
+
+
+# Four decisions, one per level: (f ? ?), (f (g ? ?) ?), (f (g ? ?) a), (f (g a ?) a)
+def four_levels():
+    program = AST(GRAMMAR)
+    program.root = program.make_root()
+    (f, g, a) = (GRAMMAR[2]["S"][0], GRAMMAR[2]["A"][0], GRAMMAR[2]["A"][1])
+    program.new_level()
+    program.fill(program.root.id, f)
+    (left, right) = (c.id for c in program.root.children)
+    program.new_level()
+    program.fill(left, g)
+    program.new_level()
+    program.fill(right, a)
+    grandchild = program.search(left).children[0].id
+    program.new_level()
+    program.fill(grandchild, a)
+    return (program, left, right, grandchild)
+
+
+def test_backjump_level():
+    (program, left, right, grandchild) = four_levels()
+    # With the last decision: undo it, and the level 3 decision that has no part in the conflict
+    with_last = Lemma({left: {'g'}, grandchild: {'a'}})
+    assert backjump_level(program, [with_last]) == 2
+    # Without the last decision (e.g., after a counterexample): go back to where `right` is the only node to undo
+    without_last = Lemma({program.root.id: {'f'}, right: {'a'}})
+    assert backjump_level(program, [without_last]) == 1
+    assert backjump_level(program, [with_last, without_last]) == 2  # The deepest level either lemma allows
+    for (lemma, level) in ((with_last, 2), (without_last, 1)):
+        (program, left, right, grandchild) = four_levels()
+        program.backtrack(level)
+        (n_missing, missing) = lemma.missing(program.assignment())
+        assert n_missing == 1 and program.search(missing).is_hole()  # Its node is pruned right away
+    # A lemma with a node that isn't filled says nothing about the decisions: go back one level
+    assert backjump_level(program, [Lemma({right: {'b'}, 99: {'a'}})]) == program.decision_level() - 1
+
+
+# `solver_calls` counts every call to Z3, `conflict_checks` only those of CHECK-CONFLICT, without the many short
+# checks of the 'generalize' analysis
+def test_conflict_checks_are_counted_apart_from_the_other_solver_calls():
+    (grammar, spec) = load_problem(os.path.join(os.path.dirname(__file__), "..", "src", "examples", "example5.sl"),
+                                   directory="")
+    (program, stats) = synthesize(100, grammar, spec, lemma_policy='decision')
+    assert 0 < stats.conflict_checks == stats.solver_calls
+    (program, stats) = synthesize(100, grammar, spec, lemma_policy='generalize')
+    assert 0 < stats.conflict_checks < stats.solver_calls
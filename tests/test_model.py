@@ -0,0 +1,23 @@
+import os
+import pickle
+from src.ast import AST
+from src.cache import load_problem
+from src.model import Model
+
+EXAMPLE5 = os.path.join(os.path.dirname(__file__), "..", "src", "examples", "example5.sl")
+
+
+# The grammar of a problem read from the cache, or in a pool worker, is a copy of the one the model was compiled for
+def test_scores_match_on_a_copy_of_the_grammar():
+    (grammar, spec) = load_problem(EXAMPLE5, directory="")
+    model = Model().train([["str.++", ["fname", ["str.++", ["\" \"", "lname"]]]]])
+    table = model.compile(grammar)
+    copy = pickle.loads(pickle.dumps(grammar))
+    program = AST(copy)
+    program.root = program.make_root()
+    h = program.root
+    candidates = [(h, p) for p in copy[2][h.non_terminal]]
+    scores = list(table.scores(program, candidates))
+    assert scores == list(model.compile(copy).scores(program, candidates))
+    best = max(range(len(candidates)), key=lambda j: scores[j])
+    assert candidates[best][1][0] == 'str.++'
@@ -0,0 +1,66 @@
+from src.parser import input_to_list, read_problem, tokenize, unquote
+
+V1 = '''(set-logic SLIA)
+(synth-fun f ((name String)) String
+    ((Start String (ntString))
+     (ntString String (name " " (str.++ ntString ntString) (str.at ntString ntInt)))
+     (ntInt Int (0 1 (str.len ntString)))))
+(declare-var name String)
+(constraint (= (f "Nancy FreeHafer") "N"))  ; a trailing comment
+(check-synth)
+'''
+
+V2 = '''(set-logic PBE_SLIA)
+(synth-fun f ((fname String) (lname String)) String
+    ((ntString String) (ntInt Int))
+    ((ntString String (fname lname " " (str.++ ntString ntString) (str.at ntString ntInt)))
+     (ntInt Int (0 1 (str.len ntString)))))
+(constraint (= (f "Nancy" "FreeHafer") "Nancy FreeHafer"))
+(check-synth)
+'''
+
+
+def test_string_literals_are_single_tokens():
+    assert tokenize('(f "Nancy FreeHafer")') == ['(', 'f', '"Nancy FreeHafer"', ')']
+    assert tokenize('"a (b) c"') == ['"a (b) c"']
+    assert tokenize('""') == ['""']
+
+
+def test_comments_are_dropped_but_not_inside_strings():
+    assert tokenize('(f "a;b") ; (g "c")') == ['(', 'f', '"a;b"', ')']
+    assert tokenize('; a whole line\nx') == ['x']
+    assert input_to_list('(a "b ; c") ; d\n(e)') == [['a', '"b ; c"'], ['e']]
+
+
+def test_escapes():
+    assert tokenize('"say ""hi"""') == ['"say ""hi"""']
+    assert unquote('"say ""hi"""') == 'say "hi"'
+    assert unquote('""') == ''
+    assert unquote('""""') == '"'
+    assert unquote('"\\u{48}i \\u{1F600} \\u0041"') == 'Hi \U0001F600 A'
+
+
+def test_a_string_literal_can_span_lines():
+    assert tokenize('(f "first\nsecond")\n(g)') == ['(', 'f', '"first\nsecond"', ')', '(', 'g', ')']
+    assert tokenize(['(f "a\n', ';not a comment\n', 'b")']) == ['(', 'f', '"a\n;not a comment\nb"', ')']
+
+
+# SyGuS v1 gives the rules alone, the first one for the start symbol; v2 declares the non-terminals first
+def test_v1_and_v2_grammars():
+    (grammar, spec) = read_problem(V1)
+    (non_terminals, terminals, productions, start, types) = grammar
+    assert start == 'Start'
+    assert non_terminals == ['Start', 'ntString', 'ntInt']
+    assert types == {'Start': 'String', 'ntString': 'String', 'ntInt': 'Int'}
+    assert productions['Start'] == productions['ntString']  # The chain rule `Start -> ntString` is inlined
+    assert [p[0] for p in productions['ntString']] == ['name', '" "', 'str.++', 'str.at']
+    assert terminals == ['name', '" "', 'str.++', 'str.at', 0, 1, 'str.len']  # In the order of the file
+    assert spec.examples == [({'name': 'Nancy FreeHafer'}, 'N')]
+
+    (grammar, spec) = read_problem(V2)
+    (non_terminals, terminals, productions, start, types) = grammar
+    assert start == 'ntString'
+    assert non_terminals == ['ntString', 'ntInt']
+    assert productions['ntString'][3] == ('str.++', ['ntString', 'ntString'])
+    assert spec.params == [('fname', 'String'), ('lname', 'String')]
+    assert spec.examples == [({'fname': 'Nancy', 'lname': 'FreeHafer'}, 'Nancy FreeHafer')]
@@ -0,0 +1,31 @@
+import queue
+from src.analyze_conflict import core_analyze_conflict, naive_analyze_conflict
+from src.lemma import Lemma
+from src.portfolio import LemmaExchange
+
+
+class Hole:
+    def __init__(self, id: int):
+        self.id = id
+
+
+# kappa: (formula, template, node id, operator) for nodes 1 and 2, where node 2 was the last decision
+KAPPA = {(None, None, 1, 'str.++'), (None, None, 2, 'fname')}
+
+
+def sent(lemmas: list) -> list:
+    inboxes = [queue.Queue(), queue.Queue()]
+    LemmaExchange(0, inboxes).send(lemmas)
+    return [] if inboxes[1].empty() else inboxes[1].get_nowait()
+
+
+# The 'decision' policy blocks `fname` at node 2 under any parent, which the spec doesn't imply; a 'core' or
+# 'generalize' search that received it could miss its solution
+def test_only_sound_lemmas_are_shared():
+    naive = naive_analyze_conflict(None, KAPPA, Hole(2))
+    core = core_analyze_conflict(None, KAPPA, Hole(2))
+    assert naive == [Lemma({2: {'fname'}})] and naive[0].local
+    assert not core[0].local
+    assert sent(naive) == []
+    assert sent(naive + core) == core
+    assert sent([Lemma({1: {'a'}, 2: {'b'}, 3: {'c'}})]) == []  # Too long to share
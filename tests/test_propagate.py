@@ -0,0 +1,73 @@
+from src.ast import AST
+from src.lemma import Lemma, LemmaDB
+from src.propagate import Propagator
+
+# S -> (f A A) | x, A -> a | b. The root is node 1 and its children are 2 and 3 (see `label`).
+GRAMMAR = (["S", "A"], ["f", "x", "a", "b"], {"S": [("f", ["A", "A"]), ("x", [])], "A": [("a", []), ("b", [])]}, "S",
+           {"S": "String", "A": "String"})
+F = GRAMMAR[2]["S"][0]
+A = GRAMMAR[2]["A"][0]
+B = GRAMMAR[2]["A"][1]
+
+
+def setup(lemmas: list):
+    program = AST(GRAMMAR)
+    program.root = program.make_root()
+    omega = LemmaDB()
+    prop = Propagator(program, omega)
+    for l in lemmas:
+        omega.add(l)
+    assert prop.propagate(program) is None
+    return (program, prop)
+
+
+# Fills a hole at a new decision level, and propagates
+def decide(program: AST, prop: Propagator, id: int, p):
+    program.new_level()
+    program.fill(id, p)
+    return prop.propagate(program)
+
+
+def ops(prop: Propagator, program: AST, id: int) -> list:
+    return [p[0] for p in prop.candidates(program.search(id))]
+
+
+# The lemma watches two of its nodes, and prunes `b` from node 3 once nodes 1 and 2 take their ops. The pruning depends
+# on the fill of node 2, and goes away with it; the watches are still in place, so it comes back with the fill.
+def test_backtracking_restores_a_pruned_domain():
+    (program, prop) = setup([Lemma({1: {'f'}, 2: {'a'}, 3: {'b'}})])
+    assert decide(program, prop, 1, F) is None
+    assert ops(prop, program, 3) == ['a', 'b']
+    assert decide(program, prop, 2, A) is None
+    assert program.assignment() == {1: 'f', 2: 'a', 3: 'a'}  # Forced: 'a' was the only op left
+    assert prop.forced == 1
+    program.backtrack(1)
+    assert program.assignment() == {1: 'f'}
+    assert ops(prop, program, 3) == ['a', 'b']
+    assert decide(program, prop, 2, A) is None
+    assert program.assignment()[3] == 'a'
+
+
+# A lemma over node 1 and node 2 is unit once node 1 is filled, and a lemma over node 2 alone is from the start: either
+# way node 2 is left with `b` as soon as it exists, and is filled with it
+def test_a_unit_lemma_forces_a_fill():
+    for lemma in (Lemma({1: {'f'}, 2: {'a'}}), Lemma({2: {'a'}})):
+        (program, prop) = setup([lemma])
+        assert decide(program, prop, 1, F) is None
+        assert program.assignment() == {1: 'f', 2: 'b'}
+        assert program.decision_level() == 1  # At the level of the decision
+        assert prop.forced == 1
+        program.backtrack(0)
+        assert ops(prop, program, 1) == ['f', 'x']
+
+
+# Node 2 loses `a` to a lemma that depends on node 1, and `b` to a lemma over node 2 alone. The reason for the empty
+# domain is the fill of node 1, which the lemma that explains the conflict blocks.
+def test_explain_gives_the_reason_of_an_empty_domain():
+    (program, prop) = setup([Lemma({1: {'f'}, 2: {'a'}}), Lemma({2: {'b'}})])
+    conflict = decide(program, prop, 1, F)
+    assert conflict == Lemma({1: {'f'}})
+    assert conflict.is_violated(program.assignment())
+    assert not conflict.local
+    (program, prop) = setup([Lemma({1: {'f'}, 2: {'a'}}, local=True), Lemma({2: {'b'}})])
+    assert decide(program, prop, 1, F).local  # Made of a local lemma
@@ -0,0 +1,77 @@
+import time
+from z3 import String, sat, unknown, unsat
+from src.spec import UINT_MAX, Spec, SpecContext, time_left
+
+# f(x) = x holds on the examples with an even position, and fails on the odd ones
+EXAMPLES = [({"x": "a"}, "a"), ({"x": "b"}, "bb"), ({"x": "c"}, "c"), ({"x": "d"}, "dd"), ({"x": "e"}, "e"),
+            ({"x": "f"}, "ff")]
+IDENTITY = String("ret_val") == String("x")
+
+
+def make_spec(examples: list) -> Spec:
+    spec = Spec("f", [("x", "String")], "String")
+    for ex in examples:
+        spec.add_example(ex)
+    return spec
+
+
+# Under CEGIS the context starts with one example, and the rest come one at a time
+def test_batches_spread_examples_added_later():
+    ctx = SpecContext(make_spec(EXAMPLES[:1]), batch=4)
+    assert ctx.batch_check([IDENTITY], [])[0] == sat
+    for ex in EXAMPLES[1:]:
+        ctx.add_example(ex)
+    assert [b.positions for b in ctx.batches] == [[0, 4], [1, 5], [2], [3]]
+    assert ctx.pool is not None
+
+
+def test_batches_split_the_examples_given_up_front():
+    ctx = SpecContext(make_spec(EXAMPLES), batch=4)
+    ctx.batch_check([IDENTITY], [])
+    assert [b.positions for b in ctx.batches] == [[0, 4], [1, 5], [2], [3]]
+
+
+# The examples of a batched core are positions in the spec, and only ones the formulas conflict with
+def test_batched_core_maps_back_to_the_examples():
+    for batch in (1, 2, 4):
+        ctx = SpecContext(make_spec(EXAMPLES), batch=batch)
+        (result, core) = ctx.batch_check([IDENTITY], [])
+        assert result == unsat
+        (fmla_ids, hint_pos, examples) = core
+        assert fmla_ids == {IDENTITY.get_id()}
+        assert len(examples) > 0 and set(examples) <= {1, 3, 5}
+        assert hint_pos == set()
+
+
+# A hint `v == values[i]` is blamed through its position, on the examples where it conflicts
+def test_batched_core_blames_hints():
+    v = String("v1")
+    ctx = SpecContext(make_spec(EXAMPLES), batch=2)
+    values = [ex[1] for ex in EXAMPLES]
+    values[2] = "z"  # Only wrong on the third example
+    (result, core) = ctx.batch_check([String("ret_val") == v], [(v, values)])
+    assert result == unsat
+    (fmla_ids, hint_pos, examples) = core
+    assert hint_pos == {0}
+    assert examples == [2]
+
+
+# A check never gets more time than is left before the deadline
+def test_time_left_is_cut_to_the_deadline():
+    assert time_left(None, None) == UINT_MAX
+    assert time_left(500, None) == 500
+    assert 1000 <= time_left(None, time.perf_counter() + 2.0) <= 2000
+    assert time_left(500, time.perf_counter() + 2.0) == 500
+    assert time_left(500, time.perf_counter() - 1.0) == 1
+
+
+# Past the deadline, checks are unknown without calling the solver
+def test_no_check_runs_past_the_deadline():
+    for batch in (0, 1):
+        ctx = SpecContext(make_spec(EXAMPLES), batch=batch)
+        ctx.set_deadline(time.perf_counter() - 1.0)
+        assert ctx.check(1, [IDENTITY]) == unknown
+        assert ctx.quick_check(1, [IDENTITY], 100) == unknown
+        if batch > 0:
+            assert ctx.batch_check([IDENTITY], [])[0] == unknown
+        assert ctx.calls == 0